@@ -0,0 +1,362 @@
+#!/usr/bin/env python3
+"""
+Parallel, resumable batch TTS generation.
+
+Covers three kinds of work:
+  paragraphs  one clip per paragraph (audios/audio_book_tts/chunk_<id>_tts.mp3),
+              the same file the shadowing page's "Generate TTS" button writes
+  groups      one clip per paragraphs.audio_path group (<stem>_tts.mp3), the
+              legacy whole-chapter layout of generate_shadowing_tts.py
+  oxford      oxford_words formal/informal example sentences
+              (audios/audios_tts_sentences/<id>_<type>.mp3)
+
+Requests run on a bounded thread pool behind a token-bucket rate limiter and
+are retried with exponential backoff on throttling/5xx/network errors.
+Finished tasks are checkpointed in the tts_batch_progress table so a rerun
+resumes where the previous one stopped.
+
+Usage:
+  python batch_tts.py --scope paragraphs,oxford --workers 4 --rate 2
+  python batch_tts.py --dry-run
+"""
+import argparse
+import os
+import pathlib
+import random
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import requests
+
+from generate_shadowing_tts import (
+    DB_PATH,
+    PROJECT_ROOT,
+    AUDIO_OUTPUT_DIR,
+    TTS_MODEL,
+    TTS_FORMAT,
+    DEFAULT_VOICE,
+    DEFAULT_SPEED,
+    synthesize_to_file,
+)
+from http_client import HTTPClient
+from tts_cache import tts_cache, cache_key, _stored_path
+
+SENTENCE_AUDIO_DIR = pathlib.Path(os.environ.get("FGL_AUDIO_DIR", PROJECT_ROOT / "audios")) / "audios_tts_sentences"
+SCOPES = ("paragraphs", "groups", "oxford")
+RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+
+# No transport-level retries: run_task decides every retry, so each attempt
+# goes through the token bucket and counts against --retries
+batch_http_client = HTTPClient(retries=0)
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS tts_batch_progress (
+        task_key TEXT PRIMARY KEY,
+        kind TEXT NOT NULL,
+        status TEXT NOT NULL,
+        output_path TEXT,
+        text_chars INTEGER,
+        attempts INTEGER DEFAULT 0,
+        cached INTEGER DEFAULT 0,
+        error TEXT,
+        updated_at TEXT DEFAULT CURRENT_TIMESTAMP
+    );
+"""
+
+
+class TokenBucket:
+    """Allows `rate` acquisitions per second on average, with bursts up to `capacity`."""
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if self.rate <= 0:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class Task:
+    def __init__(self, key, kind, text, output_path, update_sql, update_params):
+        self.key = key
+        self.kind = kind
+        self.text = text
+        self.output_path = pathlib.Path(output_path)
+        self.update_sql = update_sql
+        self.update_params = update_params
+
+    @property
+    def db_path(self):
+        return _stored_path(self.output_path)
+
+
+def _exists(rel_path):
+    return bool(rel_path) and (PROJECT_ROOT / rel_path).exists()
+
+
+def collect_tasks(conn, scopes, force=False):
+    tasks = []
+
+    if "paragraphs" in scopes:
+        rows = conn.execute(
+            "SELECT id, content, tts_audio_path FROM paragraphs WHERE content IS NOT NULL AND TRIM(content) != '' ORDER BY id"
+        ).fetchall()
+        for row in rows:
+            if not force and _exists(row["tts_audio_path"]):
+                continue
+            output = AUDIO_OUTPUT_DIR / f"chunk_{row['id']}_tts.mp3"
+            tasks.append(Task(
+                f"paragraph:{row['id']}", "paragraph", row["content"], output,
+                "UPDATE paragraphs SET tts_audio_path = ? WHERE id = ?", (row["id"],)
+            ))
+
+    if "groups" in scopes:
+        groups = conn.execute(
+            "SELECT DISTINCT audio_path FROM paragraphs WHERE audio_path IS NOT NULL ORDER BY audio_path"
+        ).fetchall()
+        for group in groups:
+            audio_path = group["audio_path"]
+            output = AUDIO_OUTPUT_DIR / f"{pathlib.Path(audio_path).stem}_tts.mp3"
+            if not force and output.exists():
+                continue
+            rows = conn.execute(
+                "SELECT content FROM paragraphs WHERE audio_path = ? ORDER BY id", (audio_path,)
+            ).fetchall()
+            text = " ".join(r["content"] for r in rows if r["content"])
+            if not text.strip():
+                continue
+            tasks.append(Task(
+                f"group:{audio_path}", "group", text, output,
+                "UPDATE paragraphs SET tts_audio_path = ? WHERE audio_path = ?", (audio_path,)
+            ))
+
+    if "oxford" in scopes:
+        rows = conn.execute(
+            "SELECT id, word, pos, level, sentence_formal, sentence_informal, audio_formal_path, audio_informal_path "
+            "FROM oxford_words WHERE id IS NOT NULL ORDER BY id"
+        ).fetchall()
+        for row in rows:
+            for speech_type in ("formal", "informal"):
+                sentence = row[f"sentence_{speech_type}"]
+                if not sentence or not sentence.strip():
+                    continue
+                if not force and _exists(row[f"audio_{speech_type}_path"]):
+                    continue
+                output = SENTENCE_AUDIO_DIR / f"{int(row['id']):04d}_{speech_type}.mp3"
+                tasks.append(Task(
+                    f"oxford:{row['id']}:{speech_type}", f"oxford_{speech_type}", sentence, output,
+                    f"UPDATE oxford_words SET audio_{speech_type}_path = ? WHERE word = ? AND pos = ? AND level = ?",
+                    (row["word"], row["pos"], row["level"])
+                ))
+
+    return tasks
+
+
+def completed_keys(conn):
+    return {row["task_key"] for row in conn.execute("SELECT task_key FROM tts_batch_progress WHERE status = 'done'")}
+
+
+def run_task(task, bucket, max_retries, voice, speed):
+    """Synthesize one task with retries. Returns (cached, attempts)."""
+    attempt = 0
+    while True:
+        attempt += 1
+        key = cache_key(task.text, voice, speed, TTS_MODEL, TTS_FORMAT)
+        if not tts_cache.contains(key):
+            bucket.acquire()
+        try:
+            cached = synthesize_to_file(task.text, task.output_path, voice=voice, speed=speed,
+                                        client=batch_http_client)
+            return cached, attempt
+        except requests.HTTPError as e:
+            status = e.response.status_code if e.response is not None else None
+            if status not in RETRYABLE_STATUS or attempt > max_retries:
+                raise
+            retry_after = e.response.headers.get("Retry-After") if e.response is not None else None
+        except (requests.ConnectionError, requests.Timeout):
+            if attempt > max_retries:
+                raise
+            retry_after = None
+
+        delay = min(60.0, 2 ** (attempt - 1)) * (0.5 + random.random())
+        if retry_after:
+            try:
+                delay = max(delay, float(retry_after))
+            except ValueError:
+                pass
+        print(f"  Retry {attempt}/{max_retries} for {task.key} in {delay:.1f}s")
+        time.sleep(delay)
+
+
+def format_duration(seconds):
+    seconds = int(seconds)
+    hours, rest = divmod(seconds, 3600)
+    minutes, seconds = divmod(rest, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}" if hours else f"{minutes:02d}:{seconds:02d}"
+
+
+def dry_run(tasks, voice, speed, rate):
+    chars = sum(len(t.text) for t in tasks)
+    cached = [t for t in tasks if tts_cache.contains(cache_key(t.text, voice, speed, TTS_MODEL, TTS_FORMAT))]
+    requests_needed = len(tasks) - len(cached)
+    by_kind = {}
+    for t in tasks:
+        by_kind[t.kind] = by_kind.get(t.kind, 0) + 1
+
+    print(f"Tasks: {len(tasks)} ({', '.join(f'{k}: {v}' for k, v in sorted(by_kind.items()))})")
+    print(f"Characters: {chars}")
+    print(f"Already in TTS cache: {len(cached)} ({sum(len(t.text) for t in cached)} chars)")
+    print(f"Remote requests needed: {requests_needed} "
+          f"({chars - sum(len(t.text) for t in cached)} chars)")
+    if rate > 0:
+        print(f"Minimum time at {rate} req/s: {format_duration(requests_needed / rate)}")
+
+
+def run_batch(scopes, workers=4, rate=2.0, burst=None, max_retries=5, force=False, restart=False,
+              dry=False, limit=None, voice=DEFAULT_VOICE, speed=DEFAULT_SPEED):
+    if not DB_PATH.exists():
+        print(f"Database not found at {DB_PATH}")
+        return False
+
+    conn = sqlite3.connect(DB_PATH, timeout=30)
+    conn.row_factory = sqlite3.Row
+    try:
+        try:
+            conn.execute("ALTER TABLE paragraphs ADD COLUMN tts_audio_path TEXT")
+            print("Added tts_audio_path column to paragraphs table.")
+        except sqlite3.OperationalError:
+            pass  # Column likely exists
+        conn.executescript(SCHEMA)
+
+        if restart:
+            conn.execute("DELETE FROM tts_batch_progress")
+            conn.commit()
+
+        tasks = collect_tasks(conn, scopes, force=force)
+        if not force:
+            done = completed_keys(conn)
+            tasks = [t for t in tasks if t.key not in done or not t.output_path.exists()]
+        if limit:
+            tasks = tasks[:limit]
+
+        if dry:
+            dry_run(tasks, voice, speed, rate)
+            return True
+
+        total = len(tasks)
+        total_chars = sum(len(t.text) for t in tasks)
+        print(f"Generating {total} TTS clips ({total_chars} chars) with {workers} workers at {rate} req/s")
+        if not total:
+            return True
+
+        bucket = TokenBucket(rate, burst)
+        start = time.monotonic()
+        finished = failed = cache_hits = chars_done = 0
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(run_task, t, bucket, max_retries, voice, speed): t for t in tasks}
+            for future in as_completed(futures):
+                task = futures[future]
+                try:
+                    cached, attempts = future.result()
+                    conn.execute(task.update_sql, (task.db_path, *task.update_params))
+                    conn.execute(
+                        """
+                        INSERT INTO tts_batch_progress (task_key, kind, status, output_path, text_chars, attempts, cached, error, updated_at)
+                        VALUES (?, ?, 'done', ?, ?, ?, ?, NULL, CURRENT_TIMESTAMP)
+                        ON CONFLICT(task_key) DO UPDATE SET
+                            status = 'done', output_path = excluded.output_path, text_chars = excluded.text_chars,
+                            attempts = excluded.attempts, cached = excluded.cached, error = NULL,
+                            updated_at = CURRENT_TIMESTAMP
+                        """,
+                        (task.key, task.kind, task.db_path, len(task.text), attempts, int(cached))
+                    )
+                    status = "cached" if cached else "ok"
+                    cache_hits += int(cached)
+                except Exception as e:
+                    failed += 1
+                    conn.execute(
+                        """
+                        INSERT INTO tts_batch_progress (task_key, kind, status, text_chars, attempts, error, updated_at)
+                        VALUES (?, ?, 'failed', ?, 1, ?, CURRENT_TIMESTAMP)
+                        ON CONFLICT(task_key) DO UPDATE SET
+                            status = 'failed', attempts = attempts + 1, error = excluded.error,
+                            updated_at = CURRENT_TIMESTAMP
+                        """,
+                        (task.key, task.kind, len(task.text), str(e))
+                    )
+                    status = f"FAILED ({e})"
+                conn.commit()
+
+                finished += 1
+                chars_done += len(task.text)
+                elapsed = time.monotonic() - start
+                rate_now = finished / elapsed if elapsed else 0.0
+                chars_rate = chars_done / elapsed if elapsed else 0.0
+                eta = (total_chars - chars_done) / chars_rate if chars_rate else 0.0
+                print(f"[{finished}/{total}] {status}: {task.key} | "
+                      f"{rate_now:.2f} clips/s, {chars_rate:.0f} chars/s, ETA {format_duration(eta)}")
+
+        elapsed = time.monotonic() - start
+        print(f"Done in {format_duration(elapsed)}: {finished - failed} ok ({cache_hits} from cache), {failed} failed.")
+        if failed:
+            print("Rerun the same command to retry the failed tasks.")
+        return failed == 0
+    finally:
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scope", default="paragraphs,oxford",
+                        help=f"comma-separated subset of {','.join(SCOPES)} (default: paragraphs,oxford)")
+    parser.add_argument("--workers", type=int, default=4, help="concurrent TTS requests")
+    parser.add_argument("--rate", type=float, default=2.0, help="max remote requests per second (0 = unlimited)")
+    parser.add_argument("--burst", type=float, default=None, help="token bucket capacity (default: max(1, rate))")
+    parser.add_argument("--retries", type=int, default=5, help="retries per task on 429/5xx/network errors")
+    parser.add_argument("--voice", default=DEFAULT_VOICE)
+    parser.add_argument("--speed", type=float, default=DEFAULT_SPEED)
+    parser.add_argument("--limit", type=int, default=None, help="only process the first N pending tasks")
+    parser.add_argument("--force", action="store_true", help="regenerate even if audio already exists")
+    parser.add_argument("--restart", action="store_true", help="forget the saved checkpoint before starting")
+    parser.add_argument("--dry-run", action="store_true", help="estimate characters and requests, generate nothing")
+    args = parser.parse_args()
+
+    scopes = {s.strip() for s in args.scope.split(",") if s.strip()}
+    unknown = scopes - set(SCOPES)
+    if unknown:
+        parser.error(f"unknown scope(s): {', '.join(sorted(unknown))}")
+
+    ok = run_batch(
+        scopes,
+        workers=args.workers,
+        rate=args.rate,
+        burst=args.burst,
+        max_retries=args.retries,
+        force=args.force,
+        restart=args.restart,
+        dry=args.dry_run,
+        limit=args.limit,
+        voice=args.voice,
+        speed=args.speed,
+    )
+    raise SystemExit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
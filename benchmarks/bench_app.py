@@ -0,0 +1,24 @@
+"""
+WSGI entry point for load tests: web_app.app with the Speech SDK replaced by
+benchmarks.fake_azure. Point FGL_DB_PATH / FGL_AUDIO_DIR at a scratch copy
+and the TTS / transcription endpoints at a fake_azure server first.
+
+    gunicorn -w 3 benchmarks.bench_app:app
+    python benchmarks/bench_app.py   # threaded werkzeug server
+
+FGL_FAKE_SPEECH_MS sets how long each pronunciation assessment takes.
+"""
+import os
+import pathlib
+import sys
+
+PROJECT_ROOT = pathlib.Path(__file__).resolve().parent.parent
+sys.path.append(str(PROJECT_ROOT))
+from benchmarks.fake_azure import speechsdk_module
+import web_app.app as web
+
+web.speechsdk = speechsdk_module(float(os.environ.get("FGL_FAKE_SPEECH_MS", 800)))
+app = web.app
+
+if __name__ == "__main__":
+    app.run(host="127.0.0.1", port=int(os.environ.get("FLASK_PORT", 5002)), threaded=True)
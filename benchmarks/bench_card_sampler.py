@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+Compares /api/card selection strategies: the legacy ORDER BY RANDOM() query
+against the in-memory CardSampler, plus the due-card lookup of the review
+scheduler with --users other users' schedules in the table. Runs on a
+throwaway copy of masterfgl.db so the real database is never touched.
+
+Usage: python benchmarks/bench_card_sampler.py [--draws 2000] [--known 0.5]
+       [--users 50]
+"""
+import argparse
+import pathlib
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+PROJECT_ROOT = pathlib.Path(__file__).resolve().parent.parent
+sys.path.append(str(PROJECT_ROOT))
+from web_app.card_sampler import ALL_LEVELS, CardSampler, ELIGIBLE_CARDS_QUERY
+from web_app.scheduler import SCHEMA as SCHEDULER_SCHEMA, Scheduler
+
+USERNAME = "bench_user"
+
+LEGACY_QUERY = """
+    SELECT ow.*,
+           uw.user_audio_formal_path, uw.user_audio_informal_path,
+           uw.user_transcription_formal, uw.user_transcription_informal
+    FROM oxford_words ow
+    LEFT JOIN user_words uw
+    ON ow.word = uw.word AND ow.pos = uw.pos AND ow.level = uw.level AND uw.username = ?
+    WHERE (uw.is_known IS NULL OR uw.is_known = 0)
+    AND (ow.audio_formal_path IS NOT NULL OR ow.audio_informal_path IS NOT NULL)
+    AND ((ow.sentence_formal IS NOT NULL AND ow.sentence_formal != '') OR (ow.sentence_informal IS NOT NULL AND ow.sentence_informal != ''))
+"""
+
+
+def connect(path):
+    conn = sqlite3.connect(path)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def seed_known_words(conn, fraction):
+    rows = conn.execute(ELIGIBLE_CARDS_QUERY).fetchall()
+    known = random.Random(42).sample(rows, int(len(rows) * fraction))
+    conn.execute("DELETE FROM user_words WHERE username = ?", (USERNAME,))
+    conn.executemany(
+        "INSERT INTO user_words (username, word, pos, level, is_known) VALUES (?, ?, ?, ?, 1)",
+        [(USERNAME, r['word'], r['pos'], r['level']) for r in known]
+    )
+    conn.commit()
+    return len(rows), len(known)
+
+
+def bench_legacy(conn, draws, level):
+    query = LEGACY_QUERY
+    params = [USERNAME]
+    if level:
+        query += " AND ow.level = ?"
+        params.append(level)
+    query += " ORDER BY RANDOM() LIMIT 1"
+
+    start = time.perf_counter()
+    for _ in range(draws):
+        conn.execute(query, params).fetchone()
+    return time.perf_counter() - start
+
+
+def seed_schedules(conn, users):
+    """Put every eligible card on the schedule of `users` other users, half of them due."""
+    rows = conn.execute(ELIGIBLE_CARDS_QUERY).fetchall()
+    rng = random.Random(1)
+    now = int(time.time())
+    conn.executemany(
+        "INSERT OR IGNORE INTO card_schedule (username, word, pos, level, due_at) VALUES (?, ?, ?, ?, ?)",
+        [(f"other_{u}", r['word'], r['pos'], r['level'], now + rng.randint(-86400, 86400))
+         for u in range(users) for r in rows]
+    )
+    conn.commit()
+    return len(rows) * users
+
+
+def bench_scheduler(conn, draws, level):
+    scheduler = Scheduler()
+    scheduler.next_due(conn, USERNAME, level)  # warm-up: migrates the user's is_known flags
+
+    # Simulate a user whose whole known set is due for review
+    clock = time.time() + 60 * 86400
+    scheduler._clock = lambda: clock
+    # The "All Levels" option (level=all) must serve reviews like no filter at all
+    due = scheduler.next_due(conn, USERNAME, None)
+    if due is None or scheduler.next_due(conn, USERNAME, ALL_LEVELS) != due:
+        raise SystemExit(f"Scheduler.next_due with level={ALL_LEVELS!r} does not match the unfiltered due card")
+    start = time.perf_counter()
+    for _ in range(draws):
+        scheduler.next_due(conn, USERNAME, level)
+    return time.perf_counter() - start
+
+
+def bench_sampler(conn, draws, level):
+    sampler = CardSampler(rng=random.Random(0))
+    sampler.draw(conn, USERNAME, level)  # warm-up: loads candidates and user pools
+
+    start = time.perf_counter()
+    for _ in range(draws):
+        sampler.draw(conn, USERNAME, level)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", default=str(PROJECT_ROOT / "masterfgl.db"))
+    parser.add_argument("--draws", type=int, default=2000)
+    parser.add_argument("--known", type=float, default=0.5, help="fraction of eligible cards marked known")
+    parser.add_argument("--level", default=None, help="CEFR level filter (default: all levels)")
+    parser.add_argument("--users", type=int, default=50, help="other users with every card scheduled")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_copy = pathlib.Path(tmp) / "bench.db"
+        shutil.copyfile(args.db, db_copy)
+        conn = connect(db_copy)
+        conn.executescript(SCHEDULER_SCHEMA)
+
+        eligible, known = seed_known_words(conn, args.known)
+        scheduled = seed_schedules(conn, args.users)
+        print(f"Eligible cards: {eligible}, known by {USERNAME}: {known}, "
+              f"other users' schedule rows: {scheduled}, draws: {args.draws}")
+
+        for name, fn in (("ORDER BY RANDOM()", bench_legacy), ("CardSampler", bench_sampler),
+                         ("Scheduler.next_due", bench_scheduler)):
+            elapsed = fn(conn, args.draws, args.level)
+            print(f"  {name:<18} {args.draws / elapsed:>10.0f} draws/s  ({elapsed * 1000 / args.draws:.3f} ms/draw)")
+
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""
+Compares /api/shadowing/content paging strategies on a synthetic multi-book
+corpus: the legacy unindexed SELECT * ... LIMIT/OFFSET query against keyset
+pagination (after_id) on idx_paragraphs_book_chapter_subtitle_id and
+idx_paragraphs_book_chapter_id.
+
+Every chapter of one book is paged through to the end, both per subtitle and
+for the whole chapter (reported separately), so deep pages are included.
+
+Usage: python benchmarks/bench_shadowing_pages.py [--books 40] [--chapters 20]
+       [--subtitles 5] [--paragraphs 40] [--page-size 100]
+"""
+import argparse
+import pathlib
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+PROJECT_ROOT = pathlib.Path(__file__).resolve().parent.parent
+sys.path.append(str(PROJECT_ROOT))
+from web_app.paragraph_pages import SCHEMA, fetch_page
+
+# Same shape as paragraphs in masterfgl.db
+PARAGRAPHS_DDL = """
+    CREATE TABLE paragraphs(
+      id INT,
+      chapter TEXT,
+      subtitle TEXT,
+      content TEXT,
+      file_source TEXT,
+      word_count INT,
+      audio_path TEXT,
+      tts_audio_path TEXT,
+      book TEXT,
+      user_audio_path TEXT
+    );
+"""
+
+WORDS = ("pitch", "frame", "status", "croc", "brain", "attention", "tension", "desire",
+         "novelty", "prize", "intrigue", "deal", "buyer", "market", "story", "power")
+
+
+def build_corpus(conn, books, chapters, subtitles, paragraphs):
+    rng = random.Random(7)
+    conn.executescript(PARAGRAPHS_DDL)
+    next_id = 1
+    # Books are imported one after another, so ids of a book are contiguous
+    for b in range(books):
+        rows = []
+        for c in range(chapters):
+            for s in range(subtitles):
+                for _ in range(paragraphs):
+                    text = " ".join(rng.choice(WORDS) for _ in range(rng.randint(60, 140)))
+                    rows.append((
+                        next_id, f"Chapter {c + 1}", f"Section {s + 1}", text, f"book_{b}.md",
+                        len(text.split()), f"book_{b}_chunk_{next_id}.mp3", None, f"Book {b:03d}", None,
+                    ))
+                    next_id += 1
+        conn.executemany("INSERT INTO paragraphs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+    conn.commit()
+    return next_id - 1
+
+
+def page_legacy(conn, book, chapter, subtitle, page_size):
+    pages = 0
+    offset = 0
+    while True:
+        query = "SELECT * FROM paragraphs WHERE 1=1 AND book = ? AND chapter = ?"
+        params = [book, chapter]
+        if subtitle:
+            query += " AND subtitle = ?"
+            params.append(subtitle)
+        query += " ORDER BY id LIMIT ? OFFSET ?"
+        rows = conn.execute(query, params + [page_size, offset]).fetchall()
+        pages += 1
+        if len(rows) < page_size:
+            return pages
+        offset += page_size
+
+
+def page_keyset(conn, book, chapter, subtitle, page_size):
+    pages = 0
+    after_id = None
+    while True:
+        rows, after_id = fetch_page(conn, book, chapter, subtitle, after_id=after_id, limit=page_size)
+        pages += 1
+        if after_id is None:
+            return pages
+
+
+def run(conn, fn, book, chapters, subtitles, page_size):
+    timings = []
+    for c in range(chapters):
+        for subtitle in subtitles:
+            start = time.perf_counter()
+            pages = fn(conn, book, f"Chapter {c + 1}", subtitle, page_size)
+            timings.append(((time.perf_counter() - start) * 1000, pages))
+    total_ms = sum(t for t, _ in timings)
+    total_pages = sum(p for _, p in timings)
+    return total_ms / total_pages, max(t / p for t, p in timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--books", type=int, default=40)
+    parser.add_argument("--chapters", type=int, default=20)
+    parser.add_argument("--subtitles", type=int, default=5)
+    parser.add_argument("--paragraphs", type=int, default=40, help="paragraphs per subtitle")
+    parser.add_argument("--page-size", type=int, default=100)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        conn = sqlite3.connect(pathlib.Path(tmp) / "bench.db")
+        conn.row_factory = sqlite3.Row
+
+        start = time.perf_counter()
+        total = build_corpus(conn, args.books, args.chapters, args.subtitles, args.paragraphs)
+        print(f"Synthetic corpus: {args.books} books, {total} paragraphs ({time.perf_counter() - start:.1f}s to build)")
+
+        # Middle book: its rows are neither first nor last in the table
+        book = f"Book {args.books // 2:03d}"
+
+        cases = (
+            ("whole chapter", [None]),
+            ("per subtitle", [f"Section {s + 1}" for s in range(args.subtitles)]),
+        )
+        for label, subtitles in cases:
+            avg, worst = run(conn, page_legacy, book, args.chapters, subtitles, args.page_size)
+            print(f"  {label + ', LIMIT/OFFSET, no index':<40} {avg:8.3f} ms/page avg  {worst:8.3f} ms/page worst")
+
+        conn.executescript(SCHEMA)
+        conn.execute("ANALYZE")
+        for label, subtitles in cases:
+            avg, worst = run(conn, page_keyset, book, args.chapters, subtitles, args.page_size)
+            print(f"  {label + ', after_id + index':<40} {avg:8.3f} ms/page avg  {worst:8.3f} ms/page worst")
+            plan = conn.execute(
+                "EXPLAIN QUERY PLAN SELECT id FROM paragraphs WHERE book = ? AND chapter = ?"
+                + (" AND subtitle = ?" if subtitles[0] else "") + " AND id > ? ORDER BY id LIMIT ?",
+                [book, "Chapter 1"] + ([subtitles[0]] if subtitles[0] else []) + [0, args.page_size + 1]
+            ).fetchall()
+            print(f"    plan: {'; '.join(row[-1] for row in plan)}")
+
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+"""
+Local stand-ins for the Azure services the app calls, for load tests.
+
+- HTTP: the TTS /audio/speech endpoint (streams fake MP3 bytes) and the
+  /audio/transcriptions endpoint (JSON {"text": ...}), each answering after a
+  configurable latency.
+- speechsdk_module(): an object with the parts of
+  azure.cognitiveservices.speech that run_pronunciation_assessment uses; the
+  recognizer fires its events from a thread after a configurable latency.
+
+Usage: python benchmarks/fake_azure.py [--port 8765] [--tts-ms 300]
+       [--transcribe-ms 400] [--jitter 0.2]
+"""
+import argparse
+import enum
+import json
+import random
+import threading
+import time
+import types
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+TTS_BYTES = 48 * 1024
+TTS_CHUNK = 8 * 1024
+
+
+def _delay(latency_s, jitter):
+    if latency_s > 0:
+        time.sleep(latency_s * random.uniform(1 - jitter, 1 + jitter))
+
+
+class FakeAzureHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        self.rfile.read(length)
+        config = self.server.config
+
+        if "/audio/speech" in self.path:
+            _delay(config["tts_s"], config["jitter"])
+            self.send_response(200)
+            self.send_header("Content-Type", "audio/mpeg")
+            self.send_header("Content-Length", str(TTS_BYTES))
+            self.end_headers()
+            # Spread the body over a few writes, like a synthesizing service
+            body = b"\xff\xfb\x90\x00" * (TTS_BYTES // 4)
+            for start in range(0, TTS_BYTES, TTS_CHUNK):
+                self.wfile.write(body[start:start + TTS_CHUNK])
+                self.wfile.flush()
+                time.sleep(config["tts_chunk_s"])
+            return
+
+        if "/audio/transcriptions" in self.path:
+            _delay(config["transcribe_s"], config["jitter"])
+            body = json.dumps({"text": "this is a fake transcription"}).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+
+        self.send_error(404)
+
+
+def make_server(host="127.0.0.1", port=0, tts_ms=300, tts_chunk_ms=20, transcribe_ms=400, jitter=0.2):
+    server = ThreadingHTTPServer((host, port), FakeAzureHandler)
+    server.daemon_threads = True
+    server.config = {
+        "tts_s": tts_ms / 1000,
+        "tts_chunk_s": tts_chunk_ms / 1000,
+        "transcribe_s": transcribe_ms / 1000,
+        "jitter": jitter,
+    }
+    return server
+
+
+# --- speechsdk ---------------------------------------------------------------
+
+class ResultReason(enum.Enum):
+    RecognizedSpeech = 3
+    NoMatch = 0
+
+
+class PronunciationAssessmentGradingSystem(enum.Enum):
+    FivePoint = 1
+    HundredMark = 2
+
+
+class PronunciationAssessmentGranularity(enum.Enum):
+    Phoneme = 1
+    Word = 2
+    FullText = 3
+
+
+class _Signal:
+    def __init__(self):
+        self._callbacks = []
+
+    def connect(self, callback):
+        self._callbacks.append(callback)
+
+    def fire(self, evt):
+        for callback in self._callbacks:
+            callback(evt)
+
+
+class SpeechConfig:
+    def __init__(self, subscription=None, region=None, **kwargs):
+        self.subscription = subscription
+        self.region = region
+
+
+class AudioConfig:
+    def __init__(self, filename=None, **kwargs):
+        self.filename = filename
+
+
+class PronunciationAssessmentConfig:
+    def __init__(self, reference_text="", grading_system=None, granularity=None, enable_miscue=False):
+        self.reference_text = reference_text
+
+    def enable_prosody_assessment(self):
+        pass
+
+    def apply_to(self, recognizer):
+        recognizer.reference_text = self.reference_text
+
+
+class _Word:
+    def __init__(self, word, rng):
+        self.word = word
+        self.accuracy_score = rng.uniform(40, 100)
+        self.error_type = "Mispronunciation" if self.accuracy_score < 55 else "None"
+
+
+class _Result:
+    def __init__(self, text):
+        self.reason = ResultReason.RecognizedSpeech
+        self.text = text
+
+
+class PronunciationAssessmentResult:
+    def __init__(self, result):
+        rng = random.Random(result.text)
+        self.words = [_Word(w, rng) for w in result.text.split()] or [_Word("hello", rng)]
+        self.accuracy_score = rng.uniform(60, 100)
+        self.pronunciation_score = rng.uniform(60, 100)
+        self.fluency_score = rng.uniform(60, 100)
+        self.prosody_score = rng.uniform(60, 100)
+
+
+def speechsdk_module(latency_ms=800, jitter=0.2):
+    """Build a fake speechsdk whose recognitions take about latency_ms."""
+
+    class SpeechRecognizer:
+        def __init__(self, speech_config=None, language=None, audio_config=None):
+            self.reference_text = ""
+            self.recognized = _Signal()
+            self.session_stopped = _Signal()
+            self.canceled = _Signal()
+
+        def _run(self):
+            _delay(latency_ms / 1000, jitter)
+            text = self.reference_text or "hello world"
+            self.recognized.fire(types.SimpleNamespace(result=_Result(text)))
+            self.session_stopped.fire(types.SimpleNamespace())
+
+        def start_continuous_recognition(self):
+            threading.Thread(target=self._run, daemon=True).start()
+
+        def stop_continuous_recognition(self):
+            pass
+
+    return types.SimpleNamespace(
+        SpeechConfig=SpeechConfig,
+        audio=types.SimpleNamespace(AudioConfig=AudioConfig),
+        PronunciationAssessmentConfig=PronunciationAssessmentConfig,
+        PronunciationAssessmentGradingSystem=PronunciationAssessmentGradingSystem,
+        PronunciationAssessmentGranularity=PronunciationAssessmentGranularity,
+        PronunciationAssessmentResult=PronunciationAssessmentResult,
+        ResultReason=ResultReason,
+        SpeechRecognizer=SpeechRecognizer,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--tts-ms", type=float, default=300, help="time to first TTS byte")
+    parser.add_argument("--tts-chunk-ms", type=float, default=20, help="delay between TTS body chunks")
+    parser.add_argument("--transcribe-ms", type=float, default=400)
+    parser.add_argument("--jitter", type=float, default=0.2, help="latencies vary by +/- this fraction")
+    args = parser.parse_args()
+
+    server = make_server(args.host, args.port, args.tts_ms, args.tts_chunk_ms, args.transcribe_ms, args.jitter)
+    print(f"Fake Azure services on http://{args.host}:{server.server_port}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
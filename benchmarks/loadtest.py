@@ -0,0 +1,497 @@
+#!/usr/bin/env python3
+"""
+Load test for the web app with the Azure services replaced by local fakes.
+
+Generates a large synthetic masterfgl.db and audio tree in a scratch
+directory, starts benchmarks/fake_azure.py and the app (gunicorn, or the
+werkzeug dev server with --server werkzeug) pointed at them, then drives a
+weighted mix of card draws, mark_known, uploads, ratings, transcriptions,
+shadowing content pages and TTS streams at a fixed concurrency. Reports
+p50/p95/p99 latency and requests/s per operation and writes them as JSON so
+runs from different commits can be compared.
+
+Usage: python benchmarks/loadtest.py [--concurrency 16] [--duration 60]
+       [--mix card=30,cards=5,content=25,...] [--output run.json] [--compare old.json]
+       python benchmarks/loadtest.py --diff old.json new.json
+
+A rating is timed from POST /api/rate until its job finishes (long-polled
+via /api/rate/jobs/<id>?wait=). ffmpeg must be on PATH for uploads.
+"""
+import argparse
+import datetime
+import io
+import json
+import math
+import os
+import pathlib
+import random
+import shutil
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import wave
+
+import requests
+
+PROJECT_ROOT = pathlib.Path(__file__).resolve().parent.parent
+
+DEFAULT_MIX = "card=30,mark_known=10,upload=10,rate=8,transcribe=7,content=25,tts=10"
+LEVELS = ("A1", "A2", "B1", "B2", "C1")
+POS = ("noun", "verb", "adjective", "adverb")
+WORDS = ("pitch", "frame", "status", "croc", "brain", "attention", "tension", "desire",
+         "novelty", "prize", "intrigue", "deal", "buyer", "market", "story", "power")
+
+# Same shape as the tables in masterfgl.db the exercised routes read
+DDL = """
+    CREATE TABLE oxford_words (
+        id INTEGER, word TEXT, pos TEXT, level TEXT, original_list TEXT, page_col TEXT,
+        sentence_formal TEXT, sentence_informal TEXT, audio_formal_path TEXT, audio_informal_path TEXT,
+        is_known INTEGER DEFAULT 0, user_audio_path TEXT, user_audio_formal_path TEXT,
+        user_audio_informal_path TEXT, user_transcription_formal TEXT, user_transcription_informal TEXT,
+        sentence_formal_prosody TEXT, sentence_informal_prosody TEXT,
+        PRIMARY KEY (word, pos, level)
+    );
+    CREATE TABLE user_words (
+        username TEXT, word TEXT, pos TEXT, level TEXT, is_known INTEGER DEFAULT 0,
+        user_audio_formal_path TEXT, user_audio_informal_path TEXT,
+        user_transcription_formal TEXT, user_transcription_informal TEXT,
+        PRIMARY KEY (username, word, pos, level)
+    );
+    CREATE TABLE paragraphs (
+        id INT, chapter TEXT, subtitle TEXT, content TEXT, file_source TEXT, word_count INT,
+        audio_path TEXT, tts_audio_path TEXT, book TEXT, user_audio_path TEXT
+    );
+    CREATE TABLE sentences (id INT, sentence TEXT, file_source TEXT, chapter TEXT, subtitle TEXT);
+    CREATE TABLE pronunciation_reports (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, audio_id INTEGER NOT NULL,
+        created_at TEXT DEFAULT CURRENT_TIMESTAMP, pronunciation_score REAL, accuracy_score REAL,
+        fluency_score REAL, prosody_score REAL, recognized_text TEXT, mispronunciations_json TEXT,
+        prosody_issues_json TEXT, report_md_path TEXT, speech_type TEXT,
+        source TEXT DEFAULT 'flashcard', total_score REAL, username TEXT
+    );
+    CREATE INDEX idx_pronunciation_reports_audio_id ON pronunciation_reports(audio_id);
+"""
+
+
+def build_database(path, words, books, chapters, subtitles, paragraphs):
+    """Write the synthetic database; returns the corpus the workload draws from."""
+    rng = random.Random(7)
+    conn = sqlite3.connect(path)
+    conn.executescript(DDL)
+
+    cards = []
+    rows = []
+    for i in range(words):
+        word, pos, level = f"{rng.choice(WORDS)}{i}", rng.choice(POS), rng.choice(LEVELS)
+        sentence = " ".join(rng.choice(WORDS) for _ in range(rng.randint(6, 14)))
+        rows.append((
+            i + 1, word, pos, level, sentence, sentence,
+            f"audios/audio_tts/{i + 1:04d}_formal.mp3", f"audios/audio_tts/{i + 1:04d}_informal.mp3",
+        ))
+        cards.append((word, pos, level))
+    conn.executemany(
+        "INSERT INTO oxford_words (id, word, pos, level, sentence_formal, sentence_informal, "
+        "audio_formal_path, audio_informal_path) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        rows
+    )
+
+    sections = []
+    next_id = 1
+    next_sentence_id = 1
+    for b in range(books):
+        rows = []
+        sentence_rows = []
+        for c in range(chapters):
+            for s in range(subtitles):
+                sections.append((f"Book {b:03d}", f"Chapter {c + 1}", f"Section {s + 1}"))
+                for _ in range(paragraphs):
+                    text = " ".join(rng.choice(WORDS) for _ in range(rng.randint(60, 140)))
+                    rows.append((
+                        next_id, f"Chapter {c + 1}", f"Section {s + 1}", text, f"book_{b}.md",
+                        len(text.split()), f"book_{b}_chunk_{next_id}.mp3", None, f"Book {b:03d}", None,
+                    ))
+                    next_id += 1
+                    tokens = text.split()
+                    for start in range(0, len(tokens), 12):
+                        sentence_rows.append((
+                            next_sentence_id, " ".join(tokens[start:start + 12]), f"book_{b}.md", "Unknown", "Unknown",
+                        ))
+                        next_sentence_id += 1
+        conn.executemany("INSERT INTO paragraphs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        conn.executemany("INSERT INTO sentences VALUES (?, ?, ?, ?, ?)", sentence_rows)
+    conn.commit()
+    conn.close()
+    return {'cards': cards, 'sections': sections, 'paragraph_ids': next_id - 1}
+
+
+def make_wav(seconds, rng):
+    buf = io.BytesIO()
+    with wave.open(buf, 'wb') as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(16000)
+        w.writeframes(rng.randbytes(int(seconds * 16000) * 2))
+    return buf.getvalue()
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_until_up(url, proc, timeout=120):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"{proc.args} exited with {proc.returncode}")
+        try:
+            requests.get(url, timeout=2)
+            return
+        except requests.ConnectionError:
+            time.sleep(0.2)
+    raise RuntimeError(f"{url} did not come up within {timeout}s")
+
+
+# --- workload ------------------------------------------------------------------
+
+class VirtualUser:
+    """One client thread's session: its username and the recordings it has uploaded."""
+
+    def __init__(self, index, base_url, corpus, seed):
+        self.username = f"load_user_{index}"
+        self.base = base_url
+        self.corpus = corpus
+        self.rng = random.Random(seed)
+        self.session = requests.Session()
+        self.card = None
+        self.recorded = []
+
+    def pick_card(self):
+        if self.card and self.rng.random() < 0.5:
+            return self.card
+        return self.rng.choice(self.corpus['cards'])
+
+    # Each op returns (name, status); multi-step ops are timed as a whole
+
+    def card_op(self):
+        params = {'username': self.username}
+        if self.rng.random() < 0.5:
+            params['level'] = self.rng.choice(LEVELS)
+        r = self.session.get(f"{self.base}/api/card", params=params, timeout=30)
+        if r.status_code == 200:
+            card = r.json()
+            self.card = (card['word'], card['pos'], card['level'])
+        return 'card', r.status_code
+
+    def cards_op(self):
+        # The flashcard page's prefetch: a batch of upcoming cards with preload hints
+        params = {'username': self.username, 'n': 5}
+        if self.rng.random() < 0.5:
+            params['level'] = self.rng.choice(LEVELS)
+        r = self.session.get(f"{self.base}/api/cards", params=params, timeout=30)
+        if r.status_code == 200 and r.json()['cards']:
+            card = r.json()['cards'][0]
+            self.card = (card['word'], card['pos'], card['level'])
+        return 'cards', r.status_code
+
+    def mark_known_op(self):
+        word, pos, level = self.pick_card()
+        self.card = None
+        r = self.session.post(f"{self.base}/api/mark_known", json={
+            'username': self.username, 'word': word, 'pos': pos, 'level': level,
+        }, timeout=30)
+        return 'mark_known', r.status_code
+
+    def mark_known_batch_op(self):
+        words = [self.rng.choice(self.corpus['cards']) for _ in range(10)]
+        r = self.session.post(f"{self.base}/api/mark_known/batch", json={
+            'username': self.username,
+            'words': [{'word': word, 'pos': pos, 'level': level} for word, pos, level in words],
+        }, timeout=30)
+        return 'mark_known_batch', r.status_code
+
+    def upload_op(self):
+        word, pos, level = self.pick_card()
+        r = self.session.post(
+            f"{self.base}/api/upload_audio",
+            params={'username': self.username, 'word': word, 'pos': pos, 'level': level, 'type': 'formal'},
+            data=make_wav(self.rng.uniform(1.5, 4.0), self.rng),
+            headers={'Content-Type': 'audio/wav'},
+            timeout=60,
+        )
+        if r.status_code == 200:
+            self.recorded.append((word, pos, level))
+        return 'upload', r.status_code
+
+    def rate_op(self):
+        if not self.recorded:
+            return self.upload_op()
+        word, pos, level = self.rng.choice(self.recorded)
+        r = self.session.post(f"{self.base}/api/rate", json={
+            'username': self.username, 'word': word, 'pos': pos, 'level': level, 'type': 'formal',
+        }, timeout=60)
+        while r.status_code == 202:
+            job_id = r.json()['job_id']
+            r = self.session.get(f"{self.base}/api/rate/jobs/{job_id}", params={'wait': 10}, timeout=60)
+        if r.status_code == 200 and not r.json().get('success'):
+            return 'rate', 'job_failed'
+        return 'rate', r.status_code
+
+    def transcribe_op(self):
+        if not self.recorded:
+            return self.upload_op()
+        word, pos, level = self.rng.choice(self.recorded)
+        r = self.session.post(f"{self.base}/api/transcribe", json={
+            'username': self.username, 'word': word, 'pos': pos, 'level': level, 'type': 'formal',
+        }, timeout=60)
+        return 'transcribe', r.status_code
+
+    def content_op(self):
+        book, chapter, subtitle = self.rng.choice(self.corpus['sections'])
+        params = {'book': book, 'chapter': chapter, 'limit': 50}
+        if self.rng.random() < 0.5:
+            params['subtitle'] = subtitle
+        r = self.session.get(f"{self.base}/api/shadowing/content", params=params, timeout=30)
+        return 'content', r.status_code
+
+    def search_op(self):
+        params = {'q': " ".join(self.rng.sample(WORDS, self.rng.randint(1, 2))), 'limit': 10}
+        if self.rng.random() < 0.3:
+            params['book'] = self.rng.choice(self.corpus['sections'])[0]
+        r = self.session.get(f"{self.base}/api/search", params=params, timeout=30)
+        return 'search', r.status_code
+
+    def tts_op(self):
+        paragraph_id = self.rng.randint(1, self.corpus['paragraph_ids'])
+        r = self.session.get(f"{self.base}/api/shadowing/tts_stream/{paragraph_id}", timeout=60)
+        r.content  # read the whole stream
+        return 'tts', r.status_code
+
+
+def parse_mix(spec):
+    mix = {}
+    for part in spec.split(','):
+        name, _, weight = part.partition('=')
+        if not hasattr(VirtualUser, f"{name.strip()}_op"):
+            raise SystemExit(f"Unknown operation in --mix: {name}")
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+def run_workload(base_url, corpus, mix, concurrency, duration, warmup):
+    names = list(mix)
+    weights = [mix[n] for n in names]
+    samples = []
+    lock = threading.Lock()
+    start = time.monotonic()
+    measure_from = start + warmup
+    stop_at = measure_from + duration
+
+    def worker(index):
+        user = VirtualUser(index, base_url, corpus, seed=index)
+        while True:
+            began = time.monotonic()
+            if began >= stop_at:
+                return
+            op = getattr(user, f"{user.rng.choices(names, weights)[0]}_op")
+            try:
+                name, status = op()
+            except requests.RequestException as e:
+                name, status = op.__name__[:-3], type(e).__name__
+            ended = time.monotonic()
+            if began >= measure_from and ended <= stop_at:
+                with lock:
+                    samples.append((name, ended - began, status))
+
+    threads = [threading.Thread(target=worker, args=(i,), daemon=True) for i in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return samples
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    # Nearest rank
+    return sorted_values[max(0, math.ceil(p / 100 * len(sorted_values)) - 1)]
+
+
+def summarize(samples, duration):
+    by_op = {}
+    for name, seconds, status in samples:
+        by_op.setdefault(name, []).append((seconds, status))
+    by_op['ALL'] = [(seconds, status) for _, seconds, status in samples]
+
+    results = {}
+    for name, entries in sorted(by_op.items()):
+        latencies = sorted(s * 1000 for s, _ in entries)
+        errors = {}
+        for _, status in entries:
+            if not (isinstance(status, int) and status < 400):
+                errors[str(status)] = errors.get(str(status), 0) + 1
+        results[name] = {
+            'count': len(entries),
+            'errors': sum(errors.values()),
+            'error_statuses': errors,
+            'rps': round(len(entries) / duration, 2),
+            'mean_ms': round(sum(latencies) / len(latencies), 2),
+            'p50_ms': round(percentile(latencies, 50), 2),
+            'p95_ms': round(percentile(latencies, 95), 2),
+            'p99_ms': round(percentile(latencies, 99), 2),
+            'max_ms': round(latencies[-1], 2),
+        }
+    return results
+
+
+def print_results(results):
+    print(f"  {'operation':<12} {'count':>7} {'errors':>7} {'req/s':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for name, r in results.items():
+        print(f"  {name:<12} {r['count']:>7} {r['errors']:>7} {r['rps']:>8.2f} "
+              f"{r['p50_ms']:>9.1f} {r['p95_ms']:>9.1f} {r['p99_ms']:>9.1f}")
+
+
+def print_diff(old, new):
+    print(f"Comparing {(old.get('git_commit') or '?')[:10]} -> {(new.get('git_commit') or '?')[:10]}")
+    print(f"  {'operation':<12} {'req/s':>18} {'p50 ms':>18} {'p95 ms':>18} {'p99 ms':>18}")
+
+    def cell(a, b):
+        if a is None or b is None:
+            return f"{'-':>18}"
+        change = f"{(b - a) / a * 100:+.0f}%" if a else "n/a"
+        return f"{b:>10.1f} ({change:>5})"
+
+    for name, r in new['results'].items():
+        base = old['results'].get(name, {})
+        print(f"  {name:<12} " + " ".join(
+            cell(base.get(key), r.get(key)) for key in ('rps', 'p50_ms', 'p95_ms', 'p99_ms')
+        ))
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], cwd=PROJECT_ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=60, help="measured seconds")
+    parser.add_argument("--warmup", type=float, default=5, help="unmeasured seconds before the run")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="operation=weight list")
+    parser.add_argument("--server", choices=("gunicorn", "werkzeug"), default="gunicorn")
+    parser.add_argument("--workers", type=int, default=3, help="gunicorn workers (production runs 3)")
+    parser.add_argument("--words", type=int, default=20000)
+    parser.add_argument("--books", type=int, default=40)
+    parser.add_argument("--chapters", type=int, default=20)
+    parser.add_argument("--subtitles", type=int, default=5)
+    parser.add_argument("--paragraphs", type=int, default=10, help="paragraphs per subtitle")
+    parser.add_argument("--tts-ms", type=float, default=300)
+    parser.add_argument("--transcribe-ms", type=float, default=400)
+    parser.add_argument("--speech-ms", type=float, default=800, help="fake pronunciation assessment time")
+    parser.add_argument("--output", help="results JSON (default: loadtest-<commit>-<time>.json)")
+    parser.add_argument("--compare", metavar="OLD_JSON", help="print the change against an earlier run")
+    parser.add_argument("--diff", nargs=2, metavar=("OLD_JSON", "NEW_JSON"), help="only compare two result files")
+    parser.add_argument("--keep", action="store_true", help="keep the scratch directory and server log")
+    args = parser.parse_args()
+
+    if args.diff:
+        old, new = (json.loads(pathlib.Path(p).read_text()) for p in args.diff)
+        print_diff(old, new)
+        return
+
+    mix = parse_mix(args.mix)
+    scratch = pathlib.Path(tempfile.mkdtemp(prefix="fgl_loadtest_"))
+    db_path = scratch / "masterfgl.db"
+    audio_dir = scratch / "audios"
+    for sub in ("audio_book_author", "audio_book_tts", "audios_user", "audios_user_tts",
+                "audios_user_shadowing", "audio_tts"):
+        (audio_dir / sub).mkdir(parents=True)
+
+    started = time.perf_counter()
+    corpus = build_database(db_path, args.words, args.books, args.chapters, args.subtitles, args.paragraphs)
+    print(f"Synthetic database: {len(corpus['cards'])} words, {corpus['paragraph_ids']} paragraphs "
+          f"({db_path.stat().st_size / 1e6:.0f} MB, {time.perf_counter() - started:.1f}s) in {scratch}")
+
+    fake_port, app_port = free_port(), free_port()
+    fake_url = f"http://127.0.0.1:{fake_port}"
+    env = {
+        **os.environ,
+        'FGL_DB_PATH': str(db_path),
+        'FGL_AUDIO_DIR': str(audio_dir),
+        'AZURE_TTS_ENDPOINT': f"{fake_url}/openai/deployments/tts/audio/speech",
+        'AZURE_TTS_KEY': 'fake',
+        'FOUNDRY_PROJECT_ENDPOINT': fake_url,
+        'FOUNDRY_API_KEY': 'fake',
+        'FGL_SPEECH_SERVICE_KEY': 'fake',
+        'FGL_FAKE_SPEECH_MS': str(args.speech_ms),
+        'FLASK_PORT': str(app_port),
+        'PYTHONUNBUFFERED': '1',
+    }
+    if args.server == "gunicorn":
+        server_cmd = [sys.executable, '-m', 'gunicorn', '-w', str(args.workers), '-b', f"127.0.0.1:{app_port}",
+                      '--timeout', '120', 'benchmarks.bench_app:app']
+    else:
+        server_cmd = [sys.executable, 'benchmarks/bench_app.py']
+
+    log_path = scratch / "server.log"
+    procs = []
+    try:
+        with open(log_path, 'wb') as log:
+            procs.append(subprocess.Popen(
+                [sys.executable, 'benchmarks/fake_azure.py', '--port', str(fake_port),
+                 '--tts-ms', str(args.tts_ms), '--transcribe-ms', str(args.transcribe_ms)],
+                cwd=PROJECT_ROOT, stdout=log, stderr=subprocess.STDOUT,
+            ))
+            procs.append(subprocess.Popen(server_cmd, cwd=PROJECT_ROOT, env=env, stdout=log, stderr=subprocess.STDOUT))
+            base_url = f"http://127.0.0.1:{app_port}"
+            wait_until_up(f"{base_url}/api/levels", procs[1])
+
+            print(f"Running {args.concurrency} clients for {args.duration:.0f}s "
+                  f"(+{args.warmup:.0f}s warm-up) against {args.server}: {args.mix}")
+            samples = run_workload(base_url, corpus, mix, args.concurrency, args.duration, args.warmup)
+    finally:
+        for proc in reversed(procs):
+            proc.terminate()
+        for proc in procs:
+            try:
+                proc.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+
+    results = summarize(samples, args.duration)
+    print_results(results)
+
+    commit = git_commit()
+    report = {
+        'git_commit': commit,
+        'created_at': datetime.datetime.now().isoformat(timespec='seconds'),
+        'config': {k: v for k, v in vars(args).items() if k not in ('output', 'compare', 'diff', 'keep')},
+        'results': results,
+    }
+    stamp = datetime.datetime.now().strftime('%Y%m%d-%H%M%S')
+    output = pathlib.Path(args.output or f"loadtest-{(commit or 'nogit')[:10]}-{stamp}.json")
+    output.write_text(json.dumps(report, indent=2))
+    print(f"Results written to {output}")
+
+    if args.compare:
+        print_diff(json.loads(pathlib.Path(args.compare).read_text()), report)
+
+    if args.keep:
+        print(f"Scratch directory kept: {scratch} (server log: {log_path})")
+    else:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
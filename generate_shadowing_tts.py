@@ -3,21 +3,32 @@ import sqlite3
 import os
 import pathlib
 import requests
-import json
 import base64
+import shutil
 import sys
+import uuid
 from dotenv import load_dotenv
 
+from http_client import http_client
+from metrics import metrics
+from tts_cache import tts_cache, cache_key
+
 # Load environment variables
 load_dotenv(pathlib.Path(__file__).parent / ".env")
 
 PROJECT_ROOT = pathlib.Path(__file__).parent
-DB_PATH = PROJECT_ROOT / "masterfgl.db"
-AUDIO_OUTPUT_DIR = PROJECT_ROOT / "audios" / "audio_book_tts"
+DB_PATH = pathlib.Path(os.environ.get("FGL_DB_PATH", PROJECT_ROOT / "masterfgl.db"))
+AUDIO_OUTPUT_DIR = pathlib.Path(os.environ.get("FGL_AUDIO_DIR", PROJECT_ROOT / "audios")) / "audio_book_tts"
+TTS_MODEL = "gpt-4o-mini-tts"
+TTS_FORMAT = "mp3"
+DEFAULT_VOICE = "alloy"
+DEFAULT_SPEED = 1.0
+
+def is_json_response(response: requests.Response) -> bool:
+    return "application/json" in response.headers.get("Content-Type", "").lower()
 
 def decode_audio(response: requests.Response) -> bytes:
-    content_type = response.headers.get("Content-Type", "").lower()
-    if "application/json" in content_type:
+    if is_json_response(response):
         payload = response.json()
         audio = payload.get("audio") or payload.get("data")
         if not audio:
@@ -25,7 +36,19 @@ def decode_audio(response: requests.Response) -> bytes:
         return base64.b64decode(audio)
     return response.content
 
-def send_request(text: str, voice: str = "alloy", speed: float = 1.0) -> requests.Response:
+def copy_into_place(src_path, output_file: pathlib.Path):
+    """Copy src_path to output_file via a temp file + rename, so readers never see a partial mp3."""
+    temp_path = output_file.with_name(f"{output_file.name}.{uuid.uuid4().hex}.part")
+    try:
+        shutil.copyfile(src_path, temp_path)
+        os.replace(temp_path, output_file)
+    finally:
+        if temp_path.exists():
+            temp_path.unlink()
+
+@metrics.timed("tts.request")
+def send_request(text: str, voice: str = DEFAULT_VOICE, speed: float = DEFAULT_SPEED, stream: bool = False,
+                 client=http_client) -> requests.Response:
     endpoint = os.environ.get("AZURE_TTS_ENDPOINT")
     if not endpoint:
         endpoint = "https://fleal-2555-resource.cognitiveservices.azure.com/openai/deployments/gpt-4o-mini-tts/audio/speech?api-version=2024-02-15-preview"
@@ -37,36 +60,125 @@ def send_request(text: str, voice: str = "alloy", speed: float = 1.0) -> request
 
     payload = {
         "voice": voice,
-        "response_format": "mp3",
+        "response_format": TTS_FORMAT,
         "speed": speed,
-        "model": "gpt-4o-mini-tts",
+        "model": TTS_MODEL,
         "input": text,
     }
 
     headers = {
         "api-key": api_key,
-        "Content-Type": "application/json",
     }
 
-    response = requests.post(endpoint, headers=headers, data=json.dumps(payload), timeout=120)
+    # Pooled keep-alive session; stream=True leaves the body unread for the caller
+    response = client.post(endpoint, name="tts", headers=headers, json=payload, stream=stream)
     if response.status_code != 200:
         print(f"TTS Error {response.status_code}: {response.text}")
     return response
 
+@metrics.timed("tts.synthesize")
+def synthesize_to_file(text: str, output_path, voice: str = DEFAULT_VOICE, speed: float = DEFAULT_SPEED,
+                       client=http_client) -> bool:
+    """
+    Writes TTS audio for text to output_path, reusing the shared TTS cache.
+    Returns True when the audio came from the cache (no remote call).
+    Raises on synthesis errors. `client` is the HTTPClient used for the remote call.
+    """
+    output_file = pathlib.Path(output_path)
+    output_file.parent.mkdir(parents=True, exist_ok=True)
+
+    key = cache_key(text, voice, speed, TTS_MODEL, TTS_FORMAT)
+    cached_path = tts_cache.get(key)
+    if cached_path is not None:
+        copy_into_place(cached_path, output_file)
+        return True
+
+    response = send_request(text, voice=voice, speed=speed, stream=True, client=client)
+    try:
+        response.raise_for_status()
+        if is_json_response(response):
+            audio_data = decode_audio(response)
+            output_file.write_bytes(audio_data)
+        else:
+            # Raw audio: stream it to disk instead of buffering it in memory
+            client.save_body(response, output_file)
+    finally:
+        response.close()
+
+    tts_cache.put_file(key, output_file, voice, speed, TTS_MODEL, TTS_FORMAT, text)
+    return False
+
+def stream_synthesis(text: str, output_path, voice: str = DEFAULT_VOICE, speed: float = DEFAULT_SPEED,
+                     on_complete=None, chunk_size: int = 16 * 1024):
+    """
+    Yields TTS audio chunks as they arrive while teeing them to output_path.
+    The file (and its TTS cache entry) only appears once the whole body has
+    been received; if the consumer stops early, the rest is still drained to
+    disk so the paid synthesis is not lost. on_complete(cached) runs after
+    the file is in place.
+    """
+    output_file = pathlib.Path(output_path)
+    output_file.parent.mkdir(parents=True, exist_ok=True)
+
+    key = cache_key(text, voice, speed, TTS_MODEL, TTS_FORMAT)
+    cached_path = tts_cache.get(key)
+    if cached_path is not None:
+        copy_into_place(cached_path, output_file)
+        if on_complete:
+            on_complete(True)
+        with open(output_file, "rb") as f:
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    return
+                yield chunk
+
+    response = send_request(text, voice=voice, speed=speed, stream=True)
+    if response.status_code != 200 or is_json_response(response):
+        # Errors and base64 JSON payloads cannot be relayed incrementally
+        try:
+            response.raise_for_status()
+            audio_data = decode_audio(response)
+        finally:
+            response.close()
+        output_file.write_bytes(audio_data)
+        tts_cache.put(key, audio_data, voice, speed, TTS_MODEL, TTS_FORMAT, text)
+        if on_complete:
+            on_complete(False)
+        yield audio_data
+        return
+
+    temp_path = output_file.with_name(f"{output_file.name}.{uuid.uuid4().hex}.part")
+    body = http_client.iter_body(response, chunk_size)
+    completed = False
+    try:
+        with open(temp_path, "wb") as f:
+            try:
+                for chunk in body:
+                    f.write(chunk)
+                    yield chunk
+            except GeneratorExit:
+                # Client went away: keep the remaining audio for next time
+                for chunk in body:
+                    f.write(chunk)
+        os.replace(temp_path, output_file)
+        completed = True
+    finally:
+        body.close()
+        if not completed and temp_path.exists():
+            temp_path.unlink()
+
+    tts_cache.put_file(key, output_file, voice, speed, TTS_MODEL, TTS_FORMAT, text)
+    if on_complete:
+        on_complete(False)
+
 def generate_tts_audio(text: str, output_path: str):
     """
     Generates TTS for the given text and saves it to output_path.
     Returns (success, error_message).
     """
     try:
-        output_file = pathlib.Path(output_path)
-        output_file.parent.mkdir(parents=True, exist_ok=True)
-        
-        response = send_request(text)
-        response.raise_for_status()
-        audio_data = decode_audio(response)
-        
-        output_file.write_bytes(audio_data)
+        synthesize_to_file(text, output_path)
         return True, None
     except Exception as e:
         print(f"Error generating TTS: {e}")
@@ -104,16 +216,10 @@ def generate_tts_for_audio_path(audio_path: str):
         new_filename = f"{original_path.stem}_tts.mp3"
         output_file = AUDIO_OUTPUT_DIR / new_filename
         
-        # Ensure output directory exists
-        output_file.parent.mkdir(parents=True, exist_ok=True)
-        
         print(f"Generating TTS for {new_filename}...")
         
-        response = send_request(full_text)
-        response.raise_for_status()
-        audio_data = decode_audio(response)
-        
-        output_file.write_bytes(audio_data)
+        if synthesize_to_file(full_text, output_file):
+            print(f"  Reused cached audio for {new_filename}")
         
         # Update DB
         # Store relative path: "audios/audio_book_tts/filename"
@@ -134,35 +240,10 @@ def generate_tts_for_audio_path(audio_path: str):
         conn.close()
 
 def main():
-    if not DB_PATH.exists():
-        print(f"Database not found at {DB_PATH}")
-        return
-
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-
-    # Ensure column exists
-    try:
-        cursor.execute("ALTER TABLE paragraphs ADD COLUMN tts_audio_path TEXT")
-        print("Added tts_audio_path column to paragraphs table.")
-    except sqlite3.OperationalError:
-        pass # Column likely exists
-
-    # Get groups
-    cursor.execute("SELECT DISTINCT audio_path FROM paragraphs WHERE audio_path IS NOT NULL")
-    groups = cursor.fetchall()
-    
-    print(f"Found {len(groups)} audio groups.")
-    conn.close()
-
-    for row in groups:
-        audio_path = row['audio_path']
-        success, result = generate_tts_for_audio_path(audio_path)
-        if success:
-            print(f"  Success: {result}")
-        else:
-            print(f"  Failed: {result}")
+    # Whole-chapter (audio_path group) generation now runs through the parallel,
+    # resumable batch runner; see batch_tts.py for the other scopes and options.
+    from batch_tts import run_batch
+    run_batch({"groups"})
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,223 @@
+"""
+Shared keep-alive HTTP client for the TTS and transcription calls.
+
+One requests.Session per host keeps TCP+TLS connections open between calls
+(instead of a fresh handshake per bare requests.post), with transport-level
+retries/backoff and default timeouts. Every call is timed and split into
+connect, time-to-first-byte and body transfer so the handshake savings show
+up in stats().
+"""
+import os
+import pathlib
+import threading
+import time
+import uuid
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.util.retry import Retry
+
+DEFAULT_TIMEOUT = (
+    float(os.environ.get("FGL_HTTP_CONNECT_TIMEOUT", 10)),
+    float(os.environ.get("FGL_HTTP_READ_TIMEOUT", 120)),
+)
+DEFAULT_RETRIES = int(os.environ.get("FGL_HTTP_RETRIES", 2))
+DEFAULT_BACKOFF = float(os.environ.get("FGL_HTTP_BACKOFF", 0.5))
+DEFAULT_POOL_SIZE = int(os.environ.get("FGL_HTTP_POOL_SIZE", 8))
+CHUNK_SIZE = 64 * 1024
+
+_timing = threading.local()
+
+
+def _add_connect_time(seconds):
+    _timing.connect = getattr(_timing, "connect", 0.0) + seconds
+    _timing.connections = getattr(_timing, "connections", 0) + 1
+
+
+class _TimedHTTPConnection(HTTPConnection):
+    def connect(self):
+        start = time.perf_counter()
+        try:
+            return super().connect()
+        finally:
+            _add_connect_time(time.perf_counter() - start)
+
+
+class _TimedHTTPSConnection(HTTPSConnection):
+    def connect(self):
+        start = time.perf_counter()
+        try:
+            return super().connect()
+        finally:
+            _add_connect_time(time.perf_counter() - start)
+
+
+class _TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _TimedHTTPConnection
+
+
+class _TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _TimedHTTPSConnection
+
+
+class _TimedAdapter(HTTPAdapter):
+    """HTTPAdapter whose pools use connections that report their connect time."""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _TimedHTTPConnectionPool,
+            "https": _TimedHTTPSConnectionPool,
+        }
+
+
+class _CallStats:
+    __slots__ = ("calls", "errors", "new_connections", "connect_s", "ttfb_s", "transfer_s",
+                 "transfers", "bytes", "max_total_s")
+
+    def __init__(self):
+        self.calls = self.errors = self.new_connections = self.transfers = self.bytes = 0
+        self.connect_s = self.ttfb_s = self.transfer_s = self.max_total_s = 0.0
+
+    def as_dict(self):
+        calls = self.calls or 1
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "new_connections": self.new_connections,
+            "reused_connections": max(0, self.calls - self.new_connections),
+            "avg_connect_ms": self.connect_s * 1000 / calls,
+            "avg_ttfb_ms": self.ttfb_s * 1000 / calls,
+            "avg_transfer_ms": self.transfer_s * 1000 / (self.transfers or 1),
+            "max_total_ms": self.max_total_s * 1000,
+            "bytes": self.bytes,
+        }
+
+
+class HTTPClient:
+    def __init__(self, timeout=DEFAULT_TIMEOUT, retries=DEFAULT_RETRIES, backoff=DEFAULT_BACKOFF,
+                 pool_size=DEFAULT_POOL_SIZE):
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.pool_size = pool_size
+        self._sessions = {}
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def _session(self, url):
+        parts = urlsplit(url)
+        host = f"{parts.scheme}://{parts.netloc}"
+        with self._lock:
+            session = self._sessions.get(host)
+            if session is None:
+                retry = Retry(
+                    total=self.retries,
+                    connect=self.retries,
+                    read=self.retries,
+                    status=self.retries,
+                    backoff_factor=self.backoff,
+                    status_forcelist=(429, 500, 502, 503, 504),
+                    allowed_methods=None,  # TTS and transcription POSTs are safe to resend
+                    respect_retry_after_header=True,
+                    raise_on_status=False,
+                )
+                # retries=0 leaves every retry decision (and its rate limiting) to the caller
+                adapter = _TimedAdapter(pool_connections=1, pool_maxsize=self.pool_size,
+                                        max_retries=retry if self.retries else 0)
+                session = requests.Session()
+                session.mount(f"{parts.scheme}://", adapter)
+                self._sessions[host] = session
+            return session
+
+    def _record(self, name, total_s=None, **values):
+        with self._lock:
+            stats = self._stats.get(name)
+            if stats is None:
+                stats = self._stats[name] = _CallStats()
+            for key, value in values.items():
+                setattr(stats, key, getattr(stats, key) + value)
+            if total_s is not None and total_s > stats.max_total_s:
+                stats.max_total_s = total_s
+
+    def request(self, method, url, name="http", stream=False, **kwargs):
+        """Send a request over the host's pooled session.
+
+        With stream=False the body is read before returning (timed as transfer).
+        With stream=True the caller must consume it, ideally via save_body().
+        """
+        kwargs.setdefault("timeout", self.timeout)
+        session = self._session(url)
+
+        _timing.connect = 0.0
+        _timing.connections = 0
+        start = time.perf_counter()
+        try:
+            response = session.request(method, url, stream=True, **kwargs)
+        except requests.RequestException:
+            self._record(name, calls=1, errors=1, connect_s=_timing.connect)
+            raise
+        headers_at = time.perf_counter()
+        connect_s = _timing.connect
+        self._record(
+            name,
+            calls=1,
+            errors=int(response.status_code >= 400),
+            new_connections=_timing.connections,
+            connect_s=connect_s,
+            ttfb_s=max(0.0, headers_at - start - connect_s),
+        )
+        response.fgl_call_name = name
+        response.fgl_started_at = start
+
+        if not stream:
+            body = response.content
+            now = time.perf_counter()
+            self._record(name, total_s=now - start, transfers=1, transfer_s=now - headers_at, bytes=len(body))
+        return response
+
+    def iter_body(self, response, chunk_size=CHUNK_SIZE):
+        """Yield a streamed response body chunk by chunk, timing the transfer."""
+        name = getattr(response, "fgl_call_name", "http")
+        start = time.perf_counter()
+        received = 0
+        try:
+            for chunk in response.iter_content(chunk_size=chunk_size):
+                if chunk:
+                    received += len(chunk)
+                    yield chunk
+        finally:
+            now = time.perf_counter()
+            self._record(name, total_s=now - getattr(response, "fgl_started_at", start),
+                         transfers=1, transfer_s=now - start, bytes=received)
+            response.close()
+
+    def save_body(self, response, dest_path, chunk_size=CHUNK_SIZE):
+        """Stream a response body to dest_path (via a temp file + rename). Returns bytes written."""
+        dest = pathlib.Path(dest_path)
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = dest.with_name(f"{dest.name}.{uuid.uuid4().hex}.part")
+        written = 0
+        try:
+            with open(temp_path, "wb") as f:
+                for chunk in self.iter_body(response, chunk_size):
+                    f.write(chunk)
+                    written += len(chunk)
+            os.replace(temp_path, dest)
+        finally:
+            if temp_path.exists():
+                temp_path.unlink()
+        return written
+
+    def post(self, url, name="http", **kwargs):
+        return self.request("POST", url, name=name, **kwargs)
+
+    def stats(self):
+        with self._lock:
+            return {name: stats.as_dict() for name, stats in self._stats.items()}
+
+
+http_client = HTTPClient()
@@ -0,0 +1,445 @@
+#!/usr/bin/env python3
+"""
+Import a book into paragraphs, sentences and word_frequency.
+
+The text (one Markdown/plain-text file, or a directory of chapter files read
+in name order) is streamed line by line through generator stages:
+
+  iter_lines        lines of each file, tagged with the file name (file_source)
+  iter_blocks       chapter (#, ## or a "Chapter N" line) and subtitle (###)
+                    detection; blank lines separate source paragraphs
+  chunk_paragraphs  source paragraphs merged into shadowing paragraphs of
+                    about --target-words words, with word_count
+  split_sentences   sentences of each paragraph
+
+Rows are written with batched executemany inside one transaction, so only
+the current file's existing rows are held in memory. word_frequency is
+updated in the same transaction by web_app/word_engine.py, which counts
+the tokens of the paragraphs that changed.
+
+Re-importing a book is idempotent. Paragraphs and sentences whose text is
+unchanged keep their id, their audio columns and anything that refers to
+them. Changed text is inserted, rows that disappeared are deleted, and
+word_frequency is adjusted by the difference in counts. Files of the book
+that are not part of the import are left alone, unless a whole directory is
+imported or --prune is given: then their rows are deleted too. Its is_known flag
+is then refreshed from known_words and from words any user marked known.
+
+Usage:
+  python ingest_book.py "books/002_Pitch Anything.md" --book "Pitch Anything"
+  python ingest_book.py books/pitch_anything/ --book "Pitch Anything" --dry-run
+"""
+import argparse
+import bisect
+import os
+import pathlib
+import re
+import sqlite3
+from collections import Counter, defaultdict, deque
+
+from web_app import word_engine
+
+PROJECT_ROOT = pathlib.Path(__file__).parent
+DB_PATH = pathlib.Path(os.environ.get("FGL_DB_PATH", PROJECT_ROOT / "masterfgl.db"))
+
+TEXT_SUFFIXES = (".md", ".markdown", ".txt")
+DEFAULT_SUBTITLE = "Intro"
+TARGET_WORDS = 200
+MAX_WORDS = 450
+BATCH_SIZE = 500
+
+# Same shapes as the shipped tables, for a fresh database
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS paragraphs(
+        id INT, chapter TEXT, subtitle TEXT, content TEXT, file_source TEXT, word_count INT,
+        audio_path TEXT, tts_audio_path TEXT, book TEXT, user_audio_path TEXT
+    );
+    CREATE TABLE IF NOT EXISTS sentences(id INT, sentence TEXT, file_source TEXT, chapter TEXT, subtitle TEXT);
+"""
+# Columns older copies of masterfgl.db may lack
+PARAGRAPH_COLUMNS = {"tts_audio_path": "TEXT", "book": "TEXT", "user_audio_path": "TEXT"}
+INDEXES = """
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_paragraphs_id ON paragraphs(id);
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_sentences_id ON sentences(id);
+    CREATE INDEX IF NOT EXISTS idx_paragraphs_file_source ON paragraphs(file_source, book, chapter);
+    CREATE INDEX IF NOT EXISTS idx_sentences_file_source ON sentences(file_source);
+"""
+
+HEADING = re.compile(r"^(#{1,6})\s+(.*?)\s*#*\s*$")
+CHAPTER_LINE = re.compile(r"^(chapter|part)\s+[\w.-]+\b", re.IGNORECASE)
+SENTENCE_END = re.compile(r"(?<=[.!?…])\s+|(?<=[.!?…][\"”’')\]])\s+")
+
+
+# --- pipeline stages -----------------------------------------------------------
+
+def iter_lines(paths):
+    for path in paths:
+        with open(path, encoding="utf-8-sig") as f:
+            for line in f:
+                yield path.name, line.rstrip("\r\n")
+
+
+def iter_blocks(lines):
+    """Yield (file_source, chapter, subtitle, text) per source paragraph."""
+    file_source = None
+    chapter, subtitle = None, DEFAULT_SUBTITLE
+    buf = []
+
+    def block():
+        return (file_source, chapter or default_chapter(file_source), subtitle, " ".join(buf))
+
+    for source, line in lines:
+        if source != file_source:
+            if buf:
+                yield block()
+                buf = []
+            file_source, chapter, subtitle = source, None, DEFAULT_SUBTITLE
+        text = line.strip()
+        heading = HEADING.match(text)
+        is_chapter_line = not heading and CHAPTER_LINE.match(text) and len(text.split()) <= 12 and not buf
+        if not text or heading or is_chapter_line:
+            if buf:
+                yield block()
+                buf = []
+            if heading:
+                if len(heading.group(1)) <= 2:
+                    chapter, subtitle = heading.group(2), DEFAULT_SUBTITLE
+                else:
+                    subtitle = heading.group(2)
+            elif is_chapter_line:
+                chapter, subtitle = text, DEFAULT_SUBTITLE
+            continue
+        buf.append(text)
+    if buf:
+        yield block()
+
+
+def default_chapter(file_source):
+    return re.sub(r"^\d+[_ -]*", "", pathlib.Path(file_source).stem) or file_source
+
+
+def split_sentences(text):
+    """Sentences of a paragraph, without a trailing full stop (as in the shipped rows)."""
+    sentences = []
+    for part in SENTENCE_END.split(text):
+        part = part.strip()
+        if part.endswith(".") and not part.endswith(".."):
+            part = part[:-1].rstrip()
+        if part:
+            sentences.append(part)
+    return sentences
+
+
+def chunk_paragraphs(blocks, target_words=TARGET_WORDS, max_words=MAX_WORDS):
+    """Merge consecutive source paragraphs of one section into ~target_words chunks.
+
+    Yields dicts with file_source, chapter, subtitle, content and word_count.
+    A source paragraph longer than max_words is cut at sentence boundaries.
+    """
+    section, parts, words = None, [], 0
+
+    def emit():
+        file_source, chapter, subtitle = section
+        content = " ".join(parts)
+        return {
+            "file_source": file_source, "chapter": chapter, "subtitle": subtitle,
+            "content": content, "word_count": len(content.split()),
+        }
+
+    for file_source, chapter, subtitle, text in blocks:
+        key = (file_source, chapter, subtitle)
+        if parts and (key != section or words >= target_words):
+            yield emit()
+            parts, words = [], 0
+        section = key
+        for piece in _pieces(text, max_words):
+            n = len(piece.split())
+            if parts and words + n > max_words:
+                yield emit()
+                parts, words = [], 0
+            parts.append(piece)
+            words += n
+    if parts:
+        yield emit()
+
+
+def _pieces(text, max_words):
+    if len(text.split()) <= max_words:
+        yield text
+        return
+    piece, words = [], 0
+    for sentence in SENTENCE_END.split(text):
+        n = len(sentence.split())
+        if piece and words + n > max_words:
+            yield " ".join(piece)
+            piece, words = [], 0
+        piece.append(sentence.strip())
+        words += n
+    if piece:
+        yield " ".join(piece)
+
+
+# --- writer --------------------------------------------------------------------
+
+class BookWriter:
+    """Reconciles the streamed paragraphs of one book with its existing rows.
+
+    Call within a transaction: add() each paragraph in reading order, then
+    finish(). Paragraph ids follow reading order; an unchanged paragraph keeps
+    its id while that order allows it, and new ones take free ids in the gap
+    before the next existing row (or the end of the table when there is none).
+    """
+
+    def __init__(self, conn, book, batch_size=BATCH_SIZE):
+        self.conn = conn
+        self.book = book
+        self.batch_size = batch_size
+        self.stats = Counter()
+        self._pending = defaultdict(list)
+        self._file_source = None
+        self._seen_files = set()
+
+        row = conn.execute("SELECT MIN(id) AS first_id FROM paragraphs WHERE book = ?", (book,)).fetchone()
+        if row["first_id"] is None:
+            self._last_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM paragraphs").fetchone()[0]
+        else:
+            self._last_id = conn.execute(
+                "SELECT COALESCE(MAX(id), 0) FROM paragraphs WHERE id < ?", (row["first_id"],)
+            ).fetchone()[0]
+        self._max_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM paragraphs").fetchone()[0]
+        self._max_sentence_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM sentences").fetchone()[0]
+
+    # existing rows of the current file
+
+    def _open_file(self, file_source):
+        self._close_file()
+        # sentences have no book column: file_source must identify the book
+        other = self.conn.execute(
+            "SELECT book FROM paragraphs WHERE file_source = ? AND book IS NOT ? LIMIT 1", (file_source, self.book)
+        ).fetchone()
+        if other is not None:
+            raise ValueError(f"{file_source} already belongs to book '{other['book']}'; rename the file")
+        self._file_source = file_source
+        self._seen_files.add(file_source)
+        self._paragraphs = defaultdict(list)   # content -> existing rows (id order)
+        self._kept_paragraphs = set()
+        for row in self.conn.execute(
+            "SELECT id, content, chapter, subtitle, word_count, audio_path, tts_audio_path, user_audio_path "
+            "FROM paragraphs WHERE file_source = ? AND book = ? ORDER BY id",
+            (file_source, self.book)
+        ):
+            self._paragraphs[row["content"]].append(dict(row))
+        self._sentences = defaultdict(deque)   # sentence -> existing rows
+        for row in self.conn.execute(
+            "SELECT id, sentence, chapter, subtitle FROM sentences WHERE file_source = ? ORDER BY id",
+            (file_source,)
+        ):
+            self._sentences[row["sentence"]].append(dict(row))
+
+    def _close_file(self):
+        if self._file_source is None:
+            return
+        for rows in self._paragraphs.values():
+            for row in rows:
+                if row["id"] not in self._kept_paragraphs:
+                    self._queue("DELETE FROM paragraphs WHERE id = ?", (row["id"],))
+                    self.stats["paragraphs_deleted"] += 1
+        for rows in self._sentences.values():
+            for row in rows:
+                self._queue("DELETE FROM sentences WHERE id = ?", (row["id"],))
+                self.stats["sentences_deleted"] += 1
+        self._file_source = None
+
+    # batched writes
+
+    def _queue(self, sql, params):
+        batch = self._pending[sql]
+        batch.append(params)
+        if len(batch) >= self.batch_size:
+            self.conn.executemany(sql, batch)
+            batch.clear()
+
+    def _flush(self):
+        for sql, batch in self._pending.items():
+            if batch:
+                self.conn.executemany(sql, batch)
+                batch.clear()
+
+    # paragraphs and sentences
+
+    def _next_paragraph_id(self):
+        upper = self.conn.execute("SELECT MIN(id) FROM paragraphs WHERE id > ?", (self._last_id,)).fetchone()[0]
+        if upper is None or upper > self._last_id + 1:
+            new_id = self._last_id + 1
+        else:
+            # No free id before the next existing row: append out of reading order
+            self.stats["paragraphs_out_of_order"] += 1
+            new_id = self._max_id + 1
+        self._max_id = max(self._max_id, new_id)
+        return new_id
+
+    def add(self, paragraph):
+        if paragraph["file_source"] != self._file_source:
+            self._open_file(paragraph["file_source"])
+
+        candidates = self._paragraphs.get(paragraph["content"], [])
+        ids = [row["id"] for row in candidates]
+        i = bisect.bisect_right(ids, self._last_id)
+        match = candidates.pop(i) if i < len(candidates) else None
+        if match is not None:
+            self._kept_paragraphs.add(match["id"])
+            self._last_id = match["id"]
+            if (match["chapter"], match["subtitle"], match["word_count"]) != (
+                paragraph["chapter"], paragraph["subtitle"], paragraph["word_count"]
+            ):
+                self._queue(
+                    "UPDATE paragraphs SET chapter = ?, subtitle = ?, word_count = ? WHERE id = ?",
+                    (paragraph["chapter"], paragraph["subtitle"], paragraph["word_count"], match["id"])
+                )
+                self.stats["paragraphs_updated"] += 1
+            else:
+                self.stats["paragraphs_unchanged"] += 1
+        else:
+            # Same text at an id that no longer fits the reading order keeps its audio
+            previous = candidates.pop(0) if candidates else {}
+            # Queued rows all have ids <= _last_id, so the gap lookup needs no flush
+            self._last_id = self._next_paragraph_id()
+            self._queue(
+                "INSERT INTO paragraphs (id, chapter, subtitle, content, file_source, word_count, "
+                "audio_path, tts_audio_path, book, user_audio_path) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    self._last_id, paragraph["chapter"], paragraph["subtitle"], paragraph["content"],
+                    paragraph["file_source"], paragraph["word_count"], previous.get("audio_path"),
+                    previous.get("tts_audio_path"), self.book, previous.get("user_audio_path"),
+                )
+            )
+            if previous:
+                self._queue("DELETE FROM paragraphs WHERE id = ?", (previous["id"],))
+            self.stats["paragraphs_inserted"] += 1
+
+        for sentence in split_sentences(paragraph["content"]):
+            rows = self._sentences.get(sentence)
+            if rows:
+                row = rows.popleft()
+                if (row["chapter"], row["subtitle"]) != (paragraph["chapter"], paragraph["subtitle"]):
+                    self._queue(
+                        "UPDATE sentences SET chapter = ?, subtitle = ? WHERE id = ?",
+                        (paragraph["chapter"], paragraph["subtitle"], row["id"])
+                    )
+                self.stats["sentences_kept"] += 1
+            else:
+                self._max_sentence_id += 1
+                self._queue(
+                    "INSERT INTO sentences (id, sentence, file_source, chapter, subtitle) VALUES (?, ?, ?, ?, ?)",
+                    (self._max_sentence_id, sentence, paragraph["file_source"], paragraph["chapter"], paragraph["subtitle"])
+                )
+                self.stats["sentences_inserted"] += 1
+
+    def finish(self, prune=False):
+        """Update word_frequency; with prune, first drop the book's files that were not imported."""
+        self._close_file()
+        stale = [row[0] for row in self.conn.execute(
+            "SELECT DISTINCT file_source FROM paragraphs WHERE book = ?", (self.book,)
+        ).fetchall() if row[0] not in self._seen_files]
+        if prune:
+            for file_source in stale:
+                self._open_file(file_source)
+                self._close_file()
+            self.stats["files_pruned"] += len(stale)
+        else:
+            self.stats["files_not_imported"] += len(stale)
+        self._flush()
+        self._update_word_frequency()
+        return dict(self.stats)
+
+    def _update_word_frequency(self):
+        # Paragraph triggers have queued every inserted/updated/deleted row
+        self.stats["chapters_recounted"] = len(word_engine.sync(self.conn))
+        self.stats["known_flags_changed"] = word_engine.refresh_known_flags(self.conn)
+
+
+def ensure_schema(conn):
+    """Create or upgrade the tables within the caller's transaction."""
+    word_engine.run_script(conn, SCHEMA)
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(paragraphs)")}
+    for name, kind in PARAGRAPH_COLUMNS.items():
+        if name not in columns:
+            conn.execute(f"ALTER TABLE paragraphs ADD COLUMN {name} {kind}")
+    word_engine.run_script(conn, INDEXES)
+    word_engine.ensure_schema(conn)
+
+
+def source_files(path):
+    path = pathlib.Path(path)
+    if path.is_dir():
+        return sorted(p for p in path.iterdir() if p.suffix.lower() in TEXT_SUFFIXES and p.is_file())
+    return [path]
+
+
+def ingest(db_path, path, book=None, target_words=TARGET_WORDS, max_words=MAX_WORDS,
+           batch_size=BATCH_SIZE, dry=False, prune=None):
+    """Import path into book; prune (default: path is a directory) drops the book's other files."""
+    files = source_files(path)
+    if prune is None:
+        prune = path.is_dir()
+    if not files:
+        raise SystemExit(f"No {'/'.join(TEXT_SUFFIXES)} files in {path}")
+    if book is None:
+        book = default_chapter(path.name) if path.is_dir() else default_chapter(files[0].name)
+
+    conn = sqlite3.connect(db_path, timeout=30)
+    conn.row_factory = sqlite3.Row
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Schema changes share the transaction so --dry-run rolls them back too
+            ensure_schema(conn)
+            writer = BookWriter(conn, book, batch_size)
+            paragraphs = chunk_paragraphs(iter_blocks(iter_lines(files)), target_words, max_words)
+            for paragraph in paragraphs:
+                writer.add(paragraph)
+            stats = writer.finish(prune)
+        except BaseException:
+            conn.rollback()
+            raise
+        if dry:
+            conn.rollback()
+        else:
+            conn.commit()
+    finally:
+        conn.close()
+    return book, files, stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("path", help="book text file, or a directory of chapter files")
+    parser.add_argument("--book", default=None, help="book name (default: from the file or directory name)")
+    parser.add_argument("--target-words", type=int, default=TARGET_WORDS, help="paragraph size to aim for")
+    parser.add_argument("--max-words", type=int, default=MAX_WORDS, help="hard paragraph size limit")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="rows per executemany")
+    parser.add_argument("--db", default=str(DB_PATH))
+    parser.add_argument("--dry-run", action="store_true", help="report what would change, write nothing")
+    parser.add_argument("--prune", action="store_true", default=None,
+                        help="delete the book's files that are not imported (default for a directory)")
+    args = parser.parse_args()
+
+    try:
+        book, files, stats = ingest(
+            args.db, pathlib.Path(args.path), book=args.book, target_words=args.target_words,
+            max_words=args.max_words, batch_size=args.batch_size, dry=args.dry_run,
+            prune=args.prune,
+        )
+    except ValueError as e:
+        raise SystemExit(f"Import failed, nothing written: {e}")
+    print(f"{'Would import' if args.dry_run else 'Imported'} '{book}' from {len(files)} file(s)")
+    for key in sorted(stats):
+        print(f"  {key}: {stats[key]}")
+    if stats.get("files_not_imported"):
+        print(f"  note: {stats['files_not_imported']} other file(s) of the book were kept; --prune deletes them")
+    if stats.get("paragraphs_out_of_order"):
+        print("  note: some new paragraphs had no free id in reading order and were appended at the end")
+
+
+if __name__ == "__main__":
+    main()
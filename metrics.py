@@ -0,0 +1,274 @@
+"""
+Request and span timing with a Prometheus text exposition, shared by all
+gunicorn workers.
+
+Each process aggregates counters and histograms in memory and periodically
+adds its deltas to the `metrics` table in masterfgl.db, so whichever worker
+answers /metrics reports the sum over all of them. Named spans (ffmpeg,
+Speech SDK, TTS/transcription calls, SQLite queries) feed a histogram and,
+while a request or rating job is being traced, its span breakdown. Traces
+slower than FGL_SLOW_REQUEST_MS are sampled into `slow_requests`.
+"""
+import functools
+import json
+import os
+import pathlib
+import random
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+PROJECT_ROOT = pathlib.Path(__file__).parent
+DB_PATH = pathlib.Path(os.environ.get("FGL_DB_PATH", PROJECT_ROOT / "masterfgl.db"))
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+FLUSH_INTERVAL = float(os.environ.get("FGL_METRICS_FLUSH_S", 5))
+SLOW_REQUEST_MS = float(os.environ.get("FGL_SLOW_REQUEST_MS", 0))  # 0 = sampling off
+SLOW_SAMPLE_RATE = float(os.environ.get("FGL_SLOW_SAMPLE_RATE", 1.0))
+SLOW_KEEP = 500
+MAX_TRACE_SPANS = 200
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS metrics (
+        name TEXT NOT NULL,
+        labels TEXT NOT NULL,
+        value REAL NOT NULL DEFAULT 0,
+        PRIMARY KEY (name, labels)
+    );
+    CREATE TABLE IF NOT EXISTS slow_requests (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        kind TEXT NOT NULL,
+        name TEXT,
+        status TEXT,
+        duration_ms REAL,
+        spans_json TEXT,
+        worker_pid INTEGER,
+        created_at TEXT DEFAULT CURRENT_TIMESTAMP
+    );
+"""
+
+FAMILIES = {
+    "fgl_http_request_duration_seconds": ("histogram", "HTTP request latency by route."),
+    "fgl_http_responses_total": ("counter", "HTTP responses by route and status code."),
+    "fgl_http_queue_seconds": ("histogram", "Time between nginx accepting a request and a worker starting it."),
+    "fgl_span_duration_seconds": ("histogram", "Duration of named internal operations."),
+    "fgl_span_errors_total": ("counter", "Named operations that raised."),
+}
+
+
+def _labels(labels):
+    return ",".join(f'{k}="{_escape(v)}"' for k, v in sorted(labels.items()))
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class Metrics:
+    def __init__(self, db_path=DB_PATH):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._deltas = {}
+        self._last_flush = time.monotonic()
+        self._schema_ready = False
+        self._local = threading.local()
+
+    # --- recording -------------------------------------------------------
+
+    def inc(self, name, labels, amount=1.0):
+        key = (name, _labels(labels))
+        with self._lock:
+            self._deltas[key] = self._deltas.get(key, 0.0) + amount
+
+    def observe(self, name, labels, seconds):
+        base = _labels(labels)
+        sep = "," if base else ""
+        with self._lock:
+            deltas = self._deltas
+            for bound in BUCKETS:
+                if seconds <= bound:
+                    key = (f"{name}_bucket", f'{base}{sep}le="{bound}"')
+                    deltas[key] = deltas.get(key, 0.0) + 1
+            key = (f"{name}_bucket", f'{base}{sep}le="+Inf"')
+            deltas[key] = deltas.get(key, 0.0) + 1
+            key = (f"{name}_sum", base)
+            deltas[key] = deltas.get(key, 0.0) + seconds
+            key = (f"{name}_count", base)
+            deltas[key] = deltas.get(key, 0.0) + 1
+
+    @contextmanager
+    def span(self, name):
+        """Time a block as span `name` (and add it to the active trace, if any)."""
+        trace = getattr(self._local, "trace", None)
+        start = time.perf_counter()
+        failed = False
+        try:
+            yield
+        except BaseException:
+            failed = True
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            self.observe("fgl_span_duration_seconds", {"span": name}, elapsed)
+            if failed:
+                self.inc("fgl_span_errors_total", {"span": name})
+            if trace is not None and len(trace["spans"]) < MAX_TRACE_SPANS:
+                trace["spans"].append({
+                    "span": name,
+                    "start_ms": round((start - trace["start"]) * 1000, 3),
+                    "ms": round(elapsed * 1000, 3),
+                    "error": failed,
+                })
+
+    def timed(self, name):
+        """Decorator form of span()."""
+        def decorator(fn):
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                with self.span(name):
+                    return fn(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def record_span(self, name, seconds):
+        """Record a duration measured elsewhere (e.g. time spent queued)."""
+        self.observe("fgl_span_duration_seconds", {"span": name}, seconds)
+        trace = getattr(self._local, "trace", None)
+        if trace is not None and len(trace["spans"]) < MAX_TRACE_SPANS:
+            trace["spans"].append({"span": name, "start_ms": None, "ms": round(seconds * 1000, 3), "error": False})
+
+    # --- traces / slow sampling ------------------------------------------
+
+    def start_trace(self):
+        self._local.trace = {"start": time.perf_counter(), "spans": []}
+
+    def end_trace(self, kind, name, status=None):
+        """Finish the thread's trace; sample it if slow. Returns its duration in seconds."""
+        trace = getattr(self._local, "trace", None)
+        self._local.trace = None
+        if trace is None:
+            return None
+        elapsed = time.perf_counter() - trace["start"]
+        if SLOW_REQUEST_MS and elapsed * 1000 >= SLOW_REQUEST_MS and random.random() < SLOW_SAMPLE_RATE:
+            self._save_slow(kind, name, status, elapsed, trace["spans"])
+        return elapsed
+
+    def _save_slow(self, kind, name, status, elapsed, spans):
+        print(f"Slow {kind} {name} ({status}): {elapsed * 1000:.0f} ms, {len(spans)} spans")
+        try:
+            conn = self._connect()
+            try:
+                conn.execute(
+                    "INSERT INTO slow_requests (kind, name, status, duration_ms, spans_json, worker_pid) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (kind, name, status, elapsed * 1000, json.dumps(spans), os.getpid())
+                )
+                conn.execute(
+                    "DELETE FROM slow_requests WHERE id <= (SELECT MAX(id) FROM slow_requests) - ?",
+                    (SLOW_KEEP,)
+                )
+                conn.commit()
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            print(f"Could not store slow request sample: {e}")
+
+    def slow_samples(self, limit=50):
+        conn = self._connect()
+        try:
+            rows = conn.execute(
+                "SELECT * FROM slow_requests ORDER BY id DESC LIMIT ?", (limit,)
+            ).fetchall()
+        finally:
+            conn.close()
+        return [
+            {**{k: row[k] for k in row.keys() if k != "spans_json"}, "spans": json.loads(row["spans_json"])}
+            for row in rows
+        ]
+
+    # --- cross-worker aggregation ----------------------------------------
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=5)
+        conn.row_factory = sqlite3.Row
+        if not self._schema_ready:
+            conn.executescript(SCHEMA)
+            self._schema_ready = True
+        return conn
+
+    def flush(self):
+        """Add this process's deltas to the shared table."""
+        with self._lock:
+            deltas, self._deltas = self._deltas, {}
+            self._last_flush = time.monotonic()
+        if not deltas:
+            return
+        try:
+            conn = self._connect()
+            try:
+                conn.executemany(
+                    "INSERT INTO metrics (name, labels, value) VALUES (?, ?, ?) "
+                    "ON CONFLICT(name, labels) DO UPDATE SET value = value + excluded.value",
+                    [(name, labels, value) for (name, labels), value in deltas.items()]
+                )
+                conn.commit()
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            # Keep the deltas for the next attempt
+            print(f"Metrics flush failed: {e}")
+            with self._lock:
+                for key, value in deltas.items():
+                    self._deltas[key] = self._deltas.get(key, 0.0) + value
+
+    def maybe_flush(self):
+        """Flush if FLUSH_INTERVAL has passed. Call only outside DB transactions."""
+        if time.monotonic() - self._last_flush >= FLUSH_INTERVAL:
+            self.flush()
+
+    def render(self):
+        """Prometheus text exposition format (version 0.0.4)."""
+        self.flush()
+        conn = self._connect()
+        try:
+            rows = conn.execute("SELECT name, labels, value FROM metrics ORDER BY name, labels").fetchall()
+        finally:
+            conn.close()
+
+        series = {}
+        for row in rows:
+            family = row["name"]
+            for suffix in ("_bucket", "_sum", "_count"):
+                if family.endswith(suffix) and family[: -len(suffix)] in FAMILIES:
+                    family = family[: -len(suffix)]
+                    break
+            series.setdefault(family, []).append(row)
+
+        lines = []
+        for family, family_rows in series.items():
+            kind, help_text = FAMILIES.get(family, ("untyped", ""))
+            lines.append(f"# HELP {family} {help_text}")
+            lines.append(f"# TYPE {family} {kind}")
+            if kind == "histogram":
+                family_rows.sort(key=lambda r: (r["name"] != f"{family}_bucket", _bucket_order(r)))
+            for row in family_rows:
+                labels = f"{{{row['labels']}}}" if row["labels"] else ""
+                lines.append(f"{row['name']}{labels} {_format(row['value'])}")
+        return "\n".join(lines) + "\n"
+
+
+def _bucket_order(row):
+    labels = row["labels"]
+    if 'le="' not in labels:
+        return (labels, 0.0)
+    base, _, le = labels.rpartition('le="')
+    le = le.rstrip('"')
+    return (base, float("inf") if le == "+Inf" else float(le))
+
+
+def _format(value):
+    return str(int(value)) if float(value).is_integer() else repr(value)
+
+
+metrics = Metrics()
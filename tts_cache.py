@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+"""
+Content-addressed cache for synthesized TTS audio.
+
+Audio blobs live on disk under audios/tts_cache/<aa>/<sha256>.<format>, and
+an index table (tts_cache) in masterfgl.db tracks size and last use so the
+store can be trimmed back under a size budget (least recently used first).
+Both the web app and generate_shadowing_tts.py consult it before calling the
+remote TTS service.
+
+Usage: python tts_cache.py [--stats] [--evict] [--clear]
+"""
+import argparse
+import hashlib
+import json
+import os
+import pathlib
+import shutil
+import sqlite3
+import threading
+import uuid
+
+PROJECT_ROOT = pathlib.Path(__file__).parent
+DB_PATH = pathlib.Path(os.environ.get("FGL_DB_PATH", PROJECT_ROOT / "masterfgl.db"))
+CACHE_DIR = pathlib.Path(os.environ.get("FGL_AUDIO_DIR", PROJECT_ROOT / "audios")) / "tts_cache"
+DEFAULT_MAX_BYTES = int(os.environ.get("FGL_TTS_CACHE_MAX_MB", 512)) * 1024 * 1024
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS tts_cache (
+        cache_key TEXT PRIMARY KEY,
+        blob_path TEXT NOT NULL,
+        size_bytes INTEGER NOT NULL,
+        voice TEXT,
+        speed REAL,
+        model TEXT,
+        format TEXT,
+        text_chars INTEGER,
+        hits INTEGER DEFAULT 0,
+        created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+        last_used_at TEXT DEFAULT CURRENT_TIMESTAMP
+    );
+    CREATE INDEX IF NOT EXISTS idx_tts_cache_last_used ON tts_cache(last_used_at);
+"""
+
+
+def cache_key(text: str, voice: str, speed: float, model: str, fmt: str) -> str:
+    raw = json.dumps([text, voice, float(speed), model, fmt], ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _stored_path(path: pathlib.Path) -> str:
+    # Relative to the project when possible; absolute for an FGL_AUDIO_DIR elsewhere
+    try:
+        return str(path.relative_to(PROJECT_ROOT))
+    except ValueError:
+        return str(path)
+
+
+class TTSCache:
+    def __init__(self, db_path=DB_PATH, cache_dir=CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        self.db_path = pathlib.Path(db_path)
+        self.cache_dir = pathlib.Path(cache_dir)
+        self.max_bytes = max_bytes
+        self._schema_ready = False
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=10)
+        conn.row_factory = sqlite3.Row
+        if not self._schema_ready:
+            conn.executescript(SCHEMA)
+            self._schema_ready = True
+        return conn
+
+    def _blob_path(self, key: str, fmt: str) -> pathlib.Path:
+        return self.cache_dir / key[:2] / f"{key}.{fmt}"
+
+    def contains(self, key: str) -> bool:
+        """Check for a cached blob without counting it as a use."""
+        conn = self._connect()
+        try:
+            row = conn.execute("SELECT blob_path FROM tts_cache WHERE cache_key = ?", (key,)).fetchone()
+        finally:
+            conn.close()
+        return row is not None and (PROJECT_ROOT / row["blob_path"]).exists()
+
+    def get(self, key: str):
+        """Return the cached blob path for key, or None. Counts as a use for LRU."""
+        conn = self._connect()
+        try:
+            row = conn.execute("SELECT blob_path FROM tts_cache WHERE cache_key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            path = PROJECT_ROOT / row["blob_path"]
+            if not path.exists():
+                # Blob was removed behind our back; forget the entry
+                conn.execute("DELETE FROM tts_cache WHERE cache_key = ?", (key,))
+                conn.commit()
+                return None
+            conn.execute(
+                "UPDATE tts_cache SET hits = hits + 1, last_used_at = CURRENT_TIMESTAMP WHERE cache_key = ?",
+                (key,)
+            )
+            conn.commit()
+            return path
+        finally:
+            conn.close()
+
+    def put(self, key: str, data: bytes, voice: str, speed: float, model: str, fmt: str, text: str) -> pathlib.Path:
+        path = self._blob_path(key, fmt)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = path.with_name(f"{path.name}.{uuid.uuid4().hex}.part")
+        temp_path.write_bytes(data)
+        os.replace(temp_path, path)
+        return self._index(key, path, len(data), voice, speed, model, fmt, text)
+
+    def put_file(self, key: str, src_path, voice: str, speed: float, model: str, fmt: str, text: str) -> pathlib.Path:
+        """Like put(), but copies an audio file that was streamed to disk."""
+        path = self._blob_path(key, fmt)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = path.with_name(f"{path.name}.{uuid.uuid4().hex}.part")
+        shutil.copyfile(src_path, temp_path)
+        os.replace(temp_path, path)
+        return self._index(key, path, path.stat().st_size, voice, speed, model, fmt, text)
+
+    def _index(self, key, path, size, voice, speed, model, fmt, text):
+        conn = self._connect()
+        try:
+            conn.execute(
+                """
+                INSERT INTO tts_cache (cache_key, blob_path, size_bytes, voice, speed, model, format, text_chars)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(cache_key) DO UPDATE SET
+                    blob_path = excluded.blob_path,
+                    size_bytes = excluded.size_bytes,
+                    last_used_at = CURRENT_TIMESTAMP
+                """,
+                (key, _stored_path(path), size, voice, speed, model, fmt, len(text))
+            )
+            conn.commit()
+        finally:
+            conn.close()
+
+        self.evict()
+        return path
+
+    def evict(self, target_bytes=None):
+        """Delete least recently used blobs until the store fits the budget.
+
+        Trims to 90% of max_bytes so a full cache does not evict on every put.
+        Returns the number of entries removed.
+        """
+        with self._lock:
+            conn = self._connect()
+            try:
+                total = conn.execute("SELECT COALESCE(SUM(size_bytes), 0) FROM tts_cache").fetchone()[0]
+                if total <= self.max_bytes and target_bytes is None:
+                    return 0
+                target = int(self.max_bytes * 0.9) if target_bytes is None else target_bytes
+
+                removed = 0
+                rows = conn.execute(
+                    "SELECT cache_key, blob_path, size_bytes FROM tts_cache ORDER BY last_used_at, hits"
+                ).fetchall()
+                for row in rows:
+                    if total <= target:
+                        break
+                    try:
+                        os.remove(PROJECT_ROOT / row["blob_path"])
+                    except OSError:
+                        pass
+                    conn.execute("DELETE FROM tts_cache WHERE cache_key = ?", (row["cache_key"],))
+                    total -= row["size_bytes"]
+                    removed += 1
+                conn.commit()
+                return removed
+            finally:
+                conn.close()
+
+    def stats(self):
+        conn = self._connect()
+        try:
+            row = conn.execute(
+                "SELECT COUNT(*) AS entries, COALESCE(SUM(size_bytes), 0) AS size_bytes, "
+                "COALESCE(SUM(hits), 0) AS hits FROM tts_cache"
+            ).fetchone()
+            return {
+                "entries": row["entries"],
+                "size_bytes": row["size_bytes"],
+                "max_bytes": self.max_bytes,
+                "hits": row["hits"],
+            }
+        finally:
+            conn.close()
+
+
+tts_cache = TTSCache()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--stats", action="store_true", help="print cache size and hit counts")
+    parser.add_argument("--evict", action="store_true", help="trim the cache to its size budget now")
+    parser.add_argument("--clear", action="store_true", help="remove every cached blob")
+    args = parser.parse_args()
+
+    if args.clear:
+        print(f"Removed {tts_cache.evict(target_bytes=0)} entries.")
+    elif args.evict:
+        print(f"Removed {tts_cache.evict()} entries.")
+    print(json.dumps(tts_cache.stats(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,4 @@
+import atexit
 import base64
 import json
 import mimetypes
@@ -7,10 +8,15 @@ import random
 import shutil
 import sqlite3
 import subprocess
-import requests
+import tempfile
+import time
+import uuid
+from urllib.parse import quote
 import azure.cognitiveservices.speech as speechsdk
 
-from flask import Flask, render_template, jsonify, request, send_from_directory
+from flask import Flask, render_template, jsonify, request, send_from_directory, Response, url_for
+from werkzeug.exceptions import NotFound
+from werkzeug.security import safe_join
 from werkzeug.utils import secure_filename
 from dotenv import load_dotenv
 import sys
@@ -20,21 +26,52 @@ load_dotenv(os.path.join(os.path.dirname(__file__), '..', '.env'))
 
 # Add project root to path to import scripts
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
-from generate_shadowing_tts import generate_tts_for_audio_path, generate_tts_audio
+from generate_shadowing_tts import generate_tts_for_audio_path, generate_tts_audio, synthesize_to_file, stream_synthesis
+from http_client import http_client
+from metrics import metrics
+from web_app.card_sampler import CardSampler, CARD_BY_KEY_QUERY, fetch_cards
+from web_app.db import get_pool, all_pool_stats
+from web_app.rating_jobs import RatingJobQueue, QueueFull, recording_key
+from web_app.result_cache import ResultCache, audio_digest, result_key, TRANSCRIPTION, ASSESSMENT
+from web_app.result_cache import SCHEMA as RESULT_CACHE_SCHEMA
+from web_app import audio_probe
+from web_app import audio_segments
+from web_app.audio_index import AudioIndex
+from web_app.fingerprint import file_version, content_version, cache_control
+from web_app.nav_index import NavIndex
+from web_app.nav_index import SCHEMA as NAV_INDEX_SCHEMA
+from web_app.paragraph_pages import fetch_page
+from web_app.paragraph_pages import SCHEMA as PARAGRAPH_PAGES_SCHEMA
+from web_app.progress_writer import ProgressWriter
+from web_app import pitch
+from web_app import pronunciation_stats
+from web_app import search
+from web_app.scheduler import Scheduler
+from web_app import word_engine
+from web_app.word_engine import WordEngine
+from web_app.scheduler import SCHEMA as SCHEDULER_SCHEMA
 
 app = Flask(__name__)
 
 # Configuration
 BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
-DB_PATH = os.path.join(BASE_DIR, 'masterfgl.db')
-PITCH_DB_PATH = os.path.join(BASE_DIR, 'masterfgl.db')
-AUDIO_DIR = os.path.join(BASE_DIR, 'audios')
-AUDIO_BOOK_DIR = os.path.join(BASE_DIR, 'audios', 'audio_book_author')
-AUDIO_BOOK_TTS_DIR = os.path.join(BASE_DIR, 'audios', 'audio_book_tts')
-USER_AUDIO_DIR = os.path.join(BASE_DIR, 'audios', 'audios_user')
-USER_AUDIO_TTS_DIR = os.path.join(BASE_DIR, 'audios', 'audios_user_tts')
-USER_AUDIO_SHADOWING_DIR = os.path.join(BASE_DIR, 'audios', 'audios_user_shadowing')
+# FGL_DB_PATH / FGL_AUDIO_DIR point the app at another database / audio tree
+# (used by benchmarks/loadtest.py)
+DB_PATH = os.environ.get('FGL_DB_PATH', os.path.join(BASE_DIR, 'masterfgl.db'))
+PITCH_DB_PATH = DB_PATH
+AUDIO_DIR = os.environ.get('FGL_AUDIO_DIR', os.path.join(BASE_DIR, 'audios'))
+AUDIO_BOOK_DIR = os.path.join(AUDIO_DIR, 'audio_book_author')
+AUDIO_BOOK_TTS_DIR = os.path.join(AUDIO_DIR, 'audio_book_tts')
+# Per-paragraph clips of the author audio (see web_app/audio_segments.py)
+AUDIO_BOOK_SEGMENTS_DIR = os.path.join(AUDIO_DIR, 'audio_book_segments')
+USER_AUDIO_DIR = os.path.join(AUDIO_DIR, 'audios_user')
+USER_AUDIO_TTS_DIR = os.path.join(AUDIO_DIR, 'audios_user_tts')
+USER_AUDIO_SHADOWING_DIR = os.path.join(AUDIO_DIR, 'audios_user_shadowing')
 FFMPEG_BIN = shutil.which("ffmpeg")
+# Behind nginx: audio routes answer with X-Accel-Redirect and nginx sends the
+# bytes from its internal /_accel/ location (see deployment/fglenglish.nginx)
+ACCEL_REDIRECT = os.environ.get("FGL_X_ACCEL") == "1"
+ACCEL_PREFIX = "/_accel/"
 SPEECH_KEY = os.environ.get("FGL_SPEECH_SERVICE_KEY")
 SPEECH_REGION = os.environ.get("FGL_SPEECH_REGION", "eastus")
 
@@ -44,19 +81,97 @@ AZURE_ENDPOINT = os.environ.get("FOUNDRY_PROJECT_ENDPOINT")
 AZURE_API_KEY = os.environ.get("FOUNDRY_API_KEY")
 AZURE_DEPLOYMENT = os.environ.get("FOUNDRY_MODEL_NAME", "gpt-4o-mini-transcribe")
 AZURE_API_VERSION = "2024-02-15-preview"
+# Part of the transcription result cache key
+TRANSCRIPTION_CONFIG = {'deployment': AZURE_DEPLOYMENT, 'api_version': AZURE_API_VERSION}
+ASSESSMENT_TIMEOUT = 300
+RATE_WORKERS = int(os.environ.get("FGL_RATE_WORKERS", 2))
+RATE_MAX_PENDING = int(os.environ.get("FGL_RATE_MAX_PENDING", 20))
+
+MAX_CARD_BATCH = 20
+MAX_MARK_KNOWN_BATCH = 200
+# user_words write-behind (see web_app/progress_writer.py): buffered | commit | direct
+USER_WORDS_DURABILITY = os.environ.get("FGL_USER_WORDS_DURABILITY", "buffered")
+USER_WORDS_FLUSH_MS = float(os.environ.get("FGL_USER_WORDS_FLUSH_MS", 50))
+USER_WORDS_FLUSH_ROWS = int(os.environ.get("FGL_USER_WORDS_FLUSH_ROWS", 200))
+
+# Per-worker card selection state for /api/card (see web_app/card_sampler.py)
+card_sampler = CardSampler()
+# Review schedule: due cards come before new ones (see web_app/scheduler.py)
+scheduler = Scheduler()
+
+DB_POOL_SIZE = int(os.environ.get("FGL_DB_POOL_SIZE", 8))
 
 def get_db_connection():
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    return conn
+    # Pooled: conn.close() returns the connection to the per-worker pool
+    return get_pool(DB_PATH, max_size=DB_POOL_SIZE).acquire()
 
 
 def get_pitch_db_connection():
-    conn = sqlite3.connect(PITCH_DB_PATH)
-    conn.row_factory = sqlite3.Row
-    return conn
+    # Same file as DB_PATH today, so both share one pool
+    return get_pool(PITCH_DB_PATH, max_size=DB_POOL_SIZE).acquire()
+
+
+def init_schema():
+    """Create the auxiliary tables the app maintains next to the shipped schema."""
+    conn = get_db_connection()
+    try:
+        conn.executescript(audio_probe.SCHEMA)
+        conn.executescript(audio_segments.SCHEMA)
+        conn.executescript(RESULT_CACHE_SCHEMA)
+        conn.executescript(NAV_INDEX_SCHEMA)
+        conn.executescript(PARAGRAPH_PAGES_SCHEMA)
+        conn.executescript(SCHEDULER_SCHEMA)
+        conn.executescript(pronunciation_stats.SCHEMA)
+        conn.executescript(pitch.SCHEMA)
+        built = search.ensure_indexes(conn)
+        if built:
+            print(f"Built search indexes: {', '.join(built)}")
+        word_engine.ensure_schema(conn)
+    finally:
+        conn.close()
+
+
+init_schema()
+
+# Last metrics interval of this worker; registered first so it runs after the other exit hooks
+atexit.register(metrics.flush)
+
+# Transcription / assessment results keyed by audio content (see web_app/result_cache.py)
+result_cache = ResultCache(get_db_connection)
+atexit.register(result_cache.flush)
+
+# Book -> chapter -> subtitle tree for the shadowing navigator (see web_app/nav_index.py)
+nav_index = NavIndex(get_pitch_db_connection)
+
+# Chapter token arrays and per-user known-word bitsets (see web_app/word_engine.py)
+word_index = WordEngine(get_pitch_db_connection)
 
+def schedule_known_cards(conn, rows):
+    # Runs inside the user_words flush transaction
+    for (username, word, pos, level), columns in rows.items():
+        if columns.get('is_known'):
+            scheduler.mark_known(conn, username, word, pos, level, commit=False)
 
+
+# Coalesced user_words upserts from mark_known and flashcard uploads
+progress_writer = ProgressWriter(
+    get_db_connection,
+    after_write=schedule_known_cards,
+    flush_ms=USER_WORDS_FLUSH_MS,
+    max_rows=USER_WORDS_FLUSH_ROWS,
+    durability=USER_WORDS_DURABILITY,
+)
+atexit.register(progress_writer.close)
+
+# Which directory serves each filename of the multi-directory audio routes
+audio_index = AudioIndex({
+    'audios_user': [USER_AUDIO_TTS_DIR, USER_AUDIO_SHADOWING_DIR, USER_AUDIO_DIR],
+    'audios_book': [AUDIO_BOOK_DIR, AUDIO_BOOK_TTS_DIR, AUDIO_BOOK_SEGMENTS_DIR],
+})
+print(f"Audio index: {audio_index.build()} files")
+
+
+@metrics.timed('ffmpeg.convert')
 def convert_to_wav_16k_mono(src_path, dest_path):
     if not FFMPEG_BIN:
         return False, "ffmpeg not found on server"
@@ -81,11 +196,128 @@ def convert_to_wav_16k_mono(src_path, dest_path):
         return False, err_text
 
 
+UPLOAD_CHUNK_SIZE = 64 * 1024
+
+
+@metrics.timed('ffmpeg.convert_stream')
+def convert_stream_to_wav_16k_mono(stream, dest_path):
+    """Pipe an uploaded audio stream through ffmpeg into dest_path.
+
+    Nothing but the final WAV touches the disk. ffmpeg writes to a unique
+    temp name that is renamed over dest_path, so concurrent uploads of the
+    same card/paragraph never see each other's half-written files.
+    """
+    if not FFMPEG_BIN:
+        return False, "ffmpeg not found on server"
+
+    temp_path = f"{dest_path}.{uuid.uuid4().hex}.part"
+    cmd = [
+        FFMPEG_BIN,
+        "-y",
+        "-hide_banner",
+        "-loglevel",
+        "error",
+        "-i",
+        "pipe:0",
+        "-ac",
+        "1",
+        "-ar",
+        "16000",
+        "-f",
+        "wav",
+        temp_path,
+    ]
+
+    with tempfile.TemporaryFile() as stderr_file:
+        proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=stderr_file)
+        try:
+            while True:
+                chunk = stream.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                proc.stdin.write(chunk)
+        except BrokenPipeError:
+            pass  # ffmpeg exited early; its stderr says why
+        finally:
+            try:
+                proc.stdin.close()
+            except BrokenPipeError:
+                pass
+        returncode = proc.wait()
+        stderr_file.seek(0)
+        err_text = stderr_file.read().decode(errors="ignore")
+
+    if returncode != 0:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        return False, err_text or f"ffmpeg exited with {returncode}"
+
+    os.replace(temp_path, dest_path)
+    return True, None
+
+
+# Containers ffmpeg cannot demux from a pipe (MP4/M4A from Safari keep the
+# moov atom at the end), so those are spooled to a temp file first.
+SEEKABLE_UPLOAD_TYPES = ('mp4', 'm4a', 'aac', 'quicktime')
+
+
+def store_user_recording(stream, directory, base_name, content_type=None):
+    """Save an uploaded recording as <base_name>.wav (16k mono).
+
+    Falls back to writing the original upload as <base_name>.webm when ffmpeg
+    is unavailable. Returns (stored_filename, converted, error).
+    """
+    final_filename = secure_filename(f"{base_name}.wav")
+    final_path = os.path.join(directory, final_filename)
+    if FFMPEG_BIN and any(t in (content_type or '') for t in SEEKABLE_UPLOAD_TYPES):
+        suffix = uuid.uuid4().hex
+        spool_path = f"{final_path}.{suffix}.upload"
+        temp_wav = f"{final_path}.{suffix}.part.wav"
+        try:
+            with open(spool_path, 'wb') as f:
+                shutil.copyfileobj(stream, f, UPLOAD_CHUNK_SIZE)
+            converted, err = convert_to_wav_16k_mono(spool_path, temp_wav)
+            if converted:
+                os.replace(temp_wav, final_path)
+        finally:
+            for leftover in (spool_path, temp_wav):
+                try:
+                    os.remove(leftover)
+                except OSError:
+                    pass
+        return (final_filename if converted else None), converted, err
+
+    if FFMPEG_BIN:
+        converted, err = convert_stream_to_wav_16k_mono(stream, final_path)
+        return (final_filename if converted else None), converted, err
+
+    # Fallback: keep original upload if ffmpeg unavailable
+    fallback_filename = secure_filename(f"{base_name}.webm")
+    fallback_path = os.path.join(directory, fallback_filename)
+    temp_path = f"{fallback_path}.{uuid.uuid4().hex}.part"
+    with open(temp_path, 'wb') as f:
+        shutil.copyfileobj(stream, f, UPLOAD_CHUNK_SIZE)
+    os.replace(temp_path, fallback_path)
+    return fallback_filename, False, "ffmpeg not found on server"
+
+
 import time
 import threading
 
 # ... existing imports ...
 
+# Part of the assessment result cache key: update it whenever the config below changes
+ASSESSMENT_CONFIG = {
+    'language': 'en-US',
+    'grading': 'HundredMark',
+    'granularity': 'Phoneme',
+    'miscue': True,
+    'prosody': True,
+}
+
+@metrics.timed('azure.assessment')
 def run_pronunciation_assessment(file_path: str, reference_text: str):
     if not speechsdk:
         return None, "azure speech sdk not installed"
@@ -108,12 +340,11 @@ def run_pronunciation_assessment(file_path: str, reference_text: str):
     pa_config.apply_to(recognizer)
 
     # Use continuous recognition to handle longer audio files
-    done = False
+    done = threading.Event()
     results = []
     
     def stop_cb(evt):
-        nonlocal done
-        done = True
+        done.set()
 
     def recognized_cb(evt):
         if evt.result.reason == speechsdk.ResultReason.RecognizedSpeech:
@@ -131,14 +362,8 @@ def run_pronunciation_assessment(file_path: str, reference_text: str):
 
     recognizer.start_continuous_recognition()
 
-    # Wait for completion with a timeout (e.g., 5 minutes)
-    start_time = time.time()
-    while not done:
-        time.sleep(0.1)
-        if time.time() - start_time > 300:
-            recognizer.stop_continuous_recognition()
-            break
-            
+    # Block until session_stopped/canceled fires, with a timeout (5 minutes)
+    done.wait(ASSESSMENT_TIMEOUT)
     recognizer.stop_continuous_recognition()
 
     if not results:
@@ -199,6 +424,7 @@ def run_pronunciation_assessment(file_path: str, reference_text: str):
 
     return final_scores, None
 
+@metrics.timed('azure.transcribe')
 def transcribe_audio_file(file_path):
     if not AZURE_ENDPOINT or not AZURE_API_KEY:
         print("Azure credentials not found.")
@@ -256,7 +482,7 @@ def transcribe_audio_file(file_path):
     try:
         with open(file_path, 'rb') as f:
             files = {'file': (os.path.basename(file_path), f, mime_type)}
-            response = requests.post(url, headers=headers, files=files)
+            response = http_client.post(url, name='transcribe', headers=headers, files=files)
             
         if response.status_code == 200:
             return response.json().get('text')
@@ -267,130 +493,211 @@ def transcribe_audio_file(file_path):
         print(f"Transcription error: {e}")
         return None
 
+@app.before_request
+def start_request_timing():
+    metrics.start_trace()
+    # nginx sets X-Request-Start: t=<epoch seconds>; the gap is time spent
+    # waiting for a free gunicorn worker
+    queued = request.headers.get('X-Request-Start', '')
+    try:
+        wait = time.time() - float(queued.lstrip('t='))
+    except ValueError:
+        return
+    if 0 <= wait < 3600:
+        metrics.observe('fgl_http_queue_seconds', {}, wait)
+
+def finish_request_timing(status):
+    route = request.url_rule.rule if request.url_rule else '<unmatched>'
+    elapsed = metrics.end_trace('request', f'{request.method} {route}', status)
+    if elapsed is None:
+        return
+    labels = {'method': request.method, 'route': route}
+    metrics.observe('fgl_http_request_duration_seconds', labels, elapsed)
+    metrics.inc('fgl_http_responses_total', {**labels, 'status': status})
+    metrics.maybe_flush()
+    result_cache.maybe_flush()
+
+@app.after_request
+def record_request_timing(response):
+    finish_request_timing(response.status_code)
+    return response
+
+@app.teardown_request
+def record_failed_request(exc):
+    # after_request is skipped for unhandled exceptions
+    if exc is not None:
+        finish_request_timing(500)
+
+@app.route('/metrics')
+def get_metrics():
+    # Prometheus scrape target; sums every gunicorn worker (see metrics.py)
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/metrics/slow')
+def get_slow_requests():
+    # Populated when FGL_SLOW_REQUEST_MS is set
+    limit = min(request.args.get('limit', 50, type=int), 500)
+    return jsonify(metrics.slow_samples(limit))
+
 @app.route('/')
 def index():
     return render_template('index.html')
 
+def send_audio(directory, filename):
+    """send_from_directory, or an X-Accel-Redirect for nginx when FGL_X_ACCEL=1.
+
+    URLs from audio_url() carry ?v=<version> and are cached as immutable;
+    ETag / Last-Modified / Range are handled by send_file (or nginx).
+    """
+    path = safe_join(directory, filename)
+    version = file_version(path) if path else None
+    if version is None:
+        raise NotFound()
+
+    if ACCEL_REDIRECT:
+        if not path.startswith(AUDIO_DIR + os.sep):
+            raise NotFound()
+        response = Response(mimetype=mimetypes.guess_type(filename)[0] or 'application/octet-stream')
+        response.headers['X-Accel-Redirect'] = ACCEL_PREFIX + quote(os.path.relpath(path, AUDIO_DIR))
+    else:
+        # ETag = the ?v= version, as advertised in /api/cards preload hints
+        response = send_from_directory(directory, filename, etag=version)
+    response.headers['Cache-Control'] = cache_control(request.args.get('v'), version)
+    return response
+
+def audio_path(route, filename):
+    """Absolute path /<route>/<filename> would serve, or None."""
+    if not filename:
+        return None
+    if route == 'audios':
+        directory = AUDIO_DIR
+    else:
+        directory = audio_index.lookup(route, filename)
+    return safe_join(directory, filename) if directory else None
+
+def audio_url(route, filename):
+    """Fingerprinted /<route>/<filename>?v=<version>, or None if the file is missing."""
+    path = audio_path(route, filename)
+    version = file_version(path) if path else None
+    if version is None:
+        return None
+    return f"/{route}/{quote(filename)}?v={version}"
+
+def audio_preload(route, filename):
+    """{url, size, etag} of an audio file for client-side prefetching, or None if missing."""
+    path = audio_path(route, filename)
+    try:
+        st = os.stat(path) if path else None
+    except OSError:
+        st = None
+    if st is None:
+        return None
+    version = file_version(path)
+    return {'url': f"/{route}/{quote(filename)}?v={version}", 'size': st.st_size, 'etag': version}
+
+def asset_url(filename):
+    """url_for('static') with a content hash, so edited JS/CSS gets a new URL."""
+    return url_for('static', filename=filename, v=content_version(os.path.join(app.static_folder, filename)))
+
+@app.context_processor
+def inject_asset_url():
+    return {'asset_url': asset_url}
+
+@app.after_request
+def cache_static_assets(response):
+    if request.endpoint == 'static' and response.status_code in (200, 206, 304):
+        filename = request.view_args.get('filename', '')
+        response.headers['Cache-Control'] = cache_control(
+            request.args.get('v'), content_version(os.path.join(app.static_folder, filename))
+        )
+    return response
+
 @app.route('/audios/<path:filename>')
 def serve_audio(filename):
-    return send_from_directory(AUDIO_DIR, filename)
+    return send_audio(AUDIO_DIR, filename)
 
 @app.route('/audios_user/<path:filename>')
 def serve_user_audio(filename):
-    # Check TTS directory first, then shadowing directory, then legacy directory
-    if os.path.exists(os.path.join(USER_AUDIO_TTS_DIR, filename)):
-        return send_from_directory(USER_AUDIO_TTS_DIR, filename)
-    if os.path.exists(os.path.join(USER_AUDIO_SHADOWING_DIR, filename)):
-        return send_from_directory(USER_AUDIO_SHADOWING_DIR, filename)
-    # Fallback to legacy directory for backward compatibility
-    if os.path.exists(os.path.join(USER_AUDIO_DIR, filename)):
-        return send_from_directory(USER_AUDIO_DIR, filename)
-    # Default to TTS directory (will 404 if not found)
-    return send_from_directory(USER_AUDIO_TTS_DIR, filename)
+    # TTS directory first, then shadowing, then legacy (default: TTS, will 404)
+    directory = audio_index.lookup('audios_user', filename) or USER_AUDIO_TTS_DIR
+    return send_audio(directory, filename)
 
 @app.route('/audios_book/<path:filename>')
 def serve_book_audio(filename):
-    # Check if file exists in author directory
-    if os.path.exists(os.path.join(AUDIO_BOOK_DIR, filename)):
-        return send_from_directory(AUDIO_BOOK_DIR, filename)
-    # Check if file exists in TTS directory
-    if os.path.exists(os.path.join(AUDIO_BOOK_TTS_DIR, filename)):
-        return send_from_directory(AUDIO_BOOK_TTS_DIR, filename)
-    # Default to author directory (will 404 if not found)
-    return send_from_directory(AUDIO_BOOK_DIR, filename)
+    # Author directory first, then TTS (default: author, will 404)
+    directory = audio_index.lookup('audios_book', filename) or AUDIO_BOOK_DIR
+    return send_audio(directory, filename)
 
 @app.route('/shadowing')
 def shadowing():
     return render_template('shadowing.html')
 
+def nav_response(etag, body):
+    # no-cache: the browser keeps the body but revalidates it (If-None-Match -> 304)
+    response = Response(body, mimetype='application/json')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response.make_conditional(request)
+
 @app.route('/api/shadowing/books')
 def get_shadowing_books():
     try:
-        conn = get_pitch_db_connection()
-        rows = conn.execute('SELECT DISTINCT book FROM paragraphs WHERE book IS NOT NULL ORDER BY book').fetchall()
-        conn.close()
-        return jsonify([row['book'] for row in rows])
+        return nav_response(*nav_index.books())
     except Exception as e:
         print(f"Error in get_shadowing_books: {e}")
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/shadowing/structure')
 def get_shadowing_structure():
+    # {book, paragraphs, first_id, last_id, chapters: [{chapter, ..., subtitles: [...]}]}
     try:
         book = request.args.get('book')
-        print(f"Fetching shadowing structure for book: {book}")
-        
-        conn = get_pitch_db_connection()
-        
-        query = 'SELECT DISTINCT chapter, subtitle FROM paragraphs WHERE 1=1'
-        params = []
-        
-        if book:
-            query += ' AND book = ?'
-            params.append(book)
-            
-        query += ' ORDER BY id'
-        
-        rows = conn.execute(query, params).fetchall()
-        conn.close()
-        
-        structure = {}
-        for row in rows:
-            chapter = row['chapter']
-            subtitle = row['subtitle']
-            
-            if not chapter:
-                continue
-                
-            if chapter not in structure:
-                structure[chapter] = []
-            
-            if subtitle and subtitle not in structure[chapter]:
-                structure[chapter].append(subtitle)
-        
-        print(f"Found {len(structure)} chapters.")
-        return jsonify(structure)
+        return nav_response(*nav_index.structure(book))
     except Exception as e:
         print(f"Error in get_shadowing_structure: {e}")
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/shadowing/content')
 def get_shadowing_content():
+    # Keyset pagination: pass the returned next_after_id as after_id for the next page
     try:
         book = request.args.get('book')
         chapter = request.args.get('chapter')
         subtitle = request.args.get('subtitle')
+        after_id = request.args.get('after_id', type=int)
         offset = request.args.get('offset', 0, type=int)
         limit = request.args.get('limit', 100, type=int)
         
-        print(f"Fetching content for book: {book}, chapter: {chapter}, subtitle: {subtitle}")
+        print(f"Fetching content for book: {book}, chapter: {chapter}, subtitle: {subtitle}, after_id: {after_id}")
         
         conn = get_pitch_db_connection()
-        
-        query = 'SELECT * FROM paragraphs WHERE 1=1'
-        params = []
-        
-        if book:
-            query += ' AND book = ?'
-            params.append(book)
-        
-        if chapter:
-            query += ' AND chapter = ?'
-            params.append(chapter)
-        
-        if subtitle:
-            query += ' AND subtitle = ?'
-            params.append(subtitle)
-            
-        query += ' ORDER BY id LIMIT ? OFFSET ?'
-        params.extend([limit, offset])
-        
-        paragraphs = conn.execute(query, params).fetchall()
+        paragraphs, next_after_id = fetch_page(
+            conn, book, chapter, subtitle, after_id=after_id, limit=limit, offset=offset
+        )
+        segments = audio_segments.segments_for(conn, [row['id'] for row in paragraphs])
         conn.close()
         
-        result = [dict(row) for row in paragraphs]
+        result = []
+        for row in paragraphs:
+            item = dict(row)
+            # Fingerprinted URLs: cached for good, and a re-recording gets a new one
+            item['audio_url'] = audio_url('audios_book', os.path.basename(row['audio_path'] or ''))
+            segment = segments.get(row['id'])
+            if segment and item['audio_url']:
+                # The paragraph's own clip, else its span of the chapter file
+                # (a media fragment the browser fetches with range requests)
+                clip_url = audio_url('audios_book', os.path.basename(segment['clip_path'] or ''))
+                item['audio_segment'] = {
+                    'start': segment['start_ms'] / 1000, 'end': segment['end_ms'] / 1000, 'clip': bool(clip_url)
+                }
+                item['audio_url'] = clip_url or (
+                    f"{item['audio_url']}#t={segment['start_ms'] / 1000:.2f},{segment['end_ms'] / 1000:.2f}"
+                )
+            item['tts_audio_url'] = audio_url('audios_book', os.path.basename(row['tts_audio_path'] or ''))
+            item['user_audio_url'] = audio_url('audios_user', row['user_audio_path'])
+            result.append(item)
         print(f"Found {len(result)} paragraphs.")
-        return jsonify(result)
+        return jsonify({'paragraphs': result, 'next_after_id': next_after_id})
     except Exception as e:
         print(f"Error in get_shadowing_content: {e}")
         return jsonify({'error': str(e)}), 500
@@ -441,26 +748,95 @@ def generate_shadowing_tts():
         # DB path should be relative
         db_path = f"audios/audio_book_tts/{new_filename}"
         
-        # We need to import generate_tts_audio or use the one in app.py
-        # It is defined in app.py
-        
-        success, err = generate_tts_audio(content, abs_output_path)
+        # Identical text is served from the shared TTS cache without a remote call
+        cached = synthesize_to_file(content, abs_output_path)
+        audio_index.add(AUDIO_BOOK_TTS_DIR, new_filename)
         
-        if success:
+        conn.execute(
+            "UPDATE paragraphs SET tts_audio_path = ? WHERE id = ?",
+            (db_path, paragraph_id)
+        )
+        conn.commit()
+        conn.close()
+        return jsonify({
+            'success': True, 'tts_path': db_path, 'tts_url': audio_url('audios_book', new_filename), 'cached': cached
+        })
+            
+    except Exception as e:
+        conn.close()
+        print(f"Error generating TTS: {e}")
+        return jsonify({'error': f'TTS generation failed: {e}'}), 500
+
+@app.route('/api/shadowing/tts_stream/<int:paragraph_id>')
+def stream_shadowing_tts(paragraph_id):
+    # Relays the TTS audio as it is synthesized so the <audio> element can start
+    # playing at the first chunk; the file lands in audio_book_tts/ at the end.
+    conn = get_pitch_db_connection()
+    paragraph = conn.execute(
+        'SELECT content, tts_audio_path FROM paragraphs WHERE id = ?',
+        (paragraph_id,)
+    ).fetchone()
+    conn.close()
+
+    if not paragraph:
+        return jsonify({'error': 'Paragraph not found'}), 404
+
+    content = paragraph['content']
+    if not content or not content.strip():
+        return jsonify({'error': 'Empty text'}), 400
+
+    new_filename = f"chunk_{paragraph_id}_tts.mp3"
+    abs_output_path = os.path.join(AUDIO_BOOK_TTS_DIR, new_filename)
+    db_path = f"audios/audio_book_tts/{new_filename}"
+
+    if paragraph['tts_audio_path'] == db_path and os.path.exists(abs_output_path):
+        return send_audio(AUDIO_BOOK_TTS_DIR, new_filename)
+
+    def save_tts_path(cached):
+        audio_index.add(AUDIO_BOOK_TTS_DIR, new_filename)
+        conn = get_pitch_db_connection()
+        try:
             conn.execute(
                 "UPDATE paragraphs SET tts_audio_path = ? WHERE id = ?",
                 (db_path, paragraph_id)
             )
             conn.commit()
+        finally:
             conn.close()
-            return jsonify({'success': True, 'tts_path': db_path})
-        else:
-            conn.close()
-            return jsonify({'error': f'TTS generation failed: {err}'}), 500
-            
+        print(f"TTS stream for paragraph {paragraph_id} saved ({'cached' if cached else 'synthesized'})")
+
+    chunks = stream_synthesis(content, abs_output_path, on_complete=save_tts_path)
+    try:
+        # Pull the first chunk here so upstream errors still get a JSON response
+        first = next(chunks, b'')
     except Exception as e:
-        conn.close()
-        return jsonify({'error': str(e)}), 500
+        print(f"Error streaming TTS: {e}")
+        return jsonify({'error': f'TTS generation failed: {e}'}), 502
+
+    def relay():
+        try:
+            yield first
+            yield from chunks
+        finally:
+            chunks.close()
+
+    response = Response(relay(), mimetype='audio/mpeg')
+    response.headers['Cache-Control'] = 'no-store'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+@app.route('/api/db/stats')
+def get_db_stats():
+    return jsonify(all_pool_stats())
+
+@app.route('/api/audio_index/stats')
+def get_audio_index_stats():
+    return jsonify(audio_index.stats())
+
+@app.route('/api/http/stats')
+def get_http_stats():
+    # Per-call latency split (connect / TTFB / transfer) for TTS and transcription
+    return jsonify(http_client.stats())
 
 @app.route('/api/levels')
 def get_levels():
@@ -469,6 +845,26 @@ def get_levels():
     conn.close()
     return jsonify([row['level'] for row in levels])
 
+def card_payload(card, preload=False):
+    """JSON body of a flashcard: the row plus fingerprinted audio URLs."""
+    card = dict(card)
+    card.pop('user_is_known', None)
+    hints = []
+    for audio_type in ('formal', 'informal'):
+        native = card.get(f'audio_{audio_type}_path') or ''
+        sources = (
+            (f'audio_{audio_type}', 'audios', native[len('audios/'):] if native.startswith('audios/') else None),
+            (f'user_audio_{audio_type}', 'audios_user', card.get(f'user_audio_{audio_type}_path')),
+        )
+        for kind, route, filename in sources:
+            hint = audio_preload(route, filename)
+            card[f'{kind}_url'] = hint['url'] if hint else None
+            if hint:
+                hints.append({'kind': kind, **hint})
+    if preload:
+        card['preload'] = hints
+    return card
+
 @app.route('/api/card')
 def get_card():
     level = request.args.get('level')
@@ -478,36 +874,91 @@ def get_card():
         return jsonify({'error': 'Username is required'}), 400
 
     conn = get_db_connection()
-    
-    # Query to get words not known by the user
-    # We prioritize user_words data over oxford_words for user specific fields
-    query = """
-        SELECT ow.*, 
-               uw.user_audio_formal_path, uw.user_audio_informal_path,
-               uw.user_transcription_formal, uw.user_transcription_informal
-        FROM oxford_words ow
-        LEFT JOIN user_words uw 
-        ON ow.word = uw.word AND ow.pos = uw.pos AND ow.level = uw.level AND uw.username = ?
-        WHERE (uw.is_known IS NULL OR uw.is_known = 0)
-        AND (ow.audio_formal_path IS NOT NULL OR ow.audio_informal_path IS NOT NULL)
-        AND ((ow.sentence_formal IS NOT NULL AND ow.sentence_formal != '') OR (ow.sentence_informal IS NOT NULL AND ow.sentence_informal != ''))
-    """
-    params = [username]
-    
-    if level and level != 'all':
-        query += " AND ow.level = ?"
-        params.append(level)
-    
-    query += " ORDER BY RANDOM() LIMIT 1"
-    
-    card = conn.execute(query, params).fetchone()
+    # Most overdue review first (one index lookup), otherwise a new card
+    due = scheduler.next_due(conn, username, level)
+    card = conn.execute(CARD_BY_KEY_QUERY, (username, *due)).fetchone() if due else None
+    if card is None:
+        card = card_sampler.draw(conn, username, level)
+    # ?examples=n adds up to n book sentences that use the word
+    examples = max(0, min(request.args.get('examples', 0, type=int), 10))
+    book_sentences = search.book_sentences_for_word(conn, card['word'], examples) if card and examples else None
     conn.close()
     
     if card:
-        return jsonify(dict(card))
+        payload = card_payload(card)
+        if book_sentences is not None:
+            payload['book_sentences'] = book_sentences
+        return jsonify(payload)
     else:
         return jsonify({'error': 'No cards found'}), 404
 
+@app.route('/api/cards')
+def get_cards():
+    """Next n distinct cards (due reviews first) with preload hints for their audio.
+
+    exclude=<word>|<pos>|<level> (repeatable) skips cards the client already holds.
+    """
+    level = request.args.get('level')
+    username = request.args.get('username')
+    n = max(1, min(request.args.get('n', 5, type=int), MAX_CARD_BATCH))
+
+    if not username:
+        return jsonify({'error': 'Username is required'}), 400
+
+    exclude = set()
+    for key in request.args.getlist('exclude')[:MAX_CARD_BATCH * 4]:
+        parts = tuple(key.split('|'))
+        if len(parts) == 3:
+            exclude.add(parts)
+
+    conn = get_db_connection()
+    due = scheduler.due_cards(conn, username, level, n, exclude)
+    cards = fetch_cards(conn, username, due)
+    if len(cards) < n:
+        cards += card_sampler.draw_many(conn, username, level, n - len(cards), exclude | set(due))
+    conn.close()
+
+    return jsonify({'cards': [card_payload(card, preload=True) for card in cards]})
+
+@app.route('/api/search')
+def search_text():
+    """Ranked full-text matches with snippets.
+
+    scope=paragraphs,sentences,oxford (default all); book/chapter filter the
+    book scopes (and leave out oxford), level filters oxford; prefix=1 lets
+    the last word match as a prefix.
+    """
+    q = request.args.get('q', '').strip()
+    if not q:
+        return jsonify({'error': 'Query is required'}), 400
+    scopes = [s for s in request.args.get('scope', ','.join(search.SCOPES)).split(',') if s]
+    if not scopes or any(s not in search.SCOPES for s in scopes):
+        return jsonify({'error': f"scope must be a comma-separated subset of {', '.join(search.SCOPES)}"}), 400
+
+    conn = get_db_connection()
+    results = search.search(
+        conn, q, scopes,
+        book=request.args.get('book'),
+        chapter=request.args.get('chapter'),
+        level=request.args.get('level'),
+        limit=request.args.get('limit', 20, type=int),
+        prefix=request.args.get('prefix') == '1',
+    )
+    conn.close()
+    return jsonify({'query': q, **results})
+
+@app.route('/api/card/examples')
+def get_card_examples():
+    """Book sentences that use a flashcard word."""
+    word = request.args.get('word')
+    if not word:
+        return jsonify({'error': 'Word is required'}), 400
+    limit = max(1, min(request.args.get('limit', 3, type=int), search.MAX_RESULTS))
+    conn = get_db_connection()
+    sentences = search.book_sentences_for_word(conn, word, limit)
+    conn.close()
+    return jsonify({'word': word, 'sentences': sentences})
+
 @app.route('/api/mark_known', methods=['POST'])
 def mark_known():
     data = request.json
@@ -520,58 +971,115 @@ def mark_known():
         return jsonify({'error': 'Missing parameters'}), 400
         
     conn = get_db_connection()
-    # Upsert into user_words
-    conn.execute(
-        """
-        INSERT INTO user_words (username, word, pos, level, is_known)
-        VALUES (?, ?, ?, ?, 1)
-        ON CONFLICT(username, word, pos, level) 
-        DO UPDATE SET is_known = 1
-        """,
-        (username, word, pos, level)
-    )
-    conn.commit()
+    scheduler.ensure_migrated(conn, username)
     conn.close()
+    # Buffered upsert into user_words; the card schedule is updated in the same flush
+    progress_writer.put(username, word, pos, level, is_known=1)
+    card_sampler.retire(username, word, pos, level)
     
     return jsonify({'success': True})
 
+@app.route('/api/mark_known/batch', methods=['POST'])
+def mark_known_batch():
+    """Mark many cards known at once: {"username": ..., "words": [{"word", "pos", "level"}, ...]}."""
+    data = request.json or {}
+    username = data.get('username')
+    words = data.get('words')
+
+    if not username or not isinstance(words, list) or not words:
+        return jsonify({'error': 'Missing parameters'}), 400
+    if len(words) > MAX_MARK_KNOWN_BATCH:
+        return jsonify({'error': f'At most {MAX_MARK_KNOWN_BATCH} words per request'}), 400
+    keys = []
+    for item in words:
+        key = tuple(item.get(k) for k in ('word', 'pos', 'level')) if isinstance(item, dict) else ()
+        if len(key) != 3 or not all(key):
+            return jsonify({'error': 'Each word needs word, pos and level'}), 400
+        keys.append(key)
+
+    conn = get_db_connection()
+    scheduler.ensure_migrated(conn, username)
+    conn.close()
+    for word, pos, level in keys:
+        progress_writer.put(username, word, pos, level, is_known=1)
+        card_sampler.retire(username, word, pos, level)
+
+    return jsonify({'success': True, 'marked': len(keys)})
+
+@app.route('/api/review', methods=['POST'])
+def review_card():
+    """Self-graded review (SM-2 grade 0-5) of a flashcard."""
+    data = request.json or {}
+    word = data.get('word')
+    pos = data.get('pos')
+    level = data.get('level')
+    username = data.get('username')
+    grade = data.get('grade')
+
+    if not all([word, pos, level, username]) or grade not in (0, 1, 2, 3, 4, 5):
+        return jsonify({'error': 'Missing parameters or grade not in 0-5'}), 400
+
+    conn = get_db_connection()
+    schedule = scheduler.review(conn, username, word, pos, level, grade)
+    conn.close()
+    card_sampler.retire(username, word, pos, level)
+
+    return jsonify({'success': True, **schedule})
+
+@app.route('/api/user_words/stats')
+def get_user_words_stats():
+    # This worker's write-behind buffer: updates, coalesced updates, flushes
+    return jsonify(progress_writer.stats())
+
+@app.route('/api/schedule/stats')
+def get_schedule_stats():
+    username = request.args.get('username')
+    if not username:
+        return jsonify({'error': 'Username is required'}), 400
+    conn = get_db_connection()
+    scheduler.ensure_migrated(conn, username)
+    stats = scheduler.stats(conn, username)
+    conn.close()
+    return jsonify(stats)
+
 @app.route('/api/upload_audio', methods=['POST'])
 def upload_audio():
-    if 'audio' not in request.files:
-        return jsonify({'error': 'No audio file'}), 400
-        
-    file = request.files['audio']
-    source = request.form.get('source')
-    username = request.form.get('username')
+    if request.content_type and request.content_type.startswith('audio/'):
+        # Raw body upload: metadata in the query string, body piped straight into ffmpeg
+        params = request.args
+        stream = request.stream
+        content_type = request.content_type
+    else:
+        if 'audio' not in request.files:
+            return jsonify({'error': 'No audio file'}), 400
+        file = request.files['audio']
+        if file.filename == '':
+            return jsonify({'error': 'No selected file'}), 400
+        params = request.form
+        stream = file.stream
+        content_type = file.mimetype
+
+    source = params.get('source')
+    username = params.get('username')
     
     if not username and source != 'shadowing': # Shadowing might not strictly require it yet, but flashcards do
          return jsonify({'error': 'Username required'}), 400
 
-    if file.filename == '':
-        return jsonify({'error': 'No selected file'}), 400
-
     if source == 'shadowing':
-        sentence_id = request.form.get('id')
+        sentence_id = params.get('id')
         if not sentence_id:
              return jsonify({'error': 'Missing sentence ID'}), 400
         
-        temp_filename = secure_filename(f"shadowing_{sentence_id}_user.webm")
-        temp_path = os.path.join(USER_AUDIO_SHADOWING_DIR, temp_filename)
-        file.save(temp_path)
-        
-        final_filename = secure_filename(f"shadowing_{sentence_id}_user.wav")
-        final_path = os.path.join(USER_AUDIO_SHADOWING_DIR, final_filename)
-        converted, err = convert_to_wav_16k_mono(temp_path, final_path)
-        
-        if converted:
-            try:
-                os.remove(temp_path)
-            except OSError:
-                pass
-            stored_filename = final_filename
-        else:
-            stored_filename = temp_filename
+        stored_filename, converted, err = store_user_recording(
+            stream, USER_AUDIO_SHADOWING_DIR, f"shadowing_{sentence_id}_user", content_type
+        )
+        if not stored_filename:
+            return jsonify({'error': f'Audio conversion failed: {err}'}), 500
+        audio_index.add(USER_AUDIO_SHADOWING_DIR, stored_filename)
             
+        stored_path = os.path.join(USER_AUDIO_SHADOWING_DIR, stored_filename)
+        audio_format = audio_probe.probe_wav(stored_path)
+
         # Update DB with user audio path
         try:
             conn = get_pitch_db_connection()
@@ -580,20 +1088,24 @@ def upload_audio():
                 "UPDATE paragraphs SET user_audio_path = ? WHERE id = ?",
                 (stored_filename, sentence_id)
             )
+            audio_probe.record_probe(conn, os.path.relpath(stored_path, BASE_DIR), stored_path, audio_format)
             conn.commit()
             conn.close()
             print(f"Shadowing audio saved: {stored_filename} for paragraph {sentence_id}")
         except Exception as e:
             print(f"Error updating user audio path in DB: {e}")
             
-        return jsonify({'success': True, 'path': stored_filename, 'converted': converted, 'error': err})
-
-    word = request.form.get('word')
-    pos = request.form.get('pos')
-    level = request.form.get('level')
+        return jsonify({
+            'success': True, 'path': stored_filename, 'url': audio_url('audios_user', stored_filename),
+            'converted': converted, 'error': err, 'format': audio_format,
+        })
+
+    word = params.get('word')
+    pos = params.get('pos')
+    level = params.get('level')
         
-    if file and word:
-        audio_type = request.form.get('type', 'formal') # 'formal' or 'informal'
+    if word:
+        audio_type = params.get('type', 'formal') # 'formal' or 'informal'
         
         # Get existing audio path to derive ID
         conn = get_db_connection()
@@ -620,39 +1132,37 @@ def upload_audio():
         # Sanitize username
         safe_username = secure_filename(username)
         
-        temp_filename = secure_filename(f"{audio_id_str}_{audio_type}_{safe_username}.webm")
-        temp_path = os.path.join(USER_AUDIO_TTS_DIR, temp_filename)
-        file.save(temp_path)
-
-        final_filename = secure_filename(f"{audio_id_str}_{audio_type}_{safe_username}.wav")
-        final_path = os.path.join(USER_AUDIO_TTS_DIR, final_filename)
-        converted, err = convert_to_wav_16k_mono(temp_path, final_path)
-        if converted:
-            try:
-                os.remove(temp_path)
-            except OSError:
-                pass
-            stored_filename = final_filename
-        else:
-            # Fallback: keep original upload if ffmpeg unavailable
-            stored_filename = temp_filename
+        stored_filename, converted, err = store_user_recording(
+            stream, USER_AUDIO_TTS_DIR, f"{audio_id_str}_{audio_type}_{safe_username}", content_type
+        )
+        if not stored_filename:
+            conn.close()
+            return jsonify({'error': f'Audio conversion failed: {err}'}), 500
+        audio_index.add(USER_AUDIO_TTS_DIR, stored_filename)
         
         # Update user_words table
         column_to_update = 'user_audio_formal_path' if audio_type == 'formal' else 'user_audio_informal_path'
 
-        conn.execute(
-            f"""
-            INSERT INTO user_words (username, word, pos, level, {column_to_update})
-            VALUES (?, ?, ?, ?, ?)
-            ON CONFLICT(username, word, pos, level) 
-            DO UPDATE SET {column_to_update} = ?
-            """,
-            (username, word, pos, level, stored_filename, stored_filename)
-        )
+        # Waits for the flush: /api/rate and /api/transcribe (possibly on another
+        # worker) read this path right after the upload
+        if not progress_writer.put(username, word, pos, level, wait=True, **{column_to_update: stored_filename}):
+            # Flush timed out or failed: write the row ourselves before answering
+            try:
+                progress_writer.write(username, word, pos, level, **{column_to_update: stored_filename})
+            except sqlite3.Error as e:
+                conn.close()
+                print(f"Error saving upload path for {username}/{word}: {e}")
+                return jsonify({'error': 'Recording saved but not recorded yet, try again'}), 503
+        stored_path = os.path.join(USER_AUDIO_TTS_DIR, stored_filename)
+        audio_format = audio_probe.probe_wav(stored_path)
+        audio_probe.record_probe(conn, os.path.relpath(stored_path, BASE_DIR), stored_path, audio_format)
         conn.commit()
         conn.close()
         
-        return jsonify({'success': True, 'path': stored_filename, 'converted': converted, 'error': err})
+        return jsonify({
+            'success': True, 'path': stored_filename, 'url': audio_url('audios_user', stored_filename),
+            'converted': converted, 'error': err, 'format': audio_format,
+        })
         
     return jsonify({'error': 'Upload failed'}), 500
 
@@ -688,8 +1198,29 @@ def transcribe_endpoint():
         conn.close()
         return jsonify({'error': 'Audio file missing on server'}), 404
         
-    # Perform transcription
-    transcription = transcribe_audio_file(file_path)
+    # Same recording bytes => same transcription; 'no_cache' forces a fresh call
+    fresh = bool(data.get('no_cache'))
+    digest = audio_digest(file_path)
+    cache_key = result_key(TRANSCRIPTION, digest, None, TRANSCRIPTION_CONFIG)
+    cached_result = None
+    if fresh:
+        result_cache.record_bypass(TRANSCRIPTION)
+    else:
+        cached_result = result_cache.get(TRANSCRIPTION, cache_key)
+
+    if cached_result is not None:
+        transcription = cached_result['text']
+    else:
+        # Perform transcription
+        started = time.perf_counter()
+        transcription = transcribe_audio_file(file_path)
+        if transcription:
+            info = audio_probe.probe_wav(file_path)
+            result_cache.put(
+                TRANSCRIPTION, cache_key, digest, {'text': transcription},
+                elapsed_ms=(time.perf_counter() - started) * 1000,
+                audio_seconds=info['duration_seconds'] if info else None,
+            )
     
     if transcription:
         # Save to DB (user_words)
@@ -701,14 +1232,158 @@ def transcribe_endpoint():
         )
         conn.commit()
         conn.close()
-        return jsonify({'success': True, 'transcription': transcription})
+        return jsonify({'success': True, 'transcription': transcription, 'cached': cached_result is not None})
     else:
         conn.close()
         return jsonify({'error': 'Transcription failed'}), 500
 
 
+def save_pronunciation_report(result, audio_id, speech_type, source, username=None):
+    conn = get_db_connection()
+    try:
+        cur = conn.execute(
+            """
+            INSERT INTO pronunciation_reports (
+                audio_id,
+                pronunciation_score,
+                accuracy_score,
+                fluency_score,
+                prosody_score,
+                total_score,
+                recognized_text,
+                mispronunciations_json,
+                prosody_issues_json,
+                report_md_path,
+                speech_type,
+                source,
+                username
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            (
+                audio_id,
+                result.get("pronunciation_score"),
+                result.get("accuracy_score"),
+                result.get("fluency_score"),
+                result.get("prosody_score"),
+                result.get("total_score"),
+                result.get("recognized_text"),
+                json.dumps(result.get("mispronunciations", [])),
+                json.dumps({}),
+                None,
+                speech_type,
+                source,
+                username
+            ),
+        )
+        # Running per-user/word/paragraph aggregates, committed with the report
+        pronunciation_stats.record_report(conn, cur.lastrowid, {
+            **result, 'audio_id': audio_id, 'source': source, 'username': username,
+        })
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def run_rating_job(payload):
+    """Executed on a rating worker thread: convert, assess and store the report."""
+    metrics.start_trace()
+    if payload.get('queued_at'):
+        metrics.record_span('rating.queue_wait', max(0.0, time.time() - payload['queued_at']))
+    result, err = None, None
+    try:
+        result, err = assess_recording(payload)
+        return result, err
+    finally:
+        metrics.end_trace('rating_job', payload['source'], 'failed' if err or result is None else 'done')
+        metrics.maybe_flush()
+        result_cache.maybe_flush()
+
+
+def assess_recording(payload):
+    file_path = payload['file_path']
+    if not os.path.exists(file_path):
+        return None, 'Audio file missing on server'
+
+    # Uploads are normally already 16k mono PCM (upload_audio converts them);
+    # only fork ffmpeg for legacy or fallback files.
+    started = time.perf_counter()
+    converted = False
+    use_path = file_path
+    info = audio_probe.probe_wav(file_path)
+    if not audio_probe.is_assessment_ready(info):
+        work_dir = os.path.dirname(file_path)
+        temp_wav = os.path.join(work_dir, f"_rate_{uuid.uuid4().hex}_{os.path.basename(file_path)}.wav")
+        converted, err = convert_to_wav_16k_mono(file_path, temp_wav)
+        if converted:
+            use_path = temp_wav
+            info = audio_probe.probe_wav(temp_wav)
+
+    try:
+        result, err = run_pronunciation_assessment(use_path, payload['reference_text'])
+    finally:
+        if converted:
+            try:
+                os.remove(temp_wav)
+            except OSError:
+                pass
+
+    if err:
+        return None, err
+
+    if payload.get('cache_key'):
+        result_cache.put(
+            ASSESSMENT, payload['cache_key'], payload['audio_sha256'], result,
+            elapsed_ms=(time.perf_counter() - started) * 1000,
+            audio_seconds=info['duration_seconds'] if info else None,
+        )
+
+    if payload.get('audio_id') is not None:
+        try:
+            save_pronunciation_report(
+                result,
+                payload['audio_id'],
+                payload['speech_type'],
+                payload['source'],
+                payload.get('username'),
+            )
+        except Exception as e:
+            print(f"Error saving {payload['source']} report: {e}")
+
+    # A flashcard assessment counts as a review of that card
+    if payload.get('card') and payload.get('username'):
+        word, pos, level = payload['card']
+        conn = get_db_connection()
+        try:
+            scheduler.review_score(conn, payload['username'], word, pos, level, result['pronunciation_score'])
+        except Exception as e:
+            print(f"Error scheduling {word} for {payload['username']}: {e}")
+        finally:
+            conn.close()
+        card_sampler.retire(payload['username'], word, pos, level)
+
+    return result, None
+
+
+rating_jobs = RatingJobQueue(
+    get_db_connection,
+    run_rating_job,
+    max_workers=RATE_WORKERS,
+    max_pending=RATE_MAX_PENDING,
+)
+
+
+def rating_job_response(job):
+    body = {'job_id': job['job_id'], 'status': job['status']}
+    if job['status'] == 'done':
+        return jsonify({'success': True, **body, 'cached': False, **job.get('result', {})}), 200
+    if job['status'] == 'failed':
+        return jsonify({'success': False, **body, 'error': job.get('error')}), 200
+    return jsonify({'success': True, **body}), 202
+
+
 @app.route('/api/rate', methods=['POST'])
 def rate_endpoint():
+    """Queue a pronunciation assessment; poll /api/rate/jobs/<job_id> for the result."""
     if not speechsdk:
         return jsonify({'error': 'Azure Speech SDK not installed on server'}), 500
 
@@ -725,171 +1400,246 @@ def rate_endpoint():
         file_path = os.path.join(USER_AUDIO_SHADOWING_DIR, audio_path)
         if not os.path.exists(file_path):
             return jsonify({'error': 'Audio file missing on server'}), 404
-            
-        # Ensure WAV 16k mono
-        temp_wav = os.path.join(USER_AUDIO_SHADOWING_DIR, f"_rate_{audio_path}")
-        converted, err = convert_to_wav_16k_mono(file_path, temp_wav)
-        use_path = temp_wav if converted else file_path
 
-        result, err = run_pronunciation_assessment(use_path, reference_text)
+        payload = {
+            'source': 'shadowing',
+            'file_path': file_path,
+            'reference_text': reference_text,
+            'audio_id': paragraph_id,
+            'speech_type': 'shadowing',
+        }
+    else:
+        word = data.get('word')
+        pos = data.get('pos')
+        level = data.get('level')
+        audio_type = data.get('type')  # 'formal' or 'informal'
+        username = data.get('username')
 
-        if converted:
-            try:
-                os.remove(temp_wav)
-            except OSError:
-                pass
+        if not all([word, pos, level, audio_type, username]):
+            return jsonify({'error': 'Missing parameters'}), 400
 
-        if err:
-            return jsonify({'error': err}), 500
-            
-        # Save to DB
-        if paragraph_id:
-            try:
-                conn = get_db_connection()
-                cur = conn.cursor()
-                cur.execute(
-                    """
-                    INSERT INTO pronunciation_reports (
-                        audio_id,
-                        pronunciation_score,
-                        accuracy_score,
-                        fluency_score,
-                        prosody_score,
-                        total_score,
-                        recognized_text,
-                        mispronunciations_json,
-                        prosody_issues_json,
-                        report_md_path,
-                        speech_type,
-                        source
-                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                    """,
-                    (
-                        paragraph_id,
-                        result.get("pronunciation_score"),
-                        result.get("accuracy_score"),
-                        result.get("fluency_score"),
-                        result.get("prosody_score"),
-                        result.get("total_score"),
-                        result.get("recognized_text"),
-                        json.dumps(result.get("mispronunciations", [])),
-                        json.dumps({}),
-                        None,
-                        'shadowing',
-                        'shadowing'
-                    ),
-                )
-                conn.commit()
-                conn.close()
-            except Exception as e:
-                print(f"Error saving shadowing report: {e}")
+        conn = get_db_connection()
+        column_audio = 'user_audio_formal_path' if audio_type == 'formal' else 'user_audio_informal_path'
+        column_sentence = 'sentence_formal' if audio_type == 'formal' else 'sentence_informal'
+
+        # Get sentence from oxford_words
+        row_oxford = conn.execute(
+            f"SELECT id AS audio_id, {column_sentence} FROM oxford_words WHERE word = ? AND pos = ? AND level = ?",
+            (word, pos, level)
+        ).fetchone()
+        
+        if not row_oxford:
+            conn.close()
+            return jsonify({'error': 'Word not found'}), 404
 
-        return jsonify({'success': True, **result})
+        # Get user audio from user_words
+        row_user = conn.execute(
+            f"SELECT {column_audio} FROM user_words WHERE word = ? AND pos = ? AND level = ? AND username = ?",
+            (word, pos, level, username)
+        ).fetchone()
+        conn.close()
 
-    word = data.get('word')
-    pos = data.get('pos')
-    level = data.get('level')
-    audio_type = data.get('type')  # 'formal' or 'informal'
-    username = data.get('username')
+        if not row_user or not row_user[column_audio]:
+            return jsonify({'error': 'No recording found to rate'}), 404
 
-    if not all([word, pos, level, audio_type, username]):
-        return jsonify({'error': 'Missing parameters'}), 400
+        file_path = os.path.join(USER_AUDIO_TTS_DIR, row_user[column_audio])
+        if not os.path.exists(file_path):
+            return jsonify({'error': 'Audio file missing on server'}), 404
 
-    conn = get_db_connection()
-    column_audio = 'user_audio_formal_path' if audio_type == 'formal' else 'user_audio_informal_path'
-    column_sentence = 'sentence_formal' if audio_type == 'formal' else 'sentence_informal'
+        payload = {
+            'source': 'flashcard',
+            'file_path': file_path,
+            'reference_text': row_oxford[column_sentence] or "",
+            'audio_id': row_oxford["audio_id"],
+            'speech_type': audio_type,
+            'username': username,
+            'card': [word, pos, level],
+        }
+
+    # Same recording bytes + reference text => same scores; 'no_cache' forces a new assessment
+    fresh = bool(data.get('no_cache'))
+    digest = audio_digest(payload['file_path'])
+    cache_key = result_key(ASSESSMENT, digest, payload['reference_text'], ASSESSMENT_CONFIG)
+    if fresh:
+        result_cache.record_bypass(ASSESSMENT)
+    else:
+        cached_result = result_cache.get(ASSESSMENT, cache_key)
+        if cached_result is not None:
+            return jsonify({'success': True, 'status': 'done', 'cached': True, **cached_result}), 200
+    payload['cache_key'] = cache_key
+    payload['audio_sha256'] = digest
+    payload['queued_at'] = time.time()
+
+    try:
+        job = rating_jobs.submit(
+            recording_key(payload['source'], payload['file_path'], payload['reference_text']),
+            payload,
+            reuse_finished=not fresh,
+        )
+    except QueueFull as e:
+        return jsonify({'error': str(e)}), 503
+
+    return rating_job_response(job)
+
+
+def stored_audio_file(db_path):
+    """Absolute path of an audio path stored in the database ('audios/...')."""
+    if not db_path:
+        return None
+    parts = pathlib.PurePosixPath(db_path).parts
+    if parts and parts[0] == 'audios':
+        return os.path.join(AUDIO_DIR, *parts[1:])
+    return os.path.join(BASE_DIR, db_path)
 
-    # Get sentence from oxford_words
-    row_oxford = conn.execute(
-        f"SELECT id AS audio_id, {column_sentence} FROM oxford_words WHERE word = ? AND pos = ? AND level = ?",
-        (word, pos, level)
-    ).fetchone()
-    
-    if not row_oxford:
-        conn.close()
-        return jsonify({'error': 'Word not found'}), 404
 
-    # Get user audio from user_words
-    row_user = conn.execute(
-        f"SELECT {column_audio} FROM user_words WHERE word = ? AND pos = ? AND level = ? AND username = ?",
+def pitch_reference(conn, data):
+    """((recording, reference file, start_ms, end_ms), None) for /api/pitch, or (None, (error, status))."""
+    if data.get('source') == 'shadowing':
+        paragraph_id = data.get('id')
+        recording = safe_join(USER_AUDIO_SHADOWING_DIR, data.get('audio_path') or '')
+        row = conn.execute(
+            "SELECT audio_path, tts_audio_path FROM paragraphs WHERE id = ?", (paragraph_id,)
+        ).fetchone()
+        if not row or not recording:
+            return None, ('Paragraph or recording not found', 404)
+        # The author's reading of this paragraph (its clip or span), else its TTS
+        segment = audio_segments.segments_for(conn, [paragraph_id]).get(paragraph_id)
+        if segment and segment['clip_path'] and os.path.exists(stored_audio_file(segment['clip_path'])):
+            return (recording, stored_audio_file(segment['clip_path']), None, None), None
+        if segment and os.path.exists(stored_audio_file(row['audio_path'])):
+            return (recording, stored_audio_file(row['audio_path']), segment['start_ms'], segment['end_ms']), None
+        return (recording, stored_audio_file(row['tts_audio_path']), None, None), None
+
+    word, pos, level = data.get('word'), data.get('pos'), data.get('level')
+    audio_type = data.get('type')
+    username = data.get('username')
+    if not all([word, pos, level, audio_type, username]):
+        return None, ('Missing parameters', 400)
+    column_ref = 'audio_formal_path' if audio_type == 'formal' else 'audio_informal_path'
+    column_user = 'user_audio_formal_path' if audio_type == 'formal' else 'user_audio_informal_path'
+    ref = conn.execute(
+        f"SELECT {column_ref} FROM oxford_words WHERE word = ? AND pos = ? AND level = ?", (word, pos, level)
+    ).fetchone()
+    user = conn.execute(
+        f"SELECT {column_user} FROM user_words WHERE word = ? AND pos = ? AND level = ? AND username = ?",
         (word, pos, level, username)
     ).fetchone()
+    if not ref or not user or not user[column_user]:
+        return None, ('No recording found to compare', 404)
+    return (os.path.join(USER_AUDIO_TTS_DIR, user[column_user]), stored_audio_file(ref[column_ref]), None, None), None
 
-    if not row_user or not row_user[column_audio]:
+
+@app.route('/api/pitch', methods=['POST'])
+def pitch_endpoint():
+    """Local intonation comparison with the reference audio; same body as /api/rate.
+
+    Answers synchronously (no Azure call), so the page can show it while
+    the rating job runs.
+    """
+    data = request.json or {}
+    conn = get_db_connection()
+    try:
+        found, err = pitch_reference(conn, data)
+        if err:
+            return jsonify({'error': err[0]}), err[1]
+        recording, reference, start_ms, end_ms = found
+        if not os.path.exists(recording):
+            return jsonify({'error': 'Audio file missing on server'}), 404
+        if not reference or not os.path.exists(reference):
+            return jsonify({'error': 'No reference audio'}), 404
+        with metrics.span('pitch.compare'):
+            reference_f0 = pitch.reference_contour(conn, reference, start_ms, end_ms)
+            result = pitch.compare(reference_f0, pitch.f0_contour(pitch.decode(recording)))
+    except RuntimeError as e:
+        return jsonify({'error': str(e)}), 500
+    finally:
         conn.close()
-        return jsonify({'error': 'No recording found to rate'}), 404
+    return jsonify({'success': result['score'] is not None, **result})
 
-    sentence = row_oxford[column_sentence] or ""
-    audio_id_val = row_oxford["audio_id"]
-    filename = row_user[column_audio]
-    file_path = os.path.join(USER_AUDIO_TTS_DIR, filename)
+
+@app.route('/api/rate/jobs/<int:job_id>')
+def get_rating_job(job_id):
+    # Optional long-poll: ?wait=<seconds> blocks until the job finishes (capped)
+    wait = min(request.args.get('wait', 0, type=float), 30.0)
+    job = rating_jobs.get(job_id, wait=wait)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return rating_job_response(job)
+
+
+@app.route('/api/rate/stats')
+def get_rating_stats():
+    return jsonify(rating_jobs.stats())
+
+
+@app.route('/api/stats/pronunciation')
+def get_pronunciation_stats():
+    """A user's running score averages and most often mispronounced words."""
+    username = request.args.get('username', '')
+    limit = max(1, min(request.args.get('limit', 10, type=int), 100))
+    conn = get_db_connection()
+    stats = pronunciation_stats.get_stats(conn, username)
+    mistakes = pronunciation_stats.top_mistakes(conn, username, limit)
     conn.close()
+    return jsonify({'username': username, 'stats': stats, 'mispronounced': mistakes})
 
-    if not os.path.exists(file_path):
-        return jsonify({'error': 'Audio file missing on server'}), 404
 
-    # Ensure WAV 16k mono for assessment
-    temp_wav = os.path.join(USER_AUDIO_TTS_DIR, f"_rate_{filename}.wav")
-    converted, err = convert_to_wav_16k_mono(file_path, temp_wav)
-    use_path = temp_wav if converted else file_path
+@app.route('/api/stats/pronunciation/weakest')
+def get_weakest_pronunciation():
+    """The user's words (or paragraphs, scope=paragraph) with the lowest recent scores."""
+    username = request.args.get('username', '')
+    scope = request.args.get('scope', pronunciation_stats.WORD)
+    limit = max(1, min(request.args.get('limit', 10, type=int), 100))
+    if scope not in (pronunciation_stats.WORD, pronunciation_stats.PARAGRAPH):
+        return jsonify({'error': 'scope must be word or paragraph'}), 400
 
-    result, err = run_pronunciation_assessment(use_path, sentence)
+    conn = get_db_connection()
+    items = pronunciation_stats.weakest(conn, username, scope, limit)
+    if scope == pronunciation_stats.WORD and items:
+        ids = [item['subject_id'] for item in items]
+        words = {row['id']: row for row in conn.execute(
+            f"SELECT id, word, pos, level FROM oxford_words WHERE id IN ({','.join('?' * len(ids))})", ids
+        ).fetchall()}
+        for item in items:
+            row = words.get(item['subject_id'])
+            item.update({'word': row['word'], 'pos': row['pos'], 'level': row['level']} if row else {})
+    conn.close()
+    return jsonify({'username': username, 'scope': scope, 'items': items})
 
-    if converted:
-        try:
-            os.remove(temp_wav)
-        except OSError:
-            pass
 
-    if err:
-        return jsonify({'error': err}), 500
+@app.route('/api/stats/pronunciation/<scope>/<int:subject_id>')
+def get_subject_pronunciation_stats(scope, subject_id):
+    """Aggregates of one flashcard word (oxford_words.id) or paragraph for a user."""
+    if scope not in (pronunciation_stats.WORD, pronunciation_stats.PARAGRAPH):
+        return jsonify({'error': 'scope must be word or paragraph'}), 404
+    username = request.args.get('username', '')
+    conn = get_db_connection()
+    stats = pronunciation_stats.get_stats(conn, username, scope, subject_id)
+    conn.close()
+    if stats is None:
+        return jsonify({'error': 'No reports yet'}), 404
+    return jsonify({'username': username, 'scope': scope, 'subject_id': subject_id, **stats})
+
+
+@app.route('/api/coverage')
+def get_coverage():
+    """Share of each book's and chapter's words the user already knows."""
+    username = request.args.get('username', '')
+    book = request.args.get('book') or None
+    with metrics.span('word_engine.coverage'):
+        books = word_index.coverage(username, book)
+    return jsonify({'username': username, 'books': books})
+
+
+@app.route('/api/coverage/stats')
+def get_coverage_stats():
+    return jsonify(word_index.stats())
 
-    # Persist to pronunciation_reports
-    try:
-        conn = get_db_connection()
-        cur = conn.cursor()
-        cur.execute(
-            """
-            INSERT INTO pronunciation_reports (
-                audio_id,
-                pronunciation_score,
-                accuracy_score,
-                fluency_score,
-                prosody_score,
-                total_score,
-                recognized_text,
-                mispronunciations_json,
-                prosody_issues_json,
-                report_md_path,
-                speech_type,
-                source,
-                username
-            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """,
-            (
-                audio_id_val,
-                result.get("pronunciation_score"),
-                result.get("accuracy_score"),
-                result.get("fluency_score"),
-                result.get("prosody_score"),
-                result.get("total_score"),
-                result.get("recognized_text"),
-                json.dumps(result.get("mispronunciations", [])),
-                json.dumps({}),
-                None,
-                audio_type,
-                'flashcard',
-                username
-            ),
-        )
-        conn.commit()
-    finally:
-        try:
-            conn.close()
-        except Exception:
-            pass
 
-    return jsonify({'success': True, **result})
+@app.route('/api/result_cache/stats')
+def get_result_cache_stats():
+    # Hit rate plus the Azure round-trips / audio seconds the cache has saved
+    return jsonify(result_cache.stats())
 
 if __name__ == '__main__':
     port = int(os.environ.get("FLASK_PORT", 5002))
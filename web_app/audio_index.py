@@ -0,0 +1,75 @@
+import os
+import threading
+
+from werkzeug.security import safe_join
+
+
+class AudioIndex:
+    """filename -> directory for the audio routes that search several directories.
+
+    routes maps a route name to its directories in lookup priority order.
+    Each worker scans them once at startup and is told about its own writes
+    (uploads, TTS files); files written by another worker or a script are
+    picked up on the first request that misses the index.
+    """
+
+    def __init__(self, routes):
+        self.routes = {name: [os.path.abspath(d) for d in dirs] for name, dirs in routes.items()}
+        self._lock = threading.Lock()
+        self._index = {name: {} for name in self.routes}
+        self._misses = 0
+        self._hits = 0
+
+    def build(self):
+        index = {}
+        for name, dirs in self.routes.items():
+            files = index[name] = {}
+            # Lowest priority first so higher-priority directories win on clashes
+            for directory in reversed(dirs):
+                try:
+                    with os.scandir(directory) as entries:
+                        for entry in entries:
+                            if entry.is_file():
+                                files[entry.name] = directory
+                except FileNotFoundError:
+                    continue
+        with self._lock:
+            self._index = index
+        return sum(len(files) for files in index.values())
+
+    def add(self, directory, filename):
+        """Record a file written to directory (called after uploads and TTS writes)."""
+        directory = os.path.abspath(directory)
+        with self._lock:
+            for name, dirs in self.routes.items():
+                if directory not in dirs:
+                    continue
+                current = self._index[name].get(filename)
+                if current is None or dirs.index(directory) <= dirs.index(current):
+                    self._index[name][filename] = directory
+
+    def lookup(self, route, filename):
+        """Return the directory holding filename for route, or None."""
+        with self._lock:
+            directory = self._index[route].get(filename)
+            if directory is not None:
+                self._hits += 1
+                return directory
+            self._misses += 1
+
+        # Miss: written by another process since the scan (or a sub-path)
+        for directory in self.routes[route]:
+            path = safe_join(directory, filename)
+            if path is not None and os.path.isfile(path):
+                if os.path.basename(filename) == filename:
+                    self.add(directory, filename)
+                return directory
+        return None
+
+    def stats(self):
+        with self._lock:
+            return {
+                'files': {name: len(files) for name, files in self._index.items()},
+                'hits': self._hits,
+                'misses': self._misses,
+            }
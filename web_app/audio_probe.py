@@ -0,0 +1,124 @@
+import os
+import struct
+
+WAVE_FORMAT_PCM = 0x0001
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+# What Azure pronunciation assessment wants (and what convert_to_wav_16k_mono writes)
+ASSESSMENT_SAMPLE_RATE = 16000
+ASSESSMENT_CHANNELS = 1
+ASSESSMENT_BITS = 16
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS audio_probes (
+        path TEXT PRIMARY KEY,
+        format TEXT,
+        codec INTEGER,
+        sample_rate INTEGER,
+        channels INTEGER,
+        bits_per_sample INTEGER,
+        duration_seconds REAL,
+        size_bytes INTEGER,
+        mtime_ns INTEGER,
+        probed_at TEXT DEFAULT CURRENT_TIMESTAMP
+    );
+"""
+
+
+def probe_wav(path):
+    """Read the RIFF/WAVE header of `path` without decoding any audio.
+
+    Returns a dict with codec, sample_rate, channels, bits_per_sample,
+    data_bytes and duration_seconds, or None if the file is not a WAV
+    (e.g. the .webm fallback kept when ffmpeg is missing).
+    """
+    try:
+        size = os.path.getsize(path)
+        with open(path, 'rb') as f:
+            header = f.read(12)
+            if len(header) < 12 or header[:4] != b'RIFF' or header[8:12] != b'WAVE':
+                return None
+
+            fmt = None
+            data_bytes = None
+            while True:
+                chunk_header = f.read(8)
+                if len(chunk_header) < 8:
+                    break
+                chunk_id, chunk_size = struct.unpack('<4sI', chunk_header)
+                if chunk_id == b'fmt ':
+                    body = f.read(chunk_size)
+                    if len(body) < 16:
+                        return None
+                    codec, channels, sample_rate, byte_rate, block_align, bits = struct.unpack('<HHIIHH', body[:16])
+                    if codec == WAVE_FORMAT_EXTENSIBLE and len(body) >= 26:
+                        codec = struct.unpack('<H', body[24:26])[0]
+                    fmt = {
+                        'codec': codec,
+                        'channels': channels,
+                        'sample_rate': sample_rate,
+                        'byte_rate': byte_rate,
+                        'block_align': block_align,
+                        'bits_per_sample': bits,
+                    }
+                    if chunk_size % 2:
+                        f.seek(1, os.SEEK_CUR)
+                elif chunk_id == b'data':
+                    # Streamed writers leave 0/0xFFFFFFFF here; trust the file size instead
+                    data_bytes = min(chunk_size, size - f.tell()) if chunk_size else size - f.tell()
+                    break
+                else:
+                    f.seek(chunk_size + (chunk_size % 2), os.SEEK_CUR)
+    except (OSError, struct.error):
+        return None
+
+    if fmt is None or data_bytes is None:
+        return None
+
+    fmt['format'] = 'wav'
+    fmt['data_bytes'] = data_bytes
+    fmt['duration_seconds'] = data_bytes / fmt['byte_rate'] if fmt['byte_rate'] else None
+    return fmt
+
+
+def is_assessment_ready(info):
+    """True if the probed WAV can be sent to the Speech SDK as-is."""
+    return bool(info) and (
+        info['codec'] == WAVE_FORMAT_PCM
+        and info['channels'] == ASSESSMENT_CHANNELS
+        and info['sample_rate'] == ASSESSMENT_SAMPLE_RATE
+        and info['bits_per_sample'] == ASSESSMENT_BITS
+    )
+
+
+def record_probe(conn, stored_path, file_path, info):
+    """Store the probed format next to the path saved in user_words/paragraphs."""
+    st = os.stat(file_path)
+    conn.execute(
+        """
+        INSERT INTO audio_probes (path, format, codec, sample_rate, channels, bits_per_sample,
+                                  duration_seconds, size_bytes, mtime_ns, probed_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+        ON CONFLICT(path) DO UPDATE SET
+            format = excluded.format,
+            codec = excluded.codec,
+            sample_rate = excluded.sample_rate,
+            channels = excluded.channels,
+            bits_per_sample = excluded.bits_per_sample,
+            duration_seconds = excluded.duration_seconds,
+            size_bytes = excluded.size_bytes,
+            mtime_ns = excluded.mtime_ns,
+            probed_at = excluded.probed_at
+        """,
+        (
+            stored_path,
+            info['format'] if info else os.path.splitext(file_path)[1].lstrip('.') or None,
+            info['codec'] if info else None,
+            info['sample_rate'] if info else None,
+            info['channels'] if info else None,
+            info['bits_per_sample'] if info else None,
+            info['duration_seconds'] if info else None,
+            st.st_size,
+            st.st_mtime_ns,
+        )
+    )
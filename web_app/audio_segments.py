@@ -0,0 +1,323 @@
+"""Per-paragraph offsets into the whole-chapter author recordings.
+
+All paragraphs of a chapter share one audios/audio_book_author/*.mp3 through
+paragraphs.audio_path. This offline pass decodes each chapter once (ffmpeg
+to 16 kHz mono PCM, read in blocks), computes the energy of every 10 ms
+frame with NumPy and marks frames near the noise floor as silent. Runs of
+silence of at least MIN_PAUSE_MS are the candidate paragraph breaks.
+
+The paragraphs' word_count values give the expected position of each
+break as a share of the chapter's speaking time. A dynamic program picks
+one pause per break, in order, trading distance from that position against
+pause length (readers pause longest between paragraphs). Chapters with too
+few pauses are cut proportionally.
+
+Offsets go to paragraph_audio_segments; with --clips each paragraph is also
+stream-copied (no re-encode) into audios/audio_book_segments/. The shadowing
+API serves the clip when there is one, otherwise the chapter URL with a
+#t=start,end media fragment, which browsers fetch with range requests.
+
+  python -m web_app.audio_segments --workers 4 --clips
+  python -m web_app.audio_segments --book "Pitch Anything" --dry-run
+"""
+import argparse
+import hashlib
+import os
+import sqlite3
+import shutil
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import numpy as np
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SEGMENTS_DIR = os.path.join(PROJECT_ROOT, 'audios', 'audio_book_segments')
+FFMPEG_BIN = shutil.which('ffmpeg')
+
+SAMPLE_RATE = 16000
+FRAME_MS = 10
+FRAME = SAMPLE_RATE * FRAME_MS // 1000
+READ_FRAMES = 6000            # one minute of audio per read
+MIN_PAUSE_MS = 250
+# Kept on each side of a cut so the clip does not start/end mid-breath
+PAD_MS = 150
+# Silence threshold: this far above the noise floor, as a share of the
+# floor-to-speech range, but at least MIN_MARGIN_DB
+SILENCE_SHARE = 0.3
+MIN_MARGIN_DB = 6.0
+# Alignment cost: break position error in units of this share of the
+# speaking time, minus PAUSE_WEIGHT * log(pause length)
+POSITION_TOLERANCE = 0.03
+PAUSE_WEIGHT = 1.0
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS paragraph_audio_segments (
+        paragraph_id INTEGER PRIMARY KEY,
+        audio_path TEXT NOT NULL,
+        start_ms INTEGER NOT NULL,
+        end_ms INTEGER NOT NULL,
+        pause_ms INTEGER,
+        method TEXT NOT NULL,
+        clip_path TEXT,
+        signature TEXT NOT NULL,
+        segmented_at TEXT DEFAULT CURRENT_TIMESTAMP
+    );
+    CREATE INDEX IF NOT EXISTS idx_paragraph_audio_segments_audio_path
+        ON paragraph_audio_segments(audio_path);
+"""
+
+
+def decode_frame_energy(path):
+    """dB energy of every FRAME_MS frame of an audio file, decoded once by ffmpeg."""
+    if not FFMPEG_BIN:
+        raise RuntimeError("ffmpeg not found")
+    cmd = [
+        FFMPEG_BIN, '-hide_banner', '-loglevel', 'error', '-i', path,
+        '-ac', '1', '-ar', str(SAMPLE_RATE), '-f', 's16le', 'pipe:1',
+    ]
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    energies = []
+    tail = b''
+    block = READ_FRAMES * FRAME * 2
+    while True:
+        data = proc.stdout.read(block)
+        if not data:
+            break
+        data = tail + data
+        usable = len(data) - len(data) % (FRAME * 2)
+        tail = data[usable:]
+        samples = np.frombuffer(data[:usable], dtype='<i2').astype(np.float32) / 32768.0
+        energies.append(frame_energy(samples))
+    stderr = proc.stderr.read()
+    if proc.wait() != 0:
+        raise RuntimeError(stderr.decode(errors='ignore').strip() or f"ffmpeg failed on {path}")
+    return np.concatenate(energies) if energies else np.zeros(0, dtype=np.float32)
+
+
+def frame_energy(samples):
+    """dB mean square of consecutive FRAME-sample frames (a trailing partial frame is dropped)."""
+    frames = samples[:samples.size - samples.size % FRAME].reshape(-1, FRAME)
+    return (10 * np.log10(np.mean(frames * frames, axis=1) + 1e-10)).astype(np.float32)
+
+
+def find_pauses(energy_db, min_pause_ms=MIN_PAUSE_MS):
+    """(pauses, speech): pauses as an (n, 2) array of [start, end) frames, speech as a bool per frame."""
+    if energy_db.size == 0:
+        return np.zeros((0, 2), dtype=np.int64), np.zeros(0, dtype=bool)
+    floor, loud = np.percentile(energy_db, [10, 95])
+    threshold = floor + max(MIN_MARGIN_DB, SILENCE_SHARE * (loud - floor))
+    silent = energy_db < threshold
+    # A single loud frame (click, breath) does not split a pause
+    silent[1:-1] |= silent[:-2] & silent[2:]
+
+    edges = np.diff(np.concatenate(([0], silent.astype(np.int8), [0])))
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)
+    keep = (ends - starts) * FRAME_MS >= min_pause_ms
+    # Leading and trailing silence is not a break between paragraphs
+    keep &= (starts > 0) & (ends < silent.size)
+    return np.stack([starts[keep], ends[keep]], axis=1), ~silent
+
+
+def align(pauses, speech, word_counts):
+    """Frame boundaries between consecutive paragraphs: (cuts, pause lengths, method).
+
+    cuts[k] is the [end of paragraph k, start of paragraph k + 1) frame
+    range; the pause length is 0 for proportional cuts.
+    """
+    breaks = len(word_counts) - 1
+    if breaks <= 0:
+        return np.zeros((0, 2), dtype=np.int64), np.zeros(0, dtype=np.int64), 'single'
+    words = np.maximum(np.asarray(word_counts, dtype=np.float64), 1)
+    expected = np.cumsum(words)[:-1] / words.sum()        # share of speaking time before each break
+    spoken = np.cumsum(speech)
+    total = max(int(spoken[-1]), 1)
+
+    if len(pauses) < breaks:
+        # Not enough pauses: cut where that share of the speech has been spoken
+        frames = np.searchsorted(spoken, expected * total)
+        return np.stack([frames, frames], axis=1), np.zeros(breaks, dtype=np.int64), 'proportional'
+
+    position = spoken[(pauses[:, 0] + pauses[:, 1]) // 2] / total
+    length = pauses[:, 1] - pauses[:, 0]
+    cost = ((position[None, :] - expected[:, None]) / POSITION_TOLERANCE) ** 2
+    cost -= PAUSE_WEIGHT * np.log(length / (MIN_PAUSE_MS / FRAME_MS))[None, :]
+
+    # best[k, j]: cheapest assignment of breaks 0..k with break k at pause j;
+    # break k may only use a pause after the one of break k - 1
+    n = len(pauses)
+    best = np.full((breaks, n), np.inf)
+    best[0] = cost[0]
+    for k in range(1, breaks):
+        prefix = np.minimum.accumulate(best[k - 1])
+        best[k, 1:] = cost[k, 1:] + prefix[:-1]
+
+    chosen = np.empty(breaks, dtype=np.int64)
+    chosen[-1] = int(np.argmin(best[-1]))
+    for k in range(breaks - 2, -1, -1):
+        chosen[k] = int(np.argmin(best[k, :chosen[k + 1]]))
+    return pauses[chosen], length[chosen], 'pauses'
+
+
+def segment(energy_db, word_counts):
+    """(start_ms, end_ms, pause_ms) per paragraph plus the method used."""
+    pauses, speech = find_pauses(energy_db)
+    cuts, lengths, method = align(pauses, speech, word_counts)
+    voiced = np.flatnonzero(speech)
+    first, last = (int(voiced[0]), int(voiced[-1]) + 1) if voiced.size else (0, energy_db.size)
+    pad = PAD_MS // FRAME_MS
+
+    starts = [max(first - pad, 0)]
+    ends = []
+    for (pause_start, pause_end), length in zip(cuts.tolist(), lengths.tolist()):
+        middle = (pause_start + pause_end) // 2
+        ends.append(min(pause_start + pad, middle))
+        starts.append(max(pause_end - pad, middle))
+    ends.append(min(last + pad, energy_db.size))
+
+    pause_after = [int(x) * FRAME_MS for x in lengths.tolist()] + [None]
+    return [
+        (start * FRAME_MS, end * FRAME_MS, pause)
+        for start, end, pause in zip(starts, ends, pause_after)
+    ], method
+
+
+def cut_clip(source, dest, start_ms, end_ms):
+    """Stream-copy [start_ms, end_ms) of source into dest (MP3 frame accuracy, no re-encode)."""
+    temp_path = f"{dest}.part"
+    cmd = [
+        FFMPEG_BIN, '-y', '-hide_banner', '-loglevel', 'error',
+        '-ss', f"{start_ms / 1000:.3f}", '-i', source,
+        '-t', f"{(end_ms - start_ms) / 1000:.3f}",
+        '-map', '0:a', '-c', 'copy', '-f', 'mp3', temp_path,
+    ]
+    subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    os.replace(temp_path, dest)
+
+
+def clip_name(audio_path, paragraph_id):
+    stem = os.path.splitext(os.path.basename(audio_path))[0]
+    return f"{stem}_p{paragraph_id}.mp3"
+
+
+def chapter_signature(path, paragraphs):
+    """Changes when the recording or the chapter's paragraphs (ids, word counts) change."""
+    st = os.stat(path)
+    digest = hashlib.sha1(f"{st.st_size}:{st.st_mtime_ns}".encode())
+    for paragraph_id, word_count in paragraphs:
+        digest.update(f"|{paragraph_id}:{word_count}".encode())
+    return digest.hexdigest()[:16]
+
+
+def load_chapters(conn, book=None):
+    """{audio_path: [(paragraph_id, word_count), ...]} in reading order."""
+    query = (
+        "SELECT audio_path, id, word_count, content FROM paragraphs "
+        "WHERE audio_path IS NOT NULL AND audio_path != ''"
+    )
+    params = []
+    if book:
+        query += " AND book = ?"
+        params.append(book)
+    chapters = {}
+    for audio_path, paragraph_id, word_count, content in conn.execute(query + " ORDER BY id", params):
+        if word_count is None:
+            word_count = len((content or '').split())
+        chapters.setdefault(audio_path, []).append((paragraph_id, word_count))
+    return chapters
+
+
+def segment_chapter(audio_path, paragraphs, signature, clips):
+    """Decode, segment and (optionally) cut one chapter; returns its rows."""
+    source = os.path.join(PROJECT_ROOT, audio_path)
+    started = time.perf_counter()
+    energy = decode_frame_energy(source)
+    spans, method = segment(energy, [word_count for _, word_count in paragraphs])
+    rows = []
+    for (paragraph_id, _), (start_ms, end_ms, pause_ms) in zip(paragraphs, spans):
+        clip_path = None
+        if clips:
+            name = clip_name(audio_path, paragraph_id)
+            cut_clip(source, os.path.join(SEGMENTS_DIR, name), start_ms, end_ms)
+            clip_path = os.path.relpath(os.path.join(SEGMENTS_DIR, name), PROJECT_ROOT)
+        rows.append((paragraph_id, audio_path, start_ms, end_ms, pause_ms, method, clip_path, signature))
+    return rows, energy.size * FRAME_MS / 1000, time.perf_counter() - started
+
+
+def segments_for(conn, paragraph_ids):
+    """{paragraph_id: row} of current segments (the paragraph still points at the segmented file)."""
+    if not paragraph_ids:
+        return {}
+    rows = conn.execute(
+        "SELECT s.paragraph_id, s.start_ms, s.end_ms, s.clip_path FROM paragraph_audio_segments s "
+        "JOIN paragraphs p ON p.id = s.paragraph_id AND p.audio_path = s.audio_path "
+        f"WHERE s.paragraph_id IN ({','.join('?' * len(paragraph_ids))})",
+        list(paragraph_ids)
+    ).fetchall()
+    return {row[0]: row for row in rows}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Split whole-chapter author audio into paragraphs")
+    parser.add_argument("--db", default=os.environ.get("FGL_DB_PATH", os.path.join(PROJECT_ROOT, "masterfgl.db")))
+    parser.add_argument("--book", help="Only this book")
+    parser.add_argument("--workers", type=int, default=2, help="Chapters decoded in parallel")
+    parser.add_argument("--clips", action="store_true", help="Also cut one mp3 clip per paragraph")
+    parser.add_argument("--force", action="store_true", help="Redo chapters that are up to date")
+    parser.add_argument("--dry-run", action="store_true", help="Print the cuts without storing them")
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db, timeout=30)
+    conn.executescript(SCHEMA)
+    todo = []
+    for audio_path, paragraphs in load_chapters(conn, args.book).items():
+        source = os.path.join(PROJECT_ROOT, audio_path)
+        if not os.path.isfile(source):
+            print(f"Missing {audio_path}, skipped")
+            continue
+        signature = chapter_signature(source, paragraphs)
+        stored = conn.execute(
+            "SELECT COUNT(*), MIN(signature) = MAX(signature) AND MIN(signature) = ?, "
+            "COUNT(*) - COUNT(clip_path) FROM paragraph_audio_segments WHERE audio_path = ?",
+            (signature, audio_path)
+        ).fetchone()
+        up_to_date = stored[0] == len(paragraphs) and stored[1] and not (args.clips and stored[2])
+        if up_to_date and not args.force:
+            continue
+        todo.append((audio_path, paragraphs, signature))
+    print(f"{len(todo)} chapter(s) to segment")
+    if args.clips and not args.dry_run:
+        os.makedirs(SEGMENTS_DIR, exist_ok=True)
+
+    with ThreadPoolExecutor(max_workers=max(1, args.workers)) as pool:
+        futures = {
+            pool.submit(segment_chapter, audio_path, paragraphs, signature, args.clips and not args.dry_run): audio_path
+            for audio_path, paragraphs, signature in todo
+        }
+        for future in as_completed(futures):
+            audio_path = futures[future]
+            try:
+                rows, duration, seconds = future.result()
+            except (RuntimeError, OSError, subprocess.CalledProcessError) as e:
+                print(f"{audio_path}: failed: {e}")
+                continue
+            print(f"{audio_path}: {len(rows)} paragraphs, {duration:.0f}s of audio, "
+                  f"method {rows[0][5]}, {seconds:.1f}s")
+            if args.dry_run:
+                for paragraph_id, _, start_ms, end_ms, pause_ms, _, _, _ in rows:
+                    print(f"  {paragraph_id}: {start_ms / 1000:.2f}-{end_ms / 1000:.2f}s (pause {pause_ms} ms)")
+                continue
+            with conn:
+                conn.execute("DELETE FROM paragraph_audio_segments WHERE audio_path = ?", (audio_path,))
+                conn.executemany(
+                    "INSERT OR REPLACE INTO paragraph_audio_segments "
+                    "(paragraph_id, audio_path, start_ms, end_ms, pause_ms, method, clip_path, signature) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    rows
+                )
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
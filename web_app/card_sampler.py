@@ -0,0 +1,209 @@
+import random
+import threading
+from collections import OrderedDict
+
+# Cards must have at least one native audio and one non-empty sentence to be
+# shown on the flashcard page. Same filter the old ORDER BY RANDOM() query used.
+ELIGIBLE_CARDS_QUERY = """
+    SELECT word, pos, level
+    FROM oxford_words
+    WHERE (audio_formal_path IS NOT NULL OR audio_informal_path IS NOT NULL)
+    AND ((sentence_formal IS NOT NULL AND sentence_formal != '') OR (sentence_informal IS NOT NULL AND sentence_informal != ''))
+    ORDER BY rowid
+"""
+
+# A card row as the flashcard page needs it; ?1 is the username
+_CARD_SELECT = """
+    SELECT ow.*,
+           uw.is_known AS user_is_known,
+           uw.user_audio_formal_path, uw.user_audio_informal_path,
+           uw.user_transcription_formal, uw.user_transcription_informal,
+           cs.due_at, cs.interval_days, cs.repetitions
+"""
+_CARD_JOINS = """
+    LEFT JOIN user_words uw
+    ON ow.word = uw.word AND ow.pos = uw.pos AND ow.level = uw.level AND uw.username = ?1
+    LEFT JOIN card_schedule cs
+    ON ow.word = cs.word AND ow.pos = cs.pos AND ow.level = cs.level AND cs.username = ?1
+"""
+
+CARD_BY_KEY_QUERY = f"""
+    {_CARD_SELECT}
+    FROM oxford_words ow
+    {_CARD_JOINS}
+    WHERE ow.word = ?2 AND ow.pos = ?3 AND ow.level = ?4
+"""
+
+# Cards that are no longer new: known, or already on the review schedule
+# (web_app/scheduler.py serves those when they fall due)
+NOT_NEW_QUERY = """
+    SELECT word, pos, level FROM user_words WHERE username = ?1 AND is_known = 1
+    UNION
+    SELECT word, pos, level FROM card_schedule WHERE username = ?1
+"""
+
+ALL_LEVELS = 'all'
+# Users whose pools a worker keeps; the least recently drawn for is dropped
+MAX_CACHED_USERS = 256
+
+
+def fetch_cards(conn, username, keys):
+    """Card rows for a list of (word, pos, level) keys in one query, in key order."""
+    if not keys:
+        return []
+    values = ', '.join(f"({n}, ?{3 * n + 2}, ?{3 * n + 3}, ?{3 * n + 4})" for n in range(len(keys)))
+    query = f"""
+        WITH wanted(n, word, pos, level) AS (VALUES {values})
+        {_CARD_SELECT}
+        FROM wanted
+        JOIN oxford_words ow ON ow.word = wanted.word AND ow.pos = wanted.pos AND ow.level = wanted.level
+        {_CARD_JOINS}
+        ORDER BY wanted.n
+    """
+    return conn.execute(query, [username] + [part for key in keys for part in key]).fetchall()
+
+
+class _UnknownPool:
+    """Indices of the cards that are still new to a user, for one level.
+
+    Backed by a dense list plus a position map so that drawing a random entry
+    and removing an arbitrary entry (swap with the last element) are O(1).
+    """
+
+    def __init__(self, indices):
+        self.items = list(indices)
+        self.positions = {idx: pos for pos, idx in enumerate(self.items)}
+
+    def __len__(self):
+        return len(self.items)
+
+    def draw(self, rng):
+        return self.items[rng.randrange(len(self.items))]
+
+    def discard(self, idx):
+        pos = self.positions.pop(idx, None)
+        if pos is None:
+            return
+        last = self.items.pop()
+        if last != idx:
+            self.items[pos] = last
+            self.positions[last] = pos
+
+
+class CardSampler:
+    """In-memory random selection of new cards for /api/card.
+
+    The eligible candidate set is loaded once per worker and grouped by CEFR
+    level. Each user gets lazily built pools of new card indices that
+    retire() shrinks in place, so a draw never scans oxford_words. Pools are
+    kept for the MAX_CACHED_USERS most recent users.
+    """
+
+    def __init__(self, rng=None):
+        self._rng = rng or random.Random()
+        self._lock = threading.Lock()
+        self._keys = None
+        self._index = None
+        self._by_level = None
+        self._user_pools = OrderedDict()
+
+    def _load_candidates(self, conn):
+        rows = conn.execute(ELIGIBLE_CARDS_QUERY).fetchall()
+        self._keys = [(row['word'], row['pos'], row['level']) for row in rows]
+        self._index = {key: idx for idx, key in enumerate(self._keys)}
+        self._by_level = {ALL_LEVELS: list(range(len(self._keys)))}
+        for idx, key in enumerate(self._keys):
+            self._by_level.setdefault(key[2], []).append(idx)
+        self._user_pools = OrderedDict()
+
+    def _known_indices(self, conn, username):
+        rows = conn.execute(NOT_NEW_QUERY, (username,)).fetchall()
+        known = set()
+        for row in rows:
+            idx = self._index.get((row['word'], row['pos'], row['level']))
+            if idx is not None:
+                known.add(idx)
+        return known
+
+    def _pool(self, conn, username, level):
+        pools = self._user_pools.get(username)
+        if pools is None:
+            pools = {'known': self._known_indices(conn, username)}
+            self._user_pools[username] = pools
+            if len(self._user_pools) > MAX_CACHED_USERS:
+                self._user_pools.popitem(last=False)
+        else:
+            self._user_pools.move_to_end(username)
+        pool = pools.get(level)
+        if pool is None:
+            known = pools['known']
+            pool = _UnknownPool(i for i in self._by_level.get(level, []) if i not in known)
+            pools[level] = pool
+        return pool
+
+    def _forget(self, username, idx):
+        pools = self._user_pools.get(username)
+        if pools is None:
+            return
+        pools['known'].add(idx)
+        for name, pool in pools.items():
+            if name != 'known':
+                pool.discard(idx)
+
+    def draw(self, conn, username, level=None):
+        """Return a random card row the user has neither marked known nor reviewed, or None."""
+        level = level or ALL_LEVELS
+        while True:
+            with self._lock:
+                if self._keys is None:
+                    self._load_candidates(conn)
+                pool = self._pool(conn, username, level)
+                if not len(pool):
+                    return None
+                idx = pool.draw(self._rng)
+                word, pos, card_level = self._keys[idx]
+
+            card = conn.execute(CARD_BY_KEY_QUERY, (username, word, pos, card_level)).fetchone()
+            if card is not None and not card['user_is_known'] and card['due_at'] is None:
+                return card
+
+            # Another worker marked or scheduled it (or the row vanished): drop it and retry.
+            with self._lock:
+                self._forget(username, idx)
+
+    def draw_many(self, conn, username, level=None, n=1, exclude=()):
+        """Up to n distinct random new card rows, skipping the (word, pos, level) keys in exclude."""
+        level = level or ALL_LEVELS
+        exclude = set(exclude)
+        with self._lock:
+            if self._keys is None:
+                self._load_candidates(conn)
+            pool = self._pool(conn, username, level)
+            picks = self._rng.sample(pool.items, min(len(pool), n + len(exclude)))
+            keys = [self._keys[idx] for idx in picks if self._keys[idx] not in exclude][:n]
+
+        cards = []
+        for card in fetch_cards(conn, username, keys):
+            if not card['user_is_known'] and card['due_at'] is None:
+                cards.append(card)
+            else:
+                # Marked or scheduled by another worker since the pool was built
+                self.retire(username, card['word'], card['pos'], card['level'])
+        return cards
+
+    def retire(self, username, word, pos, level):
+        """Stop offering the card as new (marked known, or reviewed)."""
+        with self._lock:
+            if self._index is None:
+                return
+            idx = self._index.get((word, pos, level))
+            if idx is not None:
+                self._forget(username, idx)
+
+    def invalidate(self):
+        """Drop all cached state; the next draw reloads it from the database."""
+        with self._lock:
+            self._keys = None
+            self._index = None
+            self._by_level = None
+            self._user_pools = OrderedDict()
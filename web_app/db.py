@@ -0,0 +1,269 @@
+import gc
+import os
+import sqlite3
+import threading
+import time
+import weakref
+
+from metrics import metrics
+
+# Pragmas applied once to every new pooled connection. WAL lets readers keep
+# going while mark_known/upload_audio/report inserts hold the write lock, and
+# busy_timeout makes writers from other gunicorn workers wait instead of
+# failing with "database is locked".
+DEFAULT_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 5000,
+    'cache_size': -16000,       # KiB (negative) -> ~16 MB page cache per connection
+    'mmap_size': 268435456,     # 256 MB
+    'temp_store': 'MEMORY',
+}
+
+# Minimum seconds between the garbage collections an exhausted pool runs
+LEAK_GC_INTERVAL = 1.0
+
+
+class PooledConnection(sqlite3.Connection):
+    """sqlite3 connection whose close() hands it back to its pool.
+
+    Existing call sites keep their conn.close() calls; the underlying
+    connection (and its prepared statement cache) survives for the next request.
+    A checked-out connection that is never closed (an exception between
+    acquire and close) gives its slot back when it is garbage-collected;
+    sqlite3 connections sit in a reference cycle with their statement cache,
+    so an exhausted pool runs the cycle collector before it waits.
+    """
+
+    _pool = None
+
+    def close(self):
+        pool = self._pool
+        if pool is None:
+            super().close()
+        else:
+            pool.release(self)
+
+    def really_close(self):
+        super().close()
+
+    def execute(self, *args):
+        with metrics.span('db.query'):
+            return super().execute(*args)
+
+    def executemany(self, *args):
+        with metrics.span('db.query'):
+            return super().executemany(*args)
+
+    def commit(self):
+        pool = self._pool
+        if pool is None:
+            return super().commit()
+        start = time.perf_counter()
+        try:
+            with metrics.span('db.commit'):
+                return super().commit()
+        finally:
+            pool._record_commit(time.perf_counter() - start)
+
+
+class ConnectionPool:
+    """Thread-safe pool of SQLite connections for one database file.
+
+    Connections are created lazily up to max_size and reused LIFO. The pool
+    remembers the pid it was created in, so a pool inherited through a fork
+    (gunicorn --preload) drops the parent's connections instead of sharing them.
+    """
+
+    def __init__(self, path, max_size=8, timeout=10.0, cached_statements=256, pragmas=None):
+        self.path = path
+        self.max_size = max_size
+        self.timeout = timeout
+        self.cached_statements = cached_statements
+        self.pragmas = dict(DEFAULT_PRAGMAS if pragmas is None else pragmas)
+        self._cond = threading.Condition()
+        self._idle = []
+        self._size = 0
+        self._pid = os.getpid()
+        self._last_gc = float('-inf')
+        self._stats = {
+            'created': 0,
+            'acquired': 0,
+            'reused': 0,
+            'waits': 0,
+            'connect_seconds': 0.0,
+            'acquire_wait_seconds': 0.0,
+            'commits': 0,
+            'commit_seconds': 0.0,
+            'max_commit_seconds': 0.0,
+            'reclaimed': 0,
+        }
+
+    def _check_fork(self):
+        if self._pid != os.getpid():
+            self._idle = []
+            self._size = 0
+            self._pid = os.getpid()
+
+    def _connect(self):
+        # Called without self._cond held: connecting and the pragmas can block
+        start = time.perf_counter()
+        conn = sqlite3.connect(
+            self.path,
+            timeout=self.pragmas.get('busy_timeout', 5000) / 1000,
+            check_same_thread=False,
+            cached_statements=self.cached_statements,
+            factory=PooledConnection,
+        )
+        conn.row_factory = sqlite3.Row
+        for name, value in self.pragmas.items():
+            conn.execute(f"PRAGMA {name} = {value}")
+        conn._pool = self
+        finalizer = weakref.finalize(conn, self._reclaim, self._pid)
+        finalizer.atexit = False
+        conn._finalizer = finalizer
+        with self._cond:
+            self._stats['created'] += 1
+            self._stats['connect_seconds'] += time.perf_counter() - start
+        return conn
+
+    def _reclaim(self, pid):
+        # A checked-out connection was garbage-collected without close()
+        with self._cond:
+            if pid != self._pid:
+                return  # inherited through a fork; the slot belonged to the parent
+            self._size -= 1
+            self._stats['reclaimed'] += 1
+            self._cond.notify()
+
+    def _discard(self, conn):
+        conn._finalizer.detach()
+        conn.really_close()
+
+    def _collect_leaks(self):
+        """Run the cycle collector, at most every LEAK_GC_INTERVAL seconds."""
+        with self._cond:
+            now = time.monotonic()
+            if now - self._last_gc < LEAK_GC_INTERVAL:
+                return
+            self._last_gc = now
+        gc.collect()
+
+    def acquire(self):
+        start = None
+        collected = False
+        self._cond.acquire()
+        try:
+            self._check_fork()
+            self._stats['acquired'] += 1
+            while True:
+                if self._idle:
+                    conn = self._idle.pop()
+                    self._stats['reused'] += 1
+                    break
+                if self._size < self.max_size:
+                    self._size += 1   # reserve the slot; connect outside the lock
+                    conn = None
+                    break
+                if not collected:
+                    # Leaked connections free their slots when collected
+                    collected = True
+                    self._cond.release()
+                    try:
+                        self._collect_leaks()
+                    finally:
+                        self._cond.acquire()
+                    continue
+                if start is None:
+                    self._stats['waits'] += 1
+                    start = time.perf_counter()
+                remaining = start + self.timeout - time.perf_counter()
+                if remaining <= 0:
+                    self._stats['acquire_wait_seconds'] += time.perf_counter() - start
+                    raise sqlite3.OperationalError(f"Timed out waiting for a connection to {self.path}")
+                self._cond.wait(remaining)
+            if start is not None:
+                self._stats['acquire_wait_seconds'] += time.perf_counter() - start
+        finally:
+            self._cond.release()
+        if start is not None:
+            metrics.record_span('db.acquire_wait', time.perf_counter() - start)
+        if conn is not None:
+            return conn
+
+        try:
+            return self._connect()
+        except BaseException:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+
+    def release(self, conn):
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            self._discard(conn)
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            return
+
+        with self._cond:
+            if self._pid != os.getpid():
+                self._discard(conn)
+                return
+            if any(idle is conn for idle in self._idle):
+                return  # closed twice
+            self._idle.append(conn)
+            self._cond.notify()
+
+    def _record_commit(self, seconds):
+        with self._cond:
+            self._stats['commits'] += 1
+            self._stats['commit_seconds'] += seconds
+            if seconds > self._stats['max_commit_seconds']:
+                self._stats['max_commit_seconds'] = seconds
+
+    def close_all(self):
+        with self._cond:
+            idle, self._idle = self._idle, []
+            self._size -= len(idle)
+        for conn in idle:
+            self._discard(conn)
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self._stats)
+            stats['size'] = self._size
+            stats['idle'] = len(self._idle)
+            stats['in_use'] = self._size - len(self._idle)
+        created = stats['created'] or 1
+        stats['avg_connect_ms'] = stats['connect_seconds'] * 1000 / created
+        stats['estimated_connect_ms_saved'] = stats['reused'] * stats['avg_connect_ms']
+        stats['avg_commit_ms'] = stats['commit_seconds'] * 1000 / (stats['commits'] or 1)
+        stats['path'] = os.path.basename(self.path)
+        stats['pid'] = self._pid
+        return stats
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(path, **kwargs):
+    """Return the process-wide pool for a database file, creating it on first use."""
+    key = os.path.abspath(path)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = ConnectionPool(key, **kwargs)
+            _pools[key] = pool
+        return pool
+
+
+def all_pool_stats():
+    with _pools_lock:
+        pools = list(_pools.values())
+    return [pool.stats() for pool in pools]
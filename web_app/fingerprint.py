@@ -0,0 +1,41 @@
+import functools
+import hashlib
+import os
+
+# Responses for a URL carrying the file's current version never change
+IMMUTABLE = 'public, max-age=31536000, immutable'
+# Anything else is revalidated against its ETag / Last-Modified
+REVALIDATE = 'no-cache'
+
+
+def file_version(path):
+    """Version tag for audio files, from size + mtime (no need to read the MP3).
+
+    Recordings and TTS files are replaced via os.replace, so an overwrite
+    always gets a new tag. Returns None if the file does not exist.
+    """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return hashlib.sha1(f"{st.st_size}:{st.st_mtime_ns}".encode()).hexdigest()[:12]
+
+
+@functools.lru_cache(maxsize=128)
+def _content_hash(path, size, mtime_ns):
+    with open(path, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()[:12]
+
+
+def content_version(path):
+    """Hash of the file's bytes, for the (small) static JS/CSS assets."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return _content_hash(path, st.st_size, st.st_mtime_ns)
+
+
+def cache_control(requested, current):
+    """IMMUTABLE only when the URL's ?v= matches the file as it is now."""
+    return IMMUTABLE if requested and requested == current else REVALIDATE
@@ -0,0 +1,120 @@
+import hashlib
+import json
+import threading
+
+# paragraphs_version is bumped by triggers whenever a paragraph is added,
+# removed or moved to another book/chapter/subtitle, including by scripts
+# writing to masterfgl.db outside the web app. Updates to audio/TTS paths
+# leave it alone.
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS paragraphs_version (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        version INTEGER NOT NULL
+    );
+    INSERT OR IGNORE INTO paragraphs_version (id, version) VALUES (1, 1);
+    CREATE TRIGGER IF NOT EXISTS trg_paragraphs_version_insert AFTER INSERT ON paragraphs
+    BEGIN
+        UPDATE paragraphs_version SET version = version + 1 WHERE id = 1;
+    END;
+    CREATE TRIGGER IF NOT EXISTS trg_paragraphs_version_delete AFTER DELETE ON paragraphs
+    BEGIN
+        UPDATE paragraphs_version SET version = version + 1 WHERE id = 1;
+    END;
+    CREATE TRIGGER IF NOT EXISTS trg_paragraphs_version_update AFTER UPDATE OF id, book, chapter, subtitle ON paragraphs
+    BEGIN
+        UPDATE paragraphs_version SET version = version + 1 WHERE id = 1;
+    END;
+"""
+
+NAV_QUERY = """
+    SELECT book, chapter, subtitle, COUNT(*) AS paragraphs, MIN(id) AS first_id, MAX(id) AS last_id
+    FROM paragraphs
+    WHERE book IS NOT NULL AND chapter IS NOT NULL AND chapter != ''
+    GROUP BY book, chapter, subtitle
+    ORDER BY book, MIN(id)
+"""
+
+
+def _node(**fields):
+    return {**fields, 'paragraphs': 0, 'first_id': None, 'last_id': None}
+
+
+def _add_range(node, row):
+    node['paragraphs'] += row['paragraphs']
+    if node['first_id'] is None or row['first_id'] < node['first_id']:
+        node['first_id'] = row['first_id']
+    if node['last_id'] is None or row['last_id'] > node['last_id']:
+        node['last_id'] = row['last_id']
+
+
+def build_tree(rows):
+    """book -> chapters -> subtitles (reading order), with counts and id ranges."""
+    books = {}
+    chapters = {}
+    for row in rows:
+        book = books.get(row['book'])
+        if book is None:
+            book = books[row['book']] = _node(book=row['book'], chapters=[])
+        chapter = chapters.get((row['book'], row['chapter']))
+        if chapter is None:
+            chapter = chapters[(row['book'], row['chapter'])] = _node(chapter=row['chapter'], subtitles=[])
+            book['chapters'].append(chapter)
+        _add_range(book, row)
+        _add_range(chapter, row)
+        if row['subtitle']:
+            subtitle = _node(subtitle=row['subtitle'])
+            _add_range(subtitle, row)
+            chapter['subtitles'].append(subtitle)
+    return books
+
+
+class NavIndex:
+    """Shadowing navigator tree, built once per paragraphs_version per worker.
+
+    Responses are pre-serialized along with a strong ETag (hash of the body),
+    so an unchanged tree costs one version lookup and a 304.
+    """
+
+    def __init__(self, connect):
+        self._connect = connect
+        self._lock = threading.Lock()
+        self._version = None
+        self._books = {}
+        self._payloads = {}
+
+    def _current(self):
+        """Return the (books, payloads) snapshot for the current paragraphs_version."""
+        conn = self._connect()
+        try:
+            version = conn.execute("SELECT version FROM paragraphs_version WHERE id = 1").fetchone()['version']
+            with self._lock:
+                if version != self._version:
+                    self._books = build_tree(conn.execute(NAV_QUERY).fetchall())
+                    self._payloads = {}
+                    self._version = version
+                return self._books, self._payloads
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _payload(payloads, key, make):
+        payload = payloads.get(key)
+        if payload is None:
+            body = json.dumps(make(), ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+            payload = payloads[key] = (hashlib.sha1(body).hexdigest(), body)
+        return payload
+
+    def books(self):
+        """(etag, body) for the list of book names."""
+        books, payloads = self._current()
+        return self._payload(payloads, ('books',), lambda: sorted(books))
+
+    def structure(self, book=None):
+        """(etag, body) for one book's tree, or every book's when book is None."""
+        books, payloads = self._current()
+        if book is None:
+            return self._payload(payloads, ('structure',), lambda: [books[b] for b in sorted(books)])
+        if book not in books:
+            # Not cached: the key comes straight from the query string
+            return self._payload({}, None, lambda: _node(book=book, chapters=[]))
+        return self._payload(payloads, ('structure', book), lambda: books[book])
@@ -0,0 +1,55 @@
+MAX_PAGE_SIZE = 500
+
+# Equality on (book, chapter, subtitle), or on (book, chapter) for a whole
+# chapter, plus a range on id is a single index range scan that is already in
+# id order, however deep the page is. Book-only pages still sort the book's rows.
+SCHEMA = """
+    CREATE INDEX IF NOT EXISTS idx_paragraphs_book_chapter_subtitle_id
+        ON paragraphs(book, chapter, subtitle, id);
+    CREATE INDEX IF NOT EXISTS idx_paragraphs_book_chapter_id
+        ON paragraphs(book, chapter, id);
+"""
+
+# What the shadowing cards render; file_source is left out on purpose
+CONTENT_COLUMNS = (
+    'id', 'book', 'chapter', 'subtitle', 'content', 'word_count',
+    'audio_path', 'tts_audio_path', 'user_audio_path',
+)
+
+
+def fetch_page(conn, book=None, chapter=None, subtitle=None, after_id=None, limit=100, offset=None):
+    """Return (rows, next_after_id) for one page of paragraphs in id order.
+
+    Pass the returned next_after_id back as after_id to get the following
+    page; it is None on the last page. offset is the legacy paging mode and
+    is only used when after_id is not given.
+    """
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    query = f"SELECT {', '.join(CONTENT_COLUMNS)} FROM paragraphs WHERE 1=1"
+    params = []
+
+    if book:
+        query += ' AND book = ?'
+        params.append(book)
+    if chapter:
+        query += ' AND chapter = ?'
+        params.append(chapter)
+    if subtitle:
+        query += ' AND subtitle = ?'
+        params.append(subtitle)
+    if after_id is not None:
+        query += ' AND id > ?'
+        params.append(after_id)
+
+    # Fetch one extra row to know whether another page exists
+    query += ' ORDER BY id LIMIT ?'
+    params.append(limit + 1)
+    if after_id is None and offset:
+        query += ' OFFSET ?'
+        params.append(offset)
+
+    rows = conn.execute(query, params).fetchall()
+    if len(rows) > limit:
+        rows = rows[:limit]
+        return rows, rows[-1]['id']
+    return rows, None
@@ -0,0 +1,318 @@
+"""Local intonation feedback: F0 contours of a recording and its reference, compared.
+
+F0 is estimated every HOP_MS with YIN, vectorized over all frames: the
+difference function comes from one FFT autocorrelation per frame and
+cumulative sums of squares, and each frame takes the first dip of the
+cumulative-mean-normalized difference below YIN_THRESHOLD. Quiet frames
+and frames without such a dip are unvoiced (NaN).
+
+Contours are compared in semitones relative to each speaker's median, so a
+low voice reading a high-voiced TTS sentence is not penalized for its
+register. The voiced frames of both, downsampled to DTW_HOP_MS, are aligned
+with DTW (computed one anti-diagonal at a time). The score comes from the
+mean absolute deviation along the path. The reference is split into phrases
+at its pauses, and each phrase reports the user's mean offset and whether
+its ending rises or falls like the reference.
+
+Reference contours (author/TTS audio) are cached as float16 in
+pitch_contours, keyed by path and span and invalidated when the file
+changes; user recordings are analyzed on every call.
+
+  python -m web_app.pitch reference.mp3 recording.wav
+"""
+import argparse
+import json
+import shutil
+import subprocess
+import warnings
+import wave
+
+import numpy as np
+
+from web_app import audio_probe
+from web_app.fingerprint import file_version
+
+FFMPEG_BIN = shutil.which('ffmpeg')
+SAMPLE_RATE = 16000
+HOP_MS = 10
+HOP = SAMPLE_RATE * HOP_MS // 1000
+WINDOW = 512                  # samples per YIN window (32 ms)
+F0_MIN = 70.0
+F0_MAX = 400.0
+TAU_MIN = int(SAMPLE_RATE / F0_MAX)
+TAU_MAX = int(SAMPLE_RATE / F0_MIN) + 1
+# Frames per FFT batch, to bound memory on long paragraphs
+CHUNK_FRAMES = 1000
+YIN_THRESHOLD = 0.15
+# Frames this far below the loudest frames are unvoiced
+SILENCE_DB = 35.0
+MEDIAN_FILTER = 5             # frames; removes octave jumps of single frames
+DTW_HOP_MS = 40
+MAX_DTW_POINTS = 1500
+# A pause of at least this long starts a new reference phrase
+PHRASE_GAP_MS = 200
+MIN_PHRASE_MS = 300
+# score = 100 * exp(-mean absolute deviation / SCORE_SCALE), in semitones
+SCORE_SCALE = 3.0
+# Phrase ending slope (semitones over its last ENDING_MS) that counts as rising/falling
+ENDING_MS = 300
+DIRECTION_SEMITONES = 1.0
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS pitch_contours (
+        key TEXT PRIMARY KEY,
+        version TEXT NOT NULL,
+        hop_ms INTEGER NOT NULL,
+        f0 BLOB NOT NULL,
+        created_at TEXT DEFAULT CURRENT_TIMESTAMP
+    );
+"""
+
+
+def decode(path, start_ms=None, end_ms=None):
+    """Mono float32 samples at SAMPLE_RATE; 16 kHz PCM WAVs are read directly, anything else via ffmpeg."""
+    if start_ms is None and audio_probe.is_assessment_ready(audio_probe.probe_wav(path)):
+        with wave.open(path, 'rb') as f:
+            data = f.readframes(f.getnframes())
+        return np.frombuffer(data, dtype='<i2').astype(np.float32) / 32768.0
+
+    if not FFMPEG_BIN:
+        raise RuntimeError("ffmpeg not found on server")
+    cmd = [FFMPEG_BIN, '-hide_banner', '-loglevel', 'error']
+    if start_ms is not None:
+        cmd += ['-ss', f"{start_ms / 1000:.3f}"]
+    cmd += ['-i', path]
+    if start_ms is not None and end_ms is not None:
+        cmd += ['-t', f"{(end_ms - start_ms) / 1000:.3f}"]
+    cmd += ['-ac', '1', '-ar', str(SAMPLE_RATE), '-f', 's16le', 'pipe:1']
+    proc = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr.decode(errors='ignore').strip() or f"ffmpeg failed on {path}")
+    return np.frombuffer(proc.stdout, dtype='<i2').astype(np.float32) / 32768.0
+
+
+def f0_contour(samples):
+    """F0 in Hz every HOP_MS (NaN where unvoiced), by YIN."""
+    span = WINDOW + TAU_MAX
+    if samples.size < span:
+        return np.full(0, np.nan, dtype=np.float32)
+    frames = np.lib.stride_tricks.sliding_window_view(samples, span)[::HOP]
+    f0 = np.empty(len(frames))
+    level = np.empty(len(frames))
+    for start in range(0, len(frames), CHUNK_FRAMES):
+        chunk = slice(start, start + CHUNK_FRAMES)
+        f0[chunk], level[chunk] = _yin(frames[chunk].astype(np.float64))
+    voiced = ~np.isnan(f0) & (level > np.percentile(level, 95) - SILENCE_DB)
+    return _median_filter(np.where(voiced, f0, np.nan)).astype(np.float32)
+
+
+def _yin(frames):
+    """(f0 or NaN, level in dB) of each frame of WINDOW + TAU_MAX samples."""
+    # r[t] = sum_j x[j] x[j + t] over the first WINDOW samples, for every lag at once
+    # (j + t < WINDOW + TAU_MAX, so a circular correlation of that length does not wrap)
+    n_fft = 1 << int(np.ceil(np.log2(frames.shape[1])))
+    spectrum = np.fft.rfft(frames, n_fft)
+    head = np.fft.rfft(frames[:, :WINDOW], n_fft)
+    acf = np.fft.irfft(spectrum * np.conj(head), n_fft)[:, :TAU_MAX + 1]
+
+    # d[t] = sum_j (x[j] - x[j + t])^2 = E(0) + E(t) - 2 r[t]
+    squares = np.concatenate([np.zeros((len(frames), 1)), np.cumsum(frames ** 2, axis=1)], axis=1)
+    lags = np.arange(TAU_MAX + 1)
+    energy = squares[:, lags + WINDOW] - squares[:, lags]
+    diff = np.maximum(energy[:, :1] + energy - 2 * acf, 0.0)
+
+    # Cumulative mean normalized difference d'[t] = d[t] t / sum_{k<=t} d[k]
+    cmnd = np.ones_like(diff)
+    cmnd[:, 1:] = diff[:, 1:] * lags[1:] / np.maximum(np.cumsum(diff[:, 1:], axis=1), 1e-12)
+
+    # First local minimum below the threshold in [TAU_MIN, TAU_MAX)
+    inner = cmnd[:, TAU_MIN:TAU_MAX]
+    dips = (inner < YIN_THRESHOLD) & (inner <= cmnd[:, TAU_MIN + 1:TAU_MAX + 1])
+    tau = TAU_MIN + np.argmax(dips, axis=1)
+
+    # Parabolic interpolation around the chosen lag
+    rows = np.arange(len(frames))
+    left, mid, right = cmnd[rows, tau - 1], cmnd[rows, tau], cmnd[rows, tau + 1]
+    curvature = left - 2 * mid + right
+    flat = np.abs(curvature) < 1e-12
+    shift = np.where(flat, 0.0, 0.5 * (left - right) / np.where(flat, 1.0, curvature))
+    f0 = SAMPLE_RATE / (tau + np.clip(shift, -1, 1))
+
+    level = 10 * np.log10(energy[:, 0] / WINDOW + 1e-10)
+    return np.where(dips.any(axis=1), f0, np.nan), level
+
+
+def _median_filter(f0):
+    """Median over MEDIAN_FILTER frames of voiced values; unvoiced frames stay NaN."""
+    half = MEDIAN_FILTER // 2
+    windows = np.lib.stride_tricks.sliding_window_view(np.pad(f0, half, constant_values=np.nan), MEDIAN_FILTER)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)   # all-NaN windows
+        smoothed = np.nanmedian(windows, axis=1)
+    return np.where(np.isnan(f0), np.nan, smoothed)
+
+
+def reference_contour(conn, path, start_ms=None, end_ms=None):
+    """Cached F0 contour of a reference file (or of its [start_ms, end_ms) span)."""
+    version = file_version(path)
+    if version is None:
+        raise FileNotFoundError(path)
+    key = path if start_ms is None else f"{path}#t={start_ms},{end_ms}"
+    row = conn.execute("SELECT version, hop_ms, f0 FROM pitch_contours WHERE key = ?", (key,)).fetchone()
+    if row is not None and row[0] == version and row[1] == HOP_MS:
+        return np.frombuffer(row[2], dtype=np.float16).astype(np.float32)
+
+    f0 = f0_contour(decode(path, start_ms, end_ms))
+    conn.execute(
+        "INSERT OR REPLACE INTO pitch_contours (key, version, hop_ms, f0) VALUES (?, ?, ?, ?)",
+        (key, version, HOP_MS, f0.astype(np.float16).tobytes())
+    )
+    conn.commit()
+    return f0
+
+
+def semitones(f0):
+    """Semitones relative to the contour's own median (NaN stays NaN)."""
+    voiced = f0[~np.isnan(f0)]
+    if voiced.size == 0:
+        return f0
+    return 12 * np.log2(f0 / np.median(voiced))
+
+
+def _downsample(contour):
+    """Mean over each DTW_HOP_MS block; a block is unvoiced if all of it is."""
+    step = max(1, DTW_HOP_MS // HOP_MS)
+    usable = contour.size - contour.size % step
+    if usable == 0:
+        return contour[:0], step
+    blocks = contour[:usable].reshape(-1, step)
+    voiced = ~np.isnan(blocks)
+    counts = voiced.sum(axis=1)
+    sums = np.where(voiced, blocks, 0).sum(axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(counts > 0, sums / counts, np.nan), step
+
+
+def dtw(a, b):
+    """Alignment path (pairs of indices) minimizing the summed |a[i] - b[j]|."""
+    n, m = a.size, b.size
+    cost = np.abs(a[:, None] - b[None, :])
+    acc = np.full((n + 1, m + 1), np.inf)
+    acc[0, 0] = 0.0
+    # Cells on anti-diagonal d = i + j depend only on diagonals d - 1 and d - 2
+    for d in range(2, n + m + 1):
+        i = np.arange(max(1, d - m), min(n, d - 1) + 1)
+        j = d - i
+        acc[i, j] = cost[i - 1, j - 1] + np.minimum(np.minimum(acc[i - 1, j], acc[i, j - 1]), acc[i - 1, j - 1])
+
+    path = []
+    i, j = n, m
+    while i > 0 and j > 0:
+        path.append((i - 1, j - 1))
+        step = np.argmin((acc[i - 1, j - 1], acc[i - 1, j], acc[i, j - 1]))
+        if step == 0:
+            i, j = i - 1, j - 1
+        elif step == 1:
+            i -= 1
+        else:
+            j -= 1
+    return np.array(path[::-1], dtype=np.int64).reshape(-1, 2)
+
+
+def _phrases(voiced_times, gap):
+    """[start, end) index ranges of runs of voiced points separated by more than gap."""
+    if voiced_times.size == 0:
+        return []
+    breaks = np.flatnonzero(np.diff(voiced_times) > gap) + 1
+    bounds = np.concatenate(([0], breaks, [voiced_times.size]))
+    return list(zip(bounds[:-1].tolist(), bounds[1:].tolist()))
+
+
+def _direction(times, values):
+    """'rising', 'falling' or 'flat' from the slope of the last ENDING_MS of a phrase."""
+    tail = times >= times[-1] - ENDING_MS / 1000
+    if tail.sum() < 2:
+        return 'flat'
+    slope = np.polyfit(times[tail], values[tail], 1)[0] * ENDING_MS / 1000
+    if slope > DIRECTION_SEMITONES:
+        return 'rising'
+    if slope < -DIRECTION_SEMITONES:
+        return 'falling'
+    return 'flat'
+
+
+def compare(reference_f0, user_f0):
+    """Similarity score (0-100) and per-phrase deviations of user_f0 from reference_f0."""
+    ref, step = _downsample(semitones(reference_f0))
+    user, _ = _downsample(semitones(user_f0))
+    hop = step * HOP_MS / 1000
+    ref_times = np.flatnonzero(~np.isnan(ref)) * hop
+    user_times = np.flatnonzero(~np.isnan(user)) * hop
+    ref_voiced = ref[~np.isnan(ref)]
+    user_voiced = user[~np.isnan(user)]
+    result = {
+        'reference_seconds': round(reference_f0.size * HOP_MS / 1000, 2),
+        'user_seconds': round(user_f0.size * HOP_MS / 1000, 2),
+        'reference_voiced': round(ref_voiced.size * hop, 2),
+        'user_voiced': round(user_voiced.size * hop, 2),
+    }
+    if ref_voiced.size < 2 or user_voiced.size < 2:
+        return {**result, 'score': None, 'error': 'Not enough voiced speech to compare'}
+
+    # Long recordings: compare every k-th voiced point
+    ref_every = int(np.ceil(ref_voiced.size / MAX_DTW_POINTS))
+    user_every = int(np.ceil(user_voiced.size / MAX_DTW_POINTS))
+    ref_times, ref_voiced = ref_times[::ref_every], ref_voiced[::ref_every]
+    user_times, user_voiced = user_times[::user_every], user_voiced[::user_every]
+
+    path = dtw(ref_voiced, user_voiced)
+    offsets = user_voiced[path[:, 1]] - ref_voiced[path[:, 0]]
+    deviation = float(np.mean(np.abs(offsets)))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        correlation = np.corrcoef(ref_voiced[path[:, 0]], user_voiced[path[:, 1]])[0, 1]
+    ref_range = np.percentile(ref_voiced, 95) - np.percentile(ref_voiced, 5)
+    user_range = np.percentile(user_voiced, 95) - np.percentile(user_voiced, 5)
+
+    segments = []
+    for start, end in _phrases(ref_times, PHRASE_GAP_MS / 1000):
+        if ref_times[end - 1] - ref_times[start] < MIN_PHRASE_MS / 1000:
+            continue
+        on_path = (path[:, 0] >= start) & (path[:, 0] < end)
+        if not on_path.any():
+            continue
+        pairs = path[on_path]
+        phrase_offsets = offsets[on_path]
+        user_idx = np.unique(pairs[:, 1])
+        segments.append({
+            'start': round(float(ref_times[start]), 2),
+            'end': round(float(ref_times[end - 1] + hop), 2),
+            'user_start': round(float(user_times[user_idx[0]]), 2),
+            'user_end': round(float(user_times[user_idx[-1]] + hop), 2),
+            'mean_offset': round(float(np.mean(phrase_offsets)), 2),
+            'deviation': round(float(np.mean(np.abs(phrase_offsets))), 2),
+            'reference_ending': _direction(ref_times[start:end], ref_voiced[start:end]),
+            'user_ending': _direction(user_times[user_idx], user_voiced[user_idx]),
+        })
+
+    return {
+        **result,
+        'score': round(100 * float(np.exp(-deviation / SCORE_SCALE)), 1),
+        'deviation_semitones': round(deviation, 2),
+        'correlation': round(float(correlation), 3) if np.isfinite(correlation) else None,
+        'range_ratio': round(float(user_range / ref_range), 2) if ref_range > 0 else None,
+        'segments': segments,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the intonation of a recording with a reference")
+    parser.add_argument("reference")
+    parser.add_argument("recording")
+    args = parser.parse_args()
+    reference = f0_contour(decode(args.reference))
+    recording = f0_contour(decode(args.recording))
+    print(json.dumps(compare(reference, recording), indent=2))
+
+
+if __name__ == "__main__":
+    main()
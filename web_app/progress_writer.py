@@ -0,0 +1,251 @@
+"""Write-behind buffer for user_words progress upserts.
+
+mark_known and flashcard uploads used to run one upsert and one commit each.
+Here they are buffered per worker and coalesced per (username, word, pos,
+level) - the latest value of each column wins - and a background thread
+writes them in one transaction every flush_ms milliseconds, or as soon as
+max_rows keys are pending.
+
+Durability modes:
+  buffered  the request returns once its update is buffered (default)
+  commit    the request waits for the transaction holding its update
+            (group commit: concurrent requests still share one commit)
+  direct    no buffering, one transaction per update (the old behaviour)
+
+Pending rows are written on interpreter exit. A failed flush (any
+exception, from SQLite or from after_write) keeps its rows, under any newer
+values, for the next attempt; retries back off up to MAX_RETRY_DELAY.
+"""
+import os
+import sqlite3
+import threading
+import time
+
+from metrics import metrics
+
+DURABILITY_MODES = ('buffered', 'commit', 'direct')
+# Longest pause between retries of a failing flush, in seconds
+MAX_RETRY_DELAY = 5.0
+
+# Columns an update may set; everything else is left to the existing row
+COLUMNS = ('is_known', 'user_audio_formal_path', 'user_audio_informal_path')
+
+
+def _upsert_sql(columns):
+    names = ', '.join(columns)
+    params = ', '.join('?' for _ in columns)
+    updates = ', '.join(f"{c} = excluded.{c}" for c in columns)
+    return (
+        f"INSERT INTO user_words (username, word, pos, level, {names}) "
+        f"VALUES (?, ?, ?, ?, {params}) "
+        f"ON CONFLICT(username, word, pos, level) DO UPDATE SET {updates}"
+    )
+
+
+class ProgressWriter:
+    """Coalescing write-behind queue in front of user_words.
+
+    after_write(conn, rows) runs inside the flush transaction with the
+    coalesced {key: columns} that were just written, so dependent rows (the
+    card schedule) commit together with them.
+    """
+
+    def __init__(self, connect, after_write=None, flush_ms=50, max_rows=200,
+                 durability='buffered', wait_timeout=5.0):
+        if durability not in DURABILITY_MODES:
+            raise ValueError(f"durability must be one of {DURABILITY_MODES}, got {durability!r}")
+        self._connect = connect
+        self._after_write = after_write
+        self.flush_ms = flush_ms
+        self.max_rows = max_rows
+        self.durability = durability
+        self.wait_timeout = wait_timeout
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._pending = {}
+        self._first_pending_at = None
+        self._seq = 0
+        self._durable_seq = 0
+        self._pid = None
+        self._thread = None
+        self._closed = False
+        self._failures = 0
+        self._stats = {
+            'updates': 0,
+            'coalesced': 0,
+            'flushes': 0,
+            'rows_written': 0,
+            'max_batch': 0,
+            'failed_flushes': 0,
+            'direct_writes': 0,
+            'flush_seconds': 0.0,
+        }
+
+    def _ensure_started(self):
+        # Called with self._cond held. A writer inherited through a fork
+        # (gunicorn --preload) starts its own thread with an empty buffer.
+        if self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._pending = {}
+        self._first_pending_at = None
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name='progress-writer', daemon=True)
+        self._thread.start()
+
+    def put(self, username, word, pos, level, wait=None, **columns):
+        """Queue an upsert of `columns` for one user_words row.
+
+        wait=True blocks until the update is committed (or wait_timeout
+        passes) whatever the durability mode; returns whether it was.
+        """
+        if self.durability == 'direct':
+            self.write(username, word, pos, level, **columns)
+            return True
+
+        unknown = set(columns) - set(COLUMNS)
+        if unknown:
+            raise ValueError(f"Unsupported user_words columns: {sorted(unknown)}")
+        key = (username, word, pos, level)
+
+        with self._cond:
+            self._ensure_started()
+            self._stats['updates'] += 1
+            row = self._pending.get(key)
+            if row is None:
+                self._pending[key] = dict(columns)
+                if self._first_pending_at is None:
+                    self._first_pending_at = time.monotonic()
+            else:
+                self._stats['coalesced'] += 1
+                row.update(columns)
+            self._seq += 1
+            seq = self._seq
+            self._cond.notify_all()
+
+            if wait is None:
+                wait = self.durability == 'commit'
+            if not wait:
+                return False
+            deadline = time.monotonic() + self.wait_timeout
+            while self._durable_seq < seq:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+            return True
+
+    def write(self, username, word, pos, level, **columns):
+        """Upsert one row in its own transaction now, bypassing the buffer.
+
+        For callers whose put(wait=True) timed out. A buffered value for the
+        same row already includes these columns, so its later flush agrees.
+        """
+        unknown = set(columns) - set(COLUMNS)
+        if unknown:
+            raise ValueError(f"Unsupported user_words columns: {sorted(unknown)}")
+        self._write({(username, word, pos, level): columns})
+        with self._cond:
+            self._stats['updates'] += 1
+            self._stats['direct_writes'] += 1
+
+    def _run(self):
+        pid = os.getpid()
+        while True:
+            with self._cond:
+                while not self._pending and not self._closed:
+                    self._cond.wait()
+                if self._pid != pid or (self._closed and not self._pending):
+                    return
+                # Hold the batch open for flush_ms unless it is already full
+                while (self._pending and not self._closed
+                       and len(self._pending) < self.max_rows):
+                    remaining = self._first_pending_at + self.flush_ms / 1000 - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+            self.flush()
+            with self._cond:
+                # Back off while flushes keep failing, so a broken row does not spin
+                if self._failures:
+                    delay = min(MAX_RETRY_DELAY, self.flush_ms / 1000 * 2 ** min(self._failures, 16))
+                    deadline = time.monotonic() + delay
+                    while not self._closed and time.monotonic() < deadline:
+                        self._cond.wait(deadline - time.monotonic())
+
+    def flush(self):
+        """Write everything pending in one transaction; returns the rows written."""
+        with self._flush_lock:
+            with self._cond:
+                if self._pid != os.getpid() or not self._pending:
+                    return 0
+                batch, self._pending = self._pending, {}
+                self._first_pending_at = None
+                seq = self._seq
+            try:
+                self._write(batch)
+            except Exception as e:
+                # Also after_write errors: the thread must survive to retry
+                print(f"user_words flush of {len(batch)} rows failed: {e!r}")
+                with self._cond:
+                    self._failures += 1
+                    self._stats['failed_flushes'] += 1
+                    for key, columns in batch.items():
+                        newer = self._pending.get(key)
+                        self._pending[key] = {**columns, **newer} if newer else columns
+                    if self._first_pending_at is None:
+                        self._first_pending_at = time.monotonic()
+                return 0
+            with self._cond:
+                self._failures = 0
+                self._durable_seq = max(self._durable_seq, seq)
+                self._stats['flushes'] += 1
+                self._stats['rows_written'] += len(batch)
+                self._stats['max_batch'] = max(self._stats['max_batch'], len(batch))
+                self._cond.notify_all()
+            return len(batch)
+
+    def _write(self, batch):
+        groups = {}
+        for key, columns in batch.items():
+            names = tuple(sorted(columns))
+            groups.setdefault(names, []).append((*key, *(columns[c] for c in names)))
+
+        start = time.perf_counter()
+        conn = self._connect()
+        try:
+            with metrics.span('user_words.flush'):
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    for names, rows in groups.items():
+                        conn.executemany(_upsert_sql(names), rows)
+                    if self._after_write:
+                        self._after_write(conn, batch)
+                    conn.commit()
+                except BaseException:
+                    conn.rollback()
+                    raise
+        finally:
+            conn.close()
+        with self._cond:
+            self._stats['flush_seconds'] += time.perf_counter() - start
+
+    def close(self):
+        """Flush what is pending and stop the background thread (registered atexit)."""
+        with self._cond:
+            if self._pid != os.getpid():
+                return
+            self._closed = True
+            self._cond.notify_all()
+        self.flush()
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self._stats)
+            stats['pending'] = len(self._pending) if self._pid == os.getpid() else 0
+        stats['durability'] = self.durability
+        stats['flush_ms'] = self.flush_ms
+        stats['max_rows'] = self.max_rows
+        stats['avg_flush_ms'] = stats['flush_seconds'] * 1000 / (stats['flushes'] or 1)
+        stats['pid'] = os.getpid()
+        return stats
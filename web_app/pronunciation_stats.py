@@ -0,0 +1,213 @@
+"""Running pronunciation statistics per user, per flashcard word and per paragraph.
+
+Every report saved by a rating job also updates, in the same transaction,
+its aggregate rows in pronunciation_stats (report count, sum and EWMA of each
+score) and the user's mispronounced-word counts in pronunciation_mistakes.
+The stats endpoints then read a handful of rows by key instead of parsing
+every mispronunciations_json blob.
+
+Reports without a username (shadowing) are aggregated under username ''.
+Rebuild everything from pronunciation_reports with
+`python -m web_app.pronunciation_stats backfill`.
+"""
+import argparse
+import json
+import os
+import sqlite3
+
+SCORES = ('pronunciation', 'accuracy', 'fluency', 'prosody', 'total')
+# Weight of the newest report in the moving average
+EWMA_ALPHA = 0.3
+
+USER = 'user'
+WORD = 'word'            # subject_id = oxford_words.id (flashcard audio_id)
+PARAGRAPH = 'paragraph'  # subject_id = paragraphs.id (shadowing audio_id)
+SCOPES = (USER, WORD, PARAGRAPH)
+
+_SCORE_COLUMNS = ''.join(
+    f"        {s}_n INTEGER NOT NULL DEFAULT 0,\n"
+    f"        {s}_sum REAL NOT NULL DEFAULT 0,\n"
+    f"        {s}_ewma REAL,\n"
+    for s in SCORES
+)
+
+SCHEMA = f"""
+    CREATE TABLE IF NOT EXISTS pronunciation_stats (
+        username TEXT NOT NULL,
+        scope TEXT NOT NULL,
+        subject_id INTEGER NOT NULL,
+        reports INTEGER NOT NULL DEFAULT 0,
+{_SCORE_COLUMNS}        last_report_id INTEGER,
+        updated_at TEXT DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (username, scope, subject_id)
+    );
+    CREATE INDEX IF NOT EXISTS idx_pronunciation_stats_weakest
+        ON pronunciation_stats(username, scope, pronunciation_ewma);
+    CREATE TABLE IF NOT EXISTS pronunciation_mistakes (
+        username TEXT NOT NULL,
+        word TEXT NOT NULL,
+        count INTEGER NOT NULL DEFAULT 0,
+        accuracy_sum REAL NOT NULL DEFAULT 0,
+        last_report_id INTEGER,
+        PRIMARY KEY (username, word)
+    );
+    CREATE INDEX IF NOT EXISTS idx_pronunciation_mistakes_count
+        ON pronunciation_mistakes(username, count);
+"""
+
+_STATS_UPSERT = (
+    "INSERT INTO pronunciation_stats (username, scope, subject_id, reports, "
+    + ''.join(f"{s}_n, {s}_sum, {s}_ewma, " for s in SCORES)
+    + "last_report_id) VALUES (?, ?, ?, 1, " + '?, ' * (3 * len(SCORES)) + "?) "
+    "ON CONFLICT(username, scope, subject_id) DO UPDATE SET reports = reports + 1, "
+    + ''.join(
+        f"{s}_n = {s}_n + excluded.{s}_n, {s}_sum = {s}_sum + excluded.{s}_sum, "
+        f"{s}_ewma = CASE WHEN excluded.{s}_ewma IS NULL THEN {s}_ewma "
+        f"WHEN {s}_ewma IS NULL THEN excluded.{s}_ewma "
+        f"ELSE {s}_ewma + {EWMA_ALPHA} * (excluded.{s}_ewma - {s}_ewma) END, "
+        for s in SCORES
+    )
+    + "last_report_id = excluded.last_report_id, updated_at = CURRENT_TIMESTAMP"
+)
+
+_MISTAKE_UPSERT = """
+    INSERT INTO pronunciation_mistakes (username, word, count, accuracy_sum, last_report_id)
+    VALUES (?, ?, 1, ?, ?)
+    ON CONFLICT(username, word) DO UPDATE SET
+        count = count + 1,
+        accuracy_sum = accuracy_sum + excluded.accuracy_sum,
+        last_report_id = excluded.last_report_id
+"""
+
+
+def _normalize_word(word):
+    return (word or '').strip(' .,!?;:"()[]').lower()
+
+
+def record_report(conn, report_id, report):
+    """Fold one pronunciation report into the aggregates; the caller commits.
+
+    report is a mapping with username, source, audio_id, the *_score values
+    and mispronunciations (a list, or the stored JSON text).
+    """
+    username = report.get('username') or ''
+    values = []
+    for s in SCORES:
+        x = report.get(f'{s}_score')
+        values += [int(x is not None), x or 0.0, x]
+
+    subjects = [(USER, 0)]
+    if report.get('audio_id') is not None:
+        subjects.append((PARAGRAPH if report.get('source') == 'shadowing' else WORD, report['audio_id']))
+    conn.executemany(_STATS_UPSERT, [
+        (username, scope, subject_id, *values, report_id) for scope, subject_id in subjects
+    ])
+
+    mistakes = report.get('mispronunciations') or []
+    if isinstance(mistakes, str):
+        try:
+            mistakes = json.loads(mistakes)
+        except ValueError:
+            mistakes = []
+    rows = []
+    for item in mistakes:
+        word = _normalize_word(item.get('word')) if isinstance(item, dict) else ''
+        if word:
+            rows.append((username, word, item.get('accuracy') or 0.0, report_id))
+    if rows:
+        conn.executemany(_MISTAKE_UPSERT, rows)
+
+
+def rebuild(conn):
+    """Recompute all aggregates from pronunciation_reports; returns the report count.
+
+    Runs in one BEGIN IMMEDIATE transaction so reports saved meanwhile are
+    applied on top of the rebuilt rows, not lost or counted twice.
+    """
+    conn.executescript(SCHEMA)
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.execute("DELETE FROM pronunciation_stats")
+        conn.execute("DELETE FROM pronunciation_mistakes")
+        count = 0
+        for row in conn.execute(
+            "SELECT id, username, source, audio_id, "
+            + ', '.join(f"{s}_score" for s in SCORES)
+            + ", mispronunciations_json AS mispronunciations FROM pronunciation_reports ORDER BY id"
+        ).fetchall():
+            record_report(conn, row['id'], dict(row))
+            count += 1
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    return count
+
+
+def _stats_row(row):
+    stats = {
+        'reports': row['reports'],
+        'last_report_id': row['last_report_id'],
+        'updated_at': row['updated_at'],
+        'scores': {},
+    }
+    for s in SCORES:
+        n = row[f'{s}_n']
+        stats['scores'][s] = {
+            'n': n,
+            'mean': row[f'{s}_sum'] / n if n else None,
+            'ewma': row[f'{s}_ewma'],
+        }
+    return stats
+
+
+def get_stats(conn, username, scope=USER, subject_id=0):
+    """Aggregates of one user (scope 'user') or one of the user's words/paragraphs, or None."""
+    row = conn.execute(
+        "SELECT * FROM pronunciation_stats WHERE username = ? AND scope = ? AND subject_id = ?",
+        (username or '', scope, subject_id)
+    ).fetchone()
+    return _stats_row(row) if row else None
+
+
+def weakest(conn, username, scope=WORD, limit=10):
+    """The user's words or paragraphs with the lowest pronunciation EWMA."""
+    rows = conn.execute(
+        "SELECT * FROM pronunciation_stats "
+        "WHERE username = ? AND scope = ? AND pronunciation_ewma IS NOT NULL "
+        "ORDER BY pronunciation_ewma LIMIT ?",
+        (username or '', scope, limit)
+    ).fetchall()
+    return [{'subject_id': row['subject_id'], **_stats_row(row)} for row in rows]
+
+
+def top_mistakes(conn, username, limit=10):
+    """The user's most often mispronounced words with their mean accuracy."""
+    rows = conn.execute(
+        "SELECT word, count, accuracy_sum FROM pronunciation_mistakes "
+        "WHERE username = ? ORDER BY count DESC LIMIT ?",
+        (username or '', limit)
+    ).fetchall()
+    return [
+        {'word': row['word'], 'count': row['count'], 'mean_accuracy': row['accuracy_sum'] / row['count']}
+        for row in rows
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pronunciation statistics maintenance")
+    parser.add_argument("command", choices=["backfill"])
+    parser.add_argument("--db", default=os.environ.get(
+        "FGL_DB_PATH", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "masterfgl.db")
+    ))
+    args = parser.parse_args()
+    conn = sqlite3.connect(args.db, timeout=30)
+    conn.row_factory = sqlite3.Row
+    try:
+        print(f"Aggregated {rebuild(conn)} pronunciation reports")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
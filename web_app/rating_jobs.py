@@ -0,0 +1,267 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS rating_jobs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        dedup_key TEXT NOT NULL,
+        status TEXT NOT NULL DEFAULT 'queued',
+        source TEXT,
+        payload_json TEXT NOT NULL,
+        result_json TEXT,
+        error TEXT,
+        worker_pid INTEGER,
+        created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+        started_at TEXT,
+        finished_at TEXT
+    );
+    CREATE INDEX IF NOT EXISTS idx_rating_jobs_dedup_key ON rating_jobs(dedup_key);
+    CREATE INDEX IF NOT EXISTS idx_rating_jobs_status ON rating_jobs(status);
+"""
+
+PENDING_STATUSES = ('queued', 'running')
+TERMINAL_STATUSES = ('done', 'failed')
+
+
+class QueueFull(Exception):
+    pass
+
+
+def recording_key(source, file_path, reference_text):
+    """Identify one take of one recording: re-uploading changes size/mtime."""
+    st = os.stat(file_path)
+    raw = f"{source}|{os.path.abspath(file_path)}|{st.st_size}|{st.st_mtime_ns}|{reference_text}"
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+
+def _pid_alive(pid):
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class RatingJobQueue:
+    """Pronunciation assessments persisted in SQLite, run by a bounded thread pool.
+
+    /api/rate inserts a job and returns immediately; the assessment runs on one
+    of max_workers threads so HTTP workers stay free. Jobs submitted for the
+    same recording while an earlier one is pending (or already finished) are
+    answered with that job instead of a second Azure session.
+    """
+
+    def __init__(self, connect, runner, max_workers=2, max_pending=20):
+        self._connect = connect
+        self._runner = runner
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._events = {}
+        self._local_pending = 0
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='rating')
+            self._events = {}
+            self._local_pending = 0
+
+        conn = self._connect()
+        try:
+            conn.executescript(SCHEMA)
+            orphans = conn.execute(
+                "SELECT id, worker_pid FROM rating_jobs WHERE status IN ('queued', 'running')"
+            ).fetchall()
+        finally:
+            conn.close()
+        for row in orphans:
+            if not _pid_alive(row['worker_pid']):
+                self._claim_and_schedule(row['id'], row['worker_pid'])
+
+    def _claim_and_schedule(self, job_id, previous_pid):
+        conn = self._connect()
+        try:
+            cur = conn.execute(
+                "UPDATE rating_jobs SET status = 'queued', worker_pid = ? WHERE id = ? AND worker_pid IS ?",
+                (os.getpid(), job_id, previous_pid)
+            )
+            conn.commit()
+            claimed = cur.rowcount == 1
+        finally:
+            conn.close()
+        if claimed:
+            print(f"Recovered orphaned rating job {job_id}")
+            self._schedule(job_id)
+
+    def _schedule(self, job_id):
+        with self._lock:
+            self._events[job_id] = threading.Event()
+            self._local_pending += 1
+        self._executor.submit(self._run, job_id)
+
+    def submit(self, dedup_key, payload, reuse_finished=True):
+        """Queue a job (or reuse a matching one). Returns the job dict.
+
+        With reuse_finished=False only a still-pending job is reused, so a
+        finished recording is assessed again.
+        """
+        self._ensure_started()
+        with self._lock:
+            if self._local_pending >= self.max_pending:
+                raise QueueFull("Rating queue is full, try again shortly")
+
+        conn = self._connect()
+        try:
+            # BEGIN IMMEDIATE serialises check-then-insert across gunicorn workers
+            conn.execute("BEGIN IMMEDIATE")
+            if reuse_finished:
+                condition = "status != 'failed'"
+            else:
+                condition = "status IN ('queued', 'running')"
+            existing = conn.execute(
+                f"SELECT * FROM rating_jobs WHERE dedup_key = ? AND {condition} ORDER BY id DESC LIMIT 1",
+                (dedup_key,)
+            ).fetchone()
+            if existing:
+                conn.rollback()
+                return self._row_to_job(existing)
+
+            cur = conn.execute(
+                "INSERT INTO rating_jobs (dedup_key, status, source, payload_json, worker_pid) VALUES (?, 'queued', ?, ?, ?)",
+                (dedup_key, payload.get('source'), json.dumps(payload), os.getpid())
+            )
+            job_id = cur.lastrowid
+            conn.commit()
+        finally:
+            conn.close()
+
+        self._schedule(job_id)
+        return {'job_id': job_id, 'status': 'queued'}
+
+    def _run(self, job_id):
+        # Whatever fails (including "database is locked" on the status updates),
+        # the pending count and long-poll waiters must be released
+        try:
+            self._execute(job_id)
+        except Exception as e:
+            print(f"Rating job {job_id} could not be run or stored: {e}")
+            self._mark_failed(job_id, str(e))
+        finally:
+            with self._lock:
+                self._local_pending -= 1
+                event = self._events.pop(job_id, None)
+            if event:
+                event.set()
+
+    def _execute(self, job_id):
+        conn = self._connect()
+        try:
+            conn.execute(
+                "UPDATE rating_jobs SET status = 'running', started_at = CURRENT_TIMESTAMP WHERE id = ?",
+                (job_id,)
+            )
+            conn.commit()
+            payload = json.loads(conn.execute(
+                "SELECT payload_json FROM rating_jobs WHERE id = ?", (job_id,)
+            ).fetchone()['payload_json'])
+        finally:
+            conn.close()
+
+        try:
+            result, err = self._runner(payload)
+        except Exception as e:
+            print(f"Rating job {job_id} crashed: {e}")
+            result, err = None, str(e)
+
+        conn = self._connect()
+        try:
+            conn.execute(
+                """
+                UPDATE rating_jobs
+                SET status = ?, result_json = ?, error = ?, finished_at = CURRENT_TIMESTAMP
+                WHERE id = ?
+                """,
+                ('failed' if err else 'done', None if err else json.dumps(result), err, job_id)
+            )
+            conn.commit()
+        finally:
+            conn.close()
+
+    def _mark_failed(self, job_id, error):
+        """Best effort: leave the job 'failed' rather than 'queued'/'running' for good."""
+        try:
+            conn = self._connect()
+            try:
+                conn.execute(
+                    "UPDATE rating_jobs SET status = 'failed', error = ?, finished_at = CURRENT_TIMESTAMP "
+                    "WHERE id = ? AND status IN ('queued', 'running')",
+                    (error, job_id)
+                )
+                conn.commit()
+            finally:
+                conn.close()
+        except Exception as e:
+            print(f"Could not mark rating job {job_id} failed: {e}")
+
+    def get(self, job_id, wait=0.0):
+        """Return the job dict, optionally blocking up to `wait` seconds for completion.
+
+        Jobs running in this process are awaited on their completion event;
+        jobs owned by another gunicorn worker fall back to re-reading the row.
+        """
+        self._ensure_started()
+        deadline = time.monotonic() + max(0.0, wait)
+        while True:
+            conn = self._connect()
+            try:
+                row = conn.execute("SELECT * FROM rating_jobs WHERE id = ?", (job_id,)).fetchone()
+            finally:
+                conn.close()
+            if row is None:
+                return None
+            job = self._row_to_job(row)
+            remaining = deadline - time.monotonic()
+            if job['status'] in TERMINAL_STATUSES or remaining <= 0:
+                return job
+            with self._lock:
+                event = self._events.get(job_id)
+            if event:
+                event.wait(remaining)
+            else:
+                time.sleep(min(0.5, remaining))
+
+    def stats(self):
+        with self._lock:
+            local_pending = self._local_pending
+        conn = self._connect()
+        try:
+            rows = conn.execute("SELECT status, COUNT(*) AS n FROM rating_jobs GROUP BY status").fetchall()
+        finally:
+            conn.close()
+        return {
+            'max_workers': self.max_workers,
+            'local_pending': local_pending,
+            'jobs': {row['status']: row['n'] for row in rows},
+        }
+
+    @staticmethod
+    def _row_to_job(row):
+        job = {'job_id': row['id'], 'status': row['status']}
+        if row['status'] == 'done' and row['result_json']:
+            job['result'] = json.loads(row['result_json'])
+        if row['status'] == 'failed':
+            job['error'] = row['error']
+        return job
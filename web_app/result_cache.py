@@ -0,0 +1,197 @@
+import functools
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS result_cache (
+        cache_key TEXT PRIMARY KEY,
+        kind TEXT NOT NULL,
+        audio_sha256 TEXT NOT NULL,
+        result_json TEXT NOT NULL,
+        elapsed_ms REAL,
+        audio_seconds REAL,
+        hits INTEGER DEFAULT 0,
+        created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+        last_hit_at TEXT
+    );
+    CREATE TABLE IF NOT EXISTS result_cache_stats (
+        kind TEXT PRIMARY KEY,
+        hits INTEGER DEFAULT 0,
+        misses INTEGER DEFAULT 0,
+        bypasses INTEGER DEFAULT 0,
+        saved_ms REAL DEFAULT 0,
+        saved_audio_seconds REAL DEFAULT 0
+    );
+"""
+
+TRANSCRIPTION = 'transcription'
+ASSESSMENT = 'assessment'
+# Seconds between writes of the in-memory hit/miss counters
+STATS_FLUSH_INTERVAL = 5.0
+STAT_FIELDS = ('hits', 'misses', 'bypasses', 'saved_ms', 'saved_audio_seconds')
+
+
+@functools.lru_cache(maxsize=512)
+def _digest(path, size, mtime_ns):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def audio_digest(file_path):
+    """sha256 of the recording's bytes, memoised per (path, size, mtime)."""
+    st = os.stat(file_path)
+    return _digest(os.path.abspath(file_path), st.st_size, st.st_mtime_ns)
+
+
+def result_key(kind, audio_sha256, reference_text, config):
+    """Same audio + same reference text + same service settings => same result."""
+    raw = json.dumps([kind, audio_sha256, reference_text or '', config], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+class ResultCache:
+    """Transcription / pronunciation assessment results keyed by result_key().
+
+    Lookups only read. Hit/miss counters accumulate in memory and are added
+    to SQLite by flush() (see maybe_flush), so hit rates add up across
+    gunicorn workers without a write on every request.
+    """
+
+    def __init__(self, connect):
+        self._connect = connect
+        self._lock = threading.Lock()
+        self._counts = {}     # kind -> {field: delta}
+        self._key_hits = {}   # cache_key -> [hits, last hit timestamp]
+        self._last_flush = time.monotonic()
+
+    def get(self, kind, key):
+        """Return the cached result dict (counting a hit), or None (counting a miss)."""
+        conn = self._connect()
+        try:
+            row = conn.execute(
+                "SELECT result_json, elapsed_ms, audio_seconds FROM result_cache WHERE cache_key = ?",
+                (key,)
+            ).fetchone()
+        finally:
+            conn.close()
+        if row is None:
+            self._count(kind, misses=1)
+            return None
+        self._count(kind, hits=1, saved_ms=row['elapsed_ms'] or 0,
+                    saved_audio_seconds=row['audio_seconds'] or 0)
+        with self._lock:
+            entry = self._key_hits.setdefault(key, [0, None])
+            entry[0] += 1
+            entry[1] = time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime())
+        return json.loads(row['result_json'])
+
+    def put(self, kind, key, audio_sha256, result, elapsed_ms=None, audio_seconds=None):
+        conn = self._connect()
+        try:
+            conn.execute(
+                """
+                INSERT INTO result_cache (cache_key, kind, audio_sha256, result_json, elapsed_ms, audio_seconds)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT(cache_key) DO UPDATE SET
+                    result_json = excluded.result_json,
+                    elapsed_ms = excluded.elapsed_ms,
+                    audio_seconds = excluded.audio_seconds,
+                    created_at = CURRENT_TIMESTAMP
+                """,
+                (key, kind, audio_sha256, json.dumps(result), elapsed_ms, audio_seconds)
+            )
+            conn.commit()
+        finally:
+            conn.close()
+
+    def record_bypass(self, kind):
+        self._count(kind, bypasses=1)
+
+    def _count(self, kind, **deltas):
+        with self._lock:
+            counts = self._counts.setdefault(kind, dict.fromkeys(STAT_FIELDS, 0))
+            for field, value in deltas.items():
+                counts[field] += value
+
+    def flush(self):
+        """Add this process's counters to result_cache / result_cache_stats."""
+        with self._lock:
+            counts, self._counts = self._counts, {}
+            key_hits, self._key_hits = self._key_hits, {}
+            self._last_flush = time.monotonic()
+        if not counts and not key_hits:
+            return
+        try:
+            conn = self._connect()
+            try:
+                conn.executemany(
+                    """
+                    INSERT INTO result_cache_stats (kind, hits, misses, bypasses, saved_ms, saved_audio_seconds)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                    ON CONFLICT(kind) DO UPDATE SET
+                        hits = hits + excluded.hits,
+                        misses = misses + excluded.misses,
+                        bypasses = bypasses + excluded.bypasses,
+                        saved_ms = saved_ms + excluded.saved_ms,
+                        saved_audio_seconds = saved_audio_seconds + excluded.saved_audio_seconds
+                    """,
+                    [(kind, *(c[field] for field in STAT_FIELDS)) for kind, c in counts.items()]
+                )
+                conn.executemany(
+                    "UPDATE result_cache SET hits = hits + ?, last_hit_at = ? WHERE cache_key = ?",
+                    [(hits, last_hit_at, key) for key, (hits, last_hit_at) in key_hits.items()]
+                )
+                conn.commit()
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            # Keep the counters for the next attempt
+            print(f"Result cache stats flush failed: {e}")
+            with self._lock:
+                for kind, c in counts.items():
+                    merged = self._counts.setdefault(kind, dict.fromkeys(STAT_FIELDS, 0))
+                    for field in STAT_FIELDS:
+                        merged[field] += c[field]
+                for key, (hits, last_hit_at) in key_hits.items():
+                    entry = self._key_hits.setdefault(key, [0, last_hit_at])
+                    entry[0] += hits
+
+    def maybe_flush(self):
+        """Flush if STATS_FLUSH_INTERVAL has passed. Call only outside DB transactions."""
+        if time.monotonic() - self._last_flush >= STATS_FLUSH_INTERVAL:
+            self.flush()
+
+    def stats(self):
+        self.flush()
+        conn = self._connect()
+        try:
+            counters = conn.execute("SELECT * FROM result_cache_stats").fetchall()
+            entries = {
+                row['kind']: row['n']
+                for row in conn.execute("SELECT kind, COUNT(*) AS n FROM result_cache GROUP BY kind")
+            }
+        finally:
+            conn.close()
+
+        out = {}
+        for row in counters:
+            lookups = row['hits'] + row['misses']
+            out[row['kind']] = {
+                'entries': entries.get(row['kind'], 0),
+                'hits': row['hits'],
+                'misses': row['misses'],
+                'bypasses': row['bypasses'],
+                'hit_rate': row['hits'] / lookups if lookups else None,
+                # Round-trips avoided, and what they would have cost
+                'saved_round_trips': row['hits'],
+                'saved_seconds': row['saved_ms'] / 1000,
+                'saved_audio_seconds': row['saved_audio_seconds'],
+            }
+        return out
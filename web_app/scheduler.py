@@ -0,0 +1,296 @@
+"""SM-2 spaced-repetition schedule for flashcards.
+
+Each (username, word, pos, level) a user has reviewed gets an interval, ease
+factor and due time in card_schedule. /api/card serves the most overdue card
+with one lookup on idx_card_schedule_due and only falls back to a new random
+card (CardSampler) when nothing is due. Grades come from pronunciation
+assessment scores and from mark_known.
+
+Existing is_known flags are migrated per user the first time the user's
+schedule is read (or for everyone with `python -m web_app.scheduler migrate`).
+"""
+import argparse
+import os
+import sqlite3
+import threading
+import time
+
+from web_app.card_sampler import ALL_LEVELS
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS card_schedule (
+        username TEXT NOT NULL,
+        word TEXT NOT NULL,
+        pos TEXT NOT NULL,
+        level TEXT NOT NULL,
+        due_at INTEGER NOT NULL,
+        interval_days REAL NOT NULL DEFAULT 0,
+        ease REAL NOT NULL DEFAULT 2.5,
+        repetitions INTEGER NOT NULL DEFAULT 0,
+        lapses INTEGER NOT NULL DEFAULT 0,
+        last_grade INTEGER,
+        last_reviewed_at INTEGER,
+        PRIMARY KEY (username, word, pos, level)
+    );
+    CREATE INDEX IF NOT EXISTS idx_card_schedule_due ON card_schedule(username, due_at);
+    CREATE INDEX IF NOT EXISTS idx_card_schedule_level_due ON card_schedule(username, level, due_at);
+    CREATE TABLE IF NOT EXISTS card_schedule_users (
+        username TEXT PRIMARY KEY,
+        migrated_at TEXT DEFAULT CURRENT_TIMESTAMP
+    );
+"""
+
+DAY = 86400
+MIN_EASE = 1.3
+DEFAULT_EASE = 2.5
+# A failed card comes back within the same session
+RELEARN_SECONDS = 10 * 60
+# mark_known / migrated is_known cards: treated as three good reviews
+KNOWN_INTERVAL_DAYS = 21
+KNOWN_REPETITIONS = 3
+
+# Pronunciation score (0-100) -> SM-2 grade (0-5); below 3 is a lapse
+SCORE_GRADES = ((90, 5), (80, 4), (70, 3), (55, 2), (40, 1))
+
+
+def grade_from_score(score):
+    for threshold, grade in SCORE_GRADES:
+        if score >= threshold:
+            return grade
+    return 0
+
+
+def sm2(state, grade, now):
+    """Return the schedule row after a review with grade 0-5.
+
+    state is the current row (a mapping with interval_days, ease,
+    repetitions, lapses) or None for a card that was never reviewed.
+    """
+    interval = state['interval_days'] if state else 0
+    ease = state['ease'] if state else DEFAULT_EASE
+    repetitions = state['repetitions'] if state else 0
+    lapses = state['lapses'] if state else 0
+
+    if grade >= 3:
+        if repetitions == 0:
+            interval = 1
+        elif repetitions == 1:
+            interval = 6
+        else:
+            interval = interval * ease
+        repetitions += 1
+        due_at = now + int(interval * DAY)
+    else:
+        if repetitions:
+            lapses += 1
+        repetitions = 0
+        interval = 0
+        due_at = now + RELEARN_SECONDS
+
+    ease = max(MIN_EASE, ease + 0.1 - (5 - grade) * (0.08 + (5 - grade) * 0.02))
+    return {
+        'due_at': due_at,
+        'interval_days': interval,
+        'ease': ease,
+        'repetitions': repetitions,
+        'lapses': lapses,
+        'last_grade': grade,
+        'last_reviewed_at': now,
+    }
+
+
+_UPSERT = """
+    INSERT INTO card_schedule (
+        username, word, pos, level, due_at, interval_days, ease,
+        repetitions, lapses, last_grade, last_reviewed_at
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(username, word, pos, level) DO UPDATE SET
+        due_at = excluded.due_at,
+        interval_days = excluded.interval_days,
+        ease = excluded.ease,
+        repetitions = excluded.repetitions,
+        lapses = excluded.lapses,
+        last_grade = excluded.last_grade,
+        last_reviewed_at = excluded.last_reviewed_at
+"""
+
+# is_known cards get a KNOWN_INTERVAL_DAYS interval, with due dates spread
+# over the following KNOWN_INTERVAL_DAYS so they do not all fall due at once
+_MIGRATE_KNOWN = f"""
+    INSERT OR IGNORE INTO card_schedule (
+        username, word, pos, level, due_at, interval_days, ease, repetitions, lapses
+    )
+    SELECT username, word, pos, level,
+           :now + {KNOWN_INTERVAL_DAYS * DAY} + abs(random()) % {KNOWN_INTERVAL_DAYS * DAY},
+           {KNOWN_INTERVAL_DAYS}, {DEFAULT_EASE}, {KNOWN_REPETITIONS}, 0
+    FROM user_words
+    WHERE username = :username AND is_known = 1
+"""
+
+# Replays earlier flashcard assessments (oldest first) on top of the migrated flags
+_PAST_REPORTS = """
+    SELECT ow.word, ow.pos, ow.level, pr.pronunciation_score,
+           CAST(strftime('%s', pr.created_at) AS INTEGER) AS reviewed_at
+    FROM pronunciation_reports pr
+    JOIN oxford_words ow ON ow.id = pr.audio_id
+    WHERE pr.username = ? AND pr.source = 'flashcard' AND pr.pronunciation_score IS NOT NULL
+    ORDER BY pr.id
+"""
+
+
+class Scheduler:
+    def __init__(self, clock=time.time):
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._migrated = set()
+
+    def _now(self):
+        return int(self._clock())
+
+    def ensure_migrated(self, conn, username):
+        """Seed the user's schedule from is_known flags and past reports, once."""
+        with self._lock:
+            if username in self._migrated:
+                return
+        if conn.execute("SELECT 1 FROM card_schedule_users WHERE username = ?", (username,)).fetchone() is None:
+            self._migrate_user(conn, username)
+        with self._lock:
+            self._migrated.add(username)
+
+    def _migrate_user(self, conn, username):
+        now = self._now()
+        # BEGIN IMMEDIATE: two workers must not both replay the same reports
+        conn.execute("BEGIN IMMEDIATE")
+        if conn.execute("SELECT 1 FROM card_schedule_users WHERE username = ?", (username,)).fetchone():
+            conn.rollback()  # another worker got there first
+            return
+        conn.execute(_MIGRATE_KNOWN, {'now': now, 'username': username})
+        replayed = 0
+        for row in conn.execute(_PAST_REPORTS, (username,)).fetchall():
+            self._apply(conn, username, row['word'], row['pos'], row['level'],
+                        grade_from_score(row['pronunciation_score']), row['reviewed_at'] or now)
+            replayed += 1
+        conn.execute("INSERT INTO card_schedule_users (username) VALUES (?)", (username,))
+        conn.commit()
+        print(f"Card schedule migrated for {username} ({replayed} past assessments replayed)")
+
+    def _apply(self, conn, username, word, pos, level, grade, now):
+        state = conn.execute(
+            "SELECT * FROM card_schedule WHERE username = ? AND word = ? AND pos = ? AND level = ?",
+            (username, word, pos, level)
+        ).fetchone()
+        row = sm2(state, grade, now)
+        conn.execute(_UPSERT, (
+            username, word, pos, level, row['due_at'], row['interval_days'], row['ease'],
+            row['repetitions'], row['lapses'], row['last_grade'], row['last_reviewed_at'],
+        ))
+        return row
+
+    def next_due(self, conn, username, level=None):
+        """(word, pos, level) of the user's most overdue card, or None."""
+        due = self.due_cards(conn, username, level, 1)
+        return due[0] if due else None
+
+    def due_cards(self, conn, username, level=None, n=1, exclude=()):
+        """Keys of up to n due cards, most overdue first, skipping those in exclude.
+
+        level None, '' or ALL_LEVELS (the "All Levels" option) means any level.
+        """
+        self.ensure_migrated(conn, username)
+        exclude = set(exclude)
+        limit = n + len(exclude)
+        if level and level != ALL_LEVELS:
+            rows = conn.execute(
+                "SELECT word, pos, level FROM card_schedule "
+                "WHERE username = ? AND level = ? AND due_at <= ? ORDER BY due_at LIMIT ?",
+                (username, level, self._now(), limit)
+            ).fetchall()
+        else:
+            rows = conn.execute(
+                "SELECT word, pos, level FROM card_schedule "
+                "WHERE username = ? AND due_at <= ? ORDER BY due_at LIMIT ?",
+                (username, self._now(), limit)
+            ).fetchall()
+        keys = [(row['word'], row['pos'], row['level']) for row in rows]
+        return [key for key in keys if key not in exclude][:n]
+
+    def review(self, conn, username, word, pos, level, grade):
+        """Record a review with SM-2 grade 0-5 and commit; returns the new schedule."""
+        self.ensure_migrated(conn, username)
+        row = self._apply(conn, username, word, pos, level, grade, self._now())
+        conn.commit()
+        return row
+
+    def review_score(self, conn, username, word, pos, level, score):
+        """Record a pronunciation assessment (score 0-100) as a review."""
+        return self.review(conn, username, word, pos, level, grade_from_score(score))
+
+    def mark_known(self, conn, username, word, pos, level, commit=True):
+        """Push the card out by at least KNOWN_INTERVAL_DAYS.
+
+        commit=False leaves the write in the caller's transaction; the caller
+        must then have run ensure_migrated() for the user beforehand.
+        """
+        if commit:
+            self.ensure_migrated(conn, username)
+        now = self._now()
+        state = conn.execute(
+            "SELECT * FROM card_schedule WHERE username = ? AND word = ? AND pos = ? AND level = ?",
+            (username, word, pos, level)
+        ).fetchone()
+        interval = max(KNOWN_INTERVAL_DAYS, state['interval_days'] if state else 0)
+        conn.execute(_UPSERT, (
+            username, word, pos, level, now + int(interval * DAY), interval,
+            state['ease'] if state else DEFAULT_EASE,
+            max(KNOWN_REPETITIONS, state['repetitions'] if state else 0),
+            state['lapses'] if state else 0, 5, now,
+        ))
+        if commit:
+            conn.commit()
+
+    def stats(self, conn, username):
+        now = self._now()
+        row = conn.execute(
+            """
+            SELECT COUNT(*) AS scheduled,
+                   SUM(due_at <= ?) AS due,
+                   SUM(due_at <= ? + 86400) AS due_within_day,
+                   SUM(lapses) AS lapses,
+                   AVG(ease) AS mean_ease
+            FROM card_schedule WHERE username = ?
+            """,
+            (now, now, username)
+        ).fetchone()
+        return {k: row[k] or 0 for k in row.keys()}
+
+
+def migrate_all(db_path):
+    """Migrate every user that has user_words rows; returns how many were migrated."""
+    conn = sqlite3.connect(db_path, timeout=30)
+    conn.row_factory = sqlite3.Row
+    try:
+        conn.executescript(SCHEMA)
+        users = [row['username'] for row in conn.execute(
+            "SELECT DISTINCT username FROM user_words WHERE username IS NOT NULL "
+            "AND username NOT IN (SELECT username FROM card_schedule_users)"
+        ).fetchall()]
+        scheduler = Scheduler()
+        for username in users:
+            scheduler.ensure_migrated(conn, username)
+        return len(users)
+    finally:
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Flashcard schedule maintenance")
+    parser.add_argument("command", choices=["migrate"])
+    parser.add_argument("--db", default=os.environ.get(
+        "FGL_DB_PATH", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "masterfgl.db")
+    ))
+    args = parser.parse_args()
+    print(f"Migrated {migrate_all(args.db)} users")
+
+
+if __name__ == "__main__":
+    main()
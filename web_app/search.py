@@ -0,0 +1,213 @@
+"""Full-text search over book paragraphs, book sentences and Oxford example sentences.
+
+Each source table gets an external-content FTS5 index (the text stays in
+the source table; snippets read it back by id) kept in step by triggers,
+so scripts importing books into masterfgl.db update the index too. An index
+is built from its table the first time it is created; rebuild or merge
+segments with `python -m web_app.search rebuild|optimize`.
+
+Free text is turned into a MATCH expression of quoted terms (all must
+appear), so user input never hits the FTS5 query syntax.
+"""
+import argparse
+import os
+import re
+import sqlite3
+
+# FTS table -> (source table, indexed text columns)
+INDEXES = {
+    'search_paragraphs': ('paragraphs', ('content',)),
+    'search_sentences': ('sentences', ('sentence',)),
+    'search_oxford': ('oxford_words', ('word', 'sentence_formal', 'sentence_informal')),
+}
+TOKENIZE = 'porter unicode61'
+SNIPPET_TOKENS = 16
+MAX_RESULTS = 100
+SCOPES = ('paragraphs', 'sentences', 'oxford')
+
+
+def _index_sql(fts, table, columns):
+    cols = ', '.join(columns)
+    new = ', '.join(f"new.{c}" for c in columns)
+    old = ', '.join(f"old.{c}" for c in columns)
+    return f"""
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_{table}_id ON {table}(id);
+    CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5(
+        {cols}, content='{table}', content_rowid='id', tokenize='{TOKENIZE}'
+    );
+    CREATE TRIGGER IF NOT EXISTS trg_{fts}_insert AFTER INSERT ON {table}
+    BEGIN
+        INSERT INTO {fts}(rowid, {cols}) VALUES (new.id, {new});
+    END;
+    CREATE TRIGGER IF NOT EXISTS trg_{fts}_delete AFTER DELETE ON {table}
+    BEGIN
+        INSERT INTO {fts}({fts}, rowid, {cols}) VALUES ('delete', old.id, {old});
+    END;
+    CREATE TRIGGER IF NOT EXISTS trg_{fts}_update AFTER UPDATE OF id, {cols} ON {table}
+    BEGIN
+        INSERT INTO {fts}({fts}, rowid, {cols}) VALUES ('delete', old.id, {old});
+        INSERT INTO {fts}(rowid, {cols}) VALUES (new.id, {new});
+    END;
+"""
+
+
+SCHEMA = """
+    -- sentences carry no book; they are matched to paragraphs by file_source
+    CREATE INDEX IF NOT EXISTS idx_paragraphs_file_source ON paragraphs(file_source, book, chapter);
+""" + ''.join(_index_sql(fts, table, columns) for fts, (table, columns) in INDEXES.items())
+
+
+def ensure_indexes(conn):
+    """Create missing indexes and triggers; a newly created index is built from its table."""
+    existing = {row[0] for row in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table' AND name IN (%s)" % ','.join('?' * len(INDEXES)),
+        tuple(INDEXES)
+    ).fetchall()}
+    conn.executescript(SCHEMA)
+    built = [fts for fts in INDEXES if fts not in existing]
+    for fts in built:
+        conn.execute(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')")
+    conn.commit()
+    return built
+
+
+def rebuild(conn, optimize_only=False):
+    conn.executescript(SCHEMA)
+    for fts in INDEXES:
+        conn.execute(f"INSERT INTO {fts}({fts}) VALUES (?)", ('optimize' if optimize_only else 'rebuild',))
+    conn.commit()
+
+
+def match_query(text, prefix=False):
+    """FTS5 MATCH expression requiring every word of text, or None if it has none.
+
+    prefix=True lets the last word match as a prefix (search-as-you-type).
+    """
+    terms = re.findall(r"\w+(?:'\w+)*", text or '')
+    if not terms:
+        return None
+    quoted = ['"%s"' % term.replace('"', '""') for term in terms]
+    if prefix:
+        quoted[-1] += '*'
+    return ' '.join(quoted)
+
+
+def _snippet(fts, column=-1):
+    return f"snippet({fts}, {column}, '<mark>', '</mark>', '…', {SNIPPET_TOKENS})"
+
+
+def search_paragraphs(conn, match, book=None, chapter=None, limit=20):
+    query = f"""
+        SELECT p.id, p.book, p.chapter, p.subtitle, {_snippet('search_paragraphs')} AS snippet,
+               search_paragraphs.rank AS rank
+        FROM search_paragraphs JOIN paragraphs p ON p.id = search_paragraphs.rowid
+        WHERE search_paragraphs MATCH ?
+    """
+    params = [match]
+    if book:
+        query += ' AND p.book = ?'
+        params.append(book)
+    if chapter:
+        query += ' AND p.chapter = ?'
+        params.append(chapter)
+    query += ' ORDER BY rank LIMIT ?'
+    params.append(limit)
+    return [dict(row) for row in conn.execute(query, params).fetchall()]
+
+
+# Book and chapter of a sentence's source file (first paragraph from that file)
+_SENTENCE_SOURCE = """
+    (SELECT book FROM paragraphs WHERE file_source = s.file_source LIMIT 1) AS book,
+    COALESCE(NULLIF(s.chapter, 'Unknown'),
+             (SELECT chapter FROM paragraphs WHERE file_source = s.file_source LIMIT 1)) AS chapter
+"""
+
+
+def search_sentences(conn, match, book=None, chapter=None, limit=20):
+    query = f"""
+        SELECT s.id, s.sentence, {_SENTENCE_SOURCE}, {_snippet('search_sentences')} AS snippet,
+               search_sentences.rank AS rank
+        FROM search_sentences JOIN sentences s ON s.id = search_sentences.rowid
+        WHERE search_sentences MATCH ?
+    """
+    params = [match]
+    if book:
+        query += ' AND s.file_source IN (SELECT file_source FROM paragraphs WHERE book = ?)'
+        params.append(book)
+    if chapter:
+        query += " AND (s.chapter = ? OR s.file_source IN (SELECT file_source FROM paragraphs WHERE chapter = ?))"
+        params += [chapter, chapter]
+    query += ' ORDER BY rank LIMIT ?'
+    params.append(limit)
+    return [dict(row) for row in conn.execute(query, params).fetchall()]
+
+
+def search_oxford(conn, match, level=None, limit=20):
+    query = f"""
+        SELECT o.id, o.word, o.pos, o.level,
+               {_snippet('search_oxford', 1)} AS snippet_formal,
+               {_snippet('search_oxford', 2)} AS snippet_informal,
+               search_oxford.rank AS rank
+        FROM search_oxford JOIN oxford_words o ON o.id = search_oxford.rowid
+        WHERE search_oxford MATCH ?
+    """
+    params = [match]
+    if level:
+        query += ' AND o.level = ?'
+        params.append(level)
+    query += ' ORDER BY rank LIMIT ?'
+    params.append(limit)
+    return [dict(row) for row in conn.execute(query, params).fetchall()]
+
+
+def search(conn, text, scopes=SCOPES, book=None, chapter=None, level=None, limit=20, prefix=False):
+    """Ranked matches (best first, bm25) per scope; empty lists when text has no words."""
+    limit = max(1, min(limit, MAX_RESULTS))
+    match = match_query(text, prefix)
+    results = {scope: [] for scope in scopes}
+    if match is None:
+        return results
+    if 'paragraphs' in results:
+        results['paragraphs'] = search_paragraphs(conn, match, book, chapter, limit)
+    if 'sentences' in results:
+        results['sentences'] = search_sentences(conn, match, book, chapter, limit)
+    if 'oxford' in results and not (book or chapter):
+        results['oxford'] = search_oxford(conn, match, level, limit)
+    return results
+
+
+def book_sentences_for_word(conn, word, limit=3):
+    """Real book sentences containing a flashcard word (its inflections too, via stemming)."""
+    terms = re.findall(r"\w+(?:'\w+)*", word or '')
+    if not terms:
+        return []
+    phrase = '"%s"' % ' '.join(terms).replace('"', '""')
+    rows = conn.execute(
+        f"""
+        SELECT s.id, s.sentence, {_SENTENCE_SOURCE}, {_snippet('search_sentences')} AS snippet
+        FROM search_sentences JOIN sentences s ON s.id = search_sentences.rowid
+        WHERE search_sentences MATCH ?
+        ORDER BY search_sentences.rank LIMIT ?
+        """,
+        (phrase, limit)
+    ).fetchall()
+    return [dict(row) for row in rows]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Full-text search index maintenance")
+    parser.add_argument("command", choices=["rebuild", "optimize"])
+    parser.add_argument("--db", default=os.environ.get(
+        "FGL_DB_PATH", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "masterfgl.db")
+    ))
+    args = parser.parse_args()
+    conn = sqlite3.connect(args.db, timeout=30)
+    try:
+        rebuild(conn, optimize_only=args.command == "optimize")
+    finally:
+        conn.close()
+    print(f"{args.command}: {', '.join(INDEXES)}")
+
+
+if __name__ == "__main__":
+    main()
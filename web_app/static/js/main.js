@@ -5,6 +5,16 @@ let currentRecordingType = null; // 'formal' or 'informal'
 let currentAudioBlob = null;
 let currentUser = null;
 
+// Upcoming cards from /api/cards, with their audio already loading, so a
+// flip is served from memory. Refilled in the background when it runs low.
+const CARD_BUFFER_SIZE = 5;
+const CARD_REFILL_AT = 2;
+const PRELOAD_MAX_BYTES = 2 * 1024 * 1024;
+let cardBuffer = []; // [{card, audio: {audio_formal: Audio, ...}}]
+let cardRefill = null;
+let cardGeneration = 0; // bumped when the user or level changes
+let currentCardAudio = {};
+
 // User Management
 function initUser() {
     currentUser = localStorage.getItem('fgl_username');
@@ -22,6 +32,7 @@ function initUser() {
             currentUser = newUser;
             localStorage.setItem('fgl_username', currentUser);
             updateUserDisplay();
+            resetCardBuffer();
             loadCard(); // Reload for new user
         }
     });
@@ -68,7 +79,10 @@ document.addEventListener('DOMContentLoaded', () => {
     if (levelSelect) {
         loadLevels();
         loadCard();
-        levelSelect.addEventListener('change', loadCard);
+        levelSelect.addEventListener('change', () => {
+            resetCardBuffer();
+            loadCard();
+        });
         // document.getElementById('btn-repeat').addEventListener('click', loadCard);
         document.getElementById('btn-known').addEventListener('click', markKnown);
     }
@@ -92,21 +106,84 @@ async function loadLevels() {
 }
 
 async function loadCard() {
-    const level = document.getElementById('level-select').value;
     resetUI();
 
     try {
-        const response = await fetch(`/api/card?level=${level}&username=${encodeURIComponent(currentUser)}`);
-        if (!response.ok) throw new Error('No cards found');
-        
-        currentCard = await response.json();
+        if (!cardBuffer.length) await refillCards();
+        const next = cardBuffer.shift();
+        if (!next) throw new Error('No cards found');
+
+        currentCard = next.card;
+        currentCardAudio = next.audio;
         renderCard(currentCard);
+        if (cardBuffer.length < CARD_REFILL_AT) refillCards();
     } catch (error) {
         console.error('Error loading card:', error);
         document.getElementById('card-word').textContent = "No cards available";
     }
 }
 
+function cardKey(card) {
+    return `${card.word}|${card.pos}|${card.level}`;
+}
+
+function resetCardBuffer() {
+    cardGeneration++;
+    cardBuffer = [];
+    cardRefill = null;
+}
+
+function refillCards() {
+    if (cardRefill) return cardRefill;
+
+    const generation = cardGeneration;
+    const params = new URLSearchParams({
+        level: document.getElementById('level-select').value,
+        username: currentUser,
+        n: CARD_BUFFER_SIZE - cardBuffer.length,
+    });
+    // Cards already on screen or in the buffer must not come back
+    [currentCard, ...cardBuffer.map(entry => entry.card)]
+        .filter(Boolean)
+        .forEach(card => params.append('exclude', cardKey(card)));
+
+    const refill = fetch(`/api/cards?${params}`)
+        .then(response => response.ok ? response.json() : { cards: [] })
+        .then(data => {
+            if (generation !== cardGeneration) return; // user or level changed meanwhile
+            data.cards.forEach(card => cardBuffer.push({ card, audio: preloadCardAudio(card) }));
+        })
+        .catch(error => console.error('Error prefetching cards:', error))
+        .finally(() => {
+            if (cardRefill === refill) cardRefill = null;
+        });
+    cardRefill = refill;
+    return refill;
+}
+
+function preloadCardAudio(card) {
+    // URLs are fingerprinted and immutable, so the browser cache keeps them too
+    const audio = {};
+    (card.preload || []).forEach(hint => {
+        if (hint.size > PRELOAD_MAX_BYTES) return;
+        const element = new Audio();
+        element.preload = 'auto';
+        element.src = hint.url;
+        audio[hint.kind] = element;
+    });
+    return audio;
+}
+
+function cardAudio(kind, url) {
+    // The preloaded element if it is still for this URL, otherwise a fresh one
+    const element = currentCardAudio[kind];
+    if (element && url && element.src.endsWith(url)) {
+        element.currentTime = 0;
+        return element;
+    }
+    return new Audio(url);
+}
+
 function highlightWord(text, word) {
     if (!text || !word) return text;
     // Case-insensitive replace with word boundary check
@@ -181,6 +258,7 @@ function renderCard(card) {
 
 function resetUI() {
     currentCard = null;
+    currentCardAudio = {};
     currentAudioBlob = null;
     currentRecordingType = null;
     
@@ -218,8 +296,9 @@ function playAudio(type) {
         return;
     }
     
-    // Path is the full relative path from DB (e.g. audios/audios_tts_sentences/...)
-    const audio = new Audio(`/${path}`);
+    // Prefer the fingerprinted URL; path is the full relative path from DB (e.g. audios/audios_tts_sentences/...)
+    const url = type === 'formal' ? currentCard.audio_formal_url : currentCard.audio_informal_url;
+    const audio = url ? cardAudio(`audio_${type}`, url) : new Audio(`/${path}`);
     audio.play();
 }
 
@@ -233,7 +312,8 @@ function playUserAudio(type) {
     }
     
     console.log('Playing user audio:', path);
-    const audio = new Audio(`/audios_user/${path}`);
+    const url = type === 'formal' ? currentCard.user_audio_formal_url : currentCard.user_audio_informal_url;
+    const audio = url ? cardAudio(`user_audio_${type}`, url) : new Audio(`/audios_user/${path}`);
     audio.onerror = (e) => {
         console.error('Error playing user audio:', e);
         alert('Error playing audio. File might be missing or format unsupported.');
@@ -361,20 +441,22 @@ function discardRecording(type) {
 async function saveRecording(type) {
     if (!currentAudioBlob) return;
 
-    const formData = new FormData();
-    formData.append('audio', currentAudioBlob, 'recording.webm');
-    formData.append('word', currentCard.word);
-    formData.append('pos', currentCard.pos);
-    formData.append('level', currentCard.level);
-    formData.append('type', type);
-    formData.append('username', currentUser);
+    // Send the blob as the raw request body so the server can pipe it into ffmpeg
+    const params = new URLSearchParams({
+        word: currentCard.word,
+        pos: currentCard.pos,
+        level: currentCard.level,
+        type: type,
+        username: currentUser
+    });
 
     document.getElementById('recording-status').textContent = 'Auto-saving...';
 
     try {
-        const response = await fetch('/api/upload_audio', {
+        const response = await fetch(`/api/upload_audio?${params}`, {
             method: 'POST',
-            body: formData
+            headers: { 'Content-Type': currentAudioBlob.type || 'audio/webm' },
+            body: currentAudioBlob
         });
         
         const result = await response.json();
@@ -382,6 +464,7 @@ async function saveRecording(type) {
             // Update local card data
             if (type === 'formal') {
                 currentCard.user_audio_formal_path = result.path;
+                currentCard.user_audio_formal_url = result.url;
                 document.getElementById('play-user-formal').classList.remove('hidden');
                 document.getElementById('btn-rate-formal').classList.remove('hidden');
                 // Clear old rating when new audio is saved
@@ -390,6 +473,7 @@ async function saveRecording(type) {
                 document.getElementById('transcription-formal').textContent = '';
             } else {
                 currentCard.user_audio_informal_path = result.path;
+                currentCard.user_audio_informal_url = result.url;
                 document.getElementById('play-user-informal').classList.remove('hidden');
                 document.getElementById('btn-rate-informal').classList.remove('hidden');
                 // Clear old rating when new audio is saved
@@ -421,6 +505,50 @@ async function saveRecording(type) {
     audioChunks = [];
 }
 
+// Rating runs as a background job on the server: submit it, then poll until done.
+async function fetchRating(body) {
+    const response = await fetch('/api/rate', {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify(body)
+    });
+    let data = await response.json();
+    let delay = 500;
+    while (data.success && (data.status === 'queued' || data.status === 'running')) {
+        await new Promise(resolve => setTimeout(resolve, delay));
+        delay = Math.min(delay * 1.5, 3000);
+        const poll = await fetch(`/api/rate/jobs/${data.job_id}`);
+        data = await poll.json();
+    }
+    return data;
+}
+
+// Local intonation comparison (/api/pitch): answers in well under a second,
+// so it is shown while the rating job is still running.
+async function fetchIntonation(body) {
+    try {
+        const response = await fetch('/api/pitch', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify(body)
+        });
+        const data = await response.json();
+        return data.success ? data : null;
+    } catch (err) {
+        console.error('Intonation error', err);
+        return null;
+    }
+}
+
+function describeIntonation(data) {
+    if (!data) return '';
+    const endings = (data.segments || []).filter(s => s.reference_ending !== s.user_ending).length;
+    let text = `Intonation: ${data.score.toFixed(0)}`;
+    if (data.range_ratio !== null && data.range_ratio < 0.6) text += ' (try a livelier pitch)';
+    if (endings) text += ` | ${endings} phrase ending(s) differ`;
+    return text;
+}
+
 function rateRecording(type) {
     if (!currentCard) return;
 
@@ -435,18 +563,23 @@ function rateRecording(type) {
     ratingEl.textContent = 'Rating...';
     misEl.textContent = '';
 
-    fetch('/api/rate', {
-        method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify({
-            word: currentCard.word,
-            pos: currentCard.pos,
-            level: currentCard.level,
-            type: type,
-            username: currentUser
-        })
-    }).then(resp => resp.json())
-      .then(data => {
+    const body = {
+        word: currentCard.word,
+        pos: currentCard.pos,
+        level: currentCard.level,
+        type: type,
+        username: currentUser
+    };
+    let intonation = '';
+    let rated = false;
+    fetchIntonation(body).then(data => {
+        intonation = describeIntonation(data);
+        if (intonation && !rated) ratingEl.textContent = `Rating... | ${intonation}`;
+        else if (intonation && ratingEl.textContent) ratingEl.textContent += ` | ${intonation}`;
+    });
+
+    fetchRating(body).then(data => {
+          rated = true;
           if (!data.success) {
               ratingEl.textContent = '';
               alert(data.error || 'Rating failed');
@@ -455,6 +588,7 @@ function rateRecording(type) {
           const { pronunciation_score, accuracy_score, fluency_score, prosody_score, total_score, recognized_text, mispronunciations } = data;
           
           ratingEl.textContent = `Total: ${total_score?.toFixed(1)} | Pronunciation: ${pronunciation_score?.toFixed(1)} | Acc: ${accuracy_score?.toFixed(1)} | Flu: ${fluency_score?.toFixed(1)} | Prosody: ${prosody_score?.toFixed(1)}`;
+          if (intonation) ratingEl.textContent += ` | ${intonation}`;
           
           // Conditional Formatting
           ratingEl.className = 'rating-text'; // Reset
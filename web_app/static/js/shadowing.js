@@ -1,4 +1,4 @@
-let offset = 0;
+let nextAfterId = null;
 const limit = 100;
 const shadowingRecorders = {};
 const shadowingAudioChunks = {};
@@ -86,37 +86,33 @@ async function loadStructure(book) {
             throw new Error(`HTTP error! status: ${response.status}`);
         }
         
+        // Served with an ETag, so switching back to a book is a 304 revalidation
         const structure = await response.json();
         
         chapterSelect.innerHTML = '<option value="">Select Chapter...</option>';
         
-        if (Object.keys(structure).length === 0) {
+        if (structure.chapters.length === 0) {
             chapterSelect.innerHTML = '<option value="">No chapters found</option>';
             return;
         }
         
-        for (const [chapter, subtitles] of Object.entries(structure)) {
-            if (subtitles && subtitles.length > 0) {
+        // Chapters and subtitles arrive in reading order
+        for (const { chapter, paragraphs, subtitles } of structure.chapters) {
+            if (subtitles.length > 0) {
                 // Add option group for chapter if it has subtitles
                 const optgroup = document.createElement('optgroup');
                 optgroup.label = chapter;
                 
-                // Option for the chapter itself (if needed, or just subtitles)
-                // Usually if there are subtitles, we might want to select specific subtitle
-                // But let's allow selecting the whole chapter too if that makes sense, 
-                // or just list subtitles.
-                // Based on previous logic: "Load chapter content if no subtitles or just to start"
-                
                 // Let's add the main chapter as an option
                 const mainOption = document.createElement('option');
                 mainOption.value = chapter;
-                mainOption.textContent = `${chapter} (Full)`;
+                mainOption.textContent = `${chapter} (Full, ${paragraphs})`;
                 optgroup.appendChild(mainOption);
 
                 subtitles.forEach(sub => {
                     const option = document.createElement('option');
-                    option.value = `${chapter}|${sub}`;
-                    option.textContent = sub;
+                    option.value = `${chapter}|${sub.subtitle}`;
+                    option.textContent = `${sub.subtitle} (${sub.paragraphs})`;
                     optgroup.appendChild(option);
                 });
                 chapterSelect.appendChild(optgroup);
@@ -124,7 +120,7 @@ async function loadStructure(book) {
                 // Just a chapter option
                 const option = document.createElement('option');
                 option.value = chapter;
-                option.textContent = chapter;
+                option.textContent = `${chapter} (${paragraphs})`;
                 chapterSelect.appendChild(option);
             }
         }
@@ -139,20 +135,25 @@ async function loadStructure(book) {
     }
 }
 
+function contentUrl(book, chapter, subtitle, afterId) {
+    let url = `/api/shadowing/content?limit=${limit}`;
+    if (book) url += `&book=${encodeURIComponent(book)}`;
+    if (chapter) url += `&chapter=${encodeURIComponent(chapter)}`;
+    if (subtitle) url += `&subtitle=${encodeURIComponent(subtitle)}`;
+    if (afterId !== null) url += `&after_id=${afterId}`;
+    return url;
+}
+
 async function loadContent(book, chapter, subtitle) {
-    offset = 0;
+    nextAfterId = null;
     
     const container = document.getElementById('sentences-list');
     container.innerHTML = '<div style="text-align:center; padding:20px;">Loading...</div>';
     
     try {
-        let url = `/api/shadowing/content?limit=${limit}&offset=${offset}`;
-        if (book) url += `&book=${encodeURIComponent(book)}`;
-        if (chapter) url += `&chapter=${encodeURIComponent(chapter)}`;
-        if (subtitle) url += `&subtitle=${encodeURIComponent(subtitle)}`;
-        
-        const response = await fetch(url);
-        const paragraphs = await response.json();
+        const response = await fetch(contentUrl(book, chapter, subtitle, null));
+        const page = await response.json();
+        const paragraphs = page.paragraphs;
         
         container.innerHTML = '';
         
@@ -173,12 +174,43 @@ async function loadContent(book, chapter, subtitle) {
             container.appendChild(card);
         });
 
+        nextAfterId = page.next_after_id;
+        renderLoadMore(container, book, chapter, subtitle);
+
     } catch (error) {
         console.error('Error loading content:', error);
         container.innerHTML = '<div style="color:red; text-align:center;">Error loading content</div>';
     }
 }
 
+function renderLoadMore(container, book, chapter, subtitle) {
+    if (nextAfterId === null) return;
+
+    const btn = document.createElement('button');
+    btn.className = 'btn btn-secondary';
+    btn.style.display = 'block';
+    btn.style.margin = '20px auto';
+    btn.textContent = 'Load more';
+    btn.onclick = async () => {
+        btn.disabled = true;
+        btn.textContent = 'Loading...';
+        try {
+            // Cursor from the previous page: cost does not grow with depth
+            const response = await fetch(contentUrl(book, chapter, subtitle, nextAfterId));
+            const page = await response.json();
+            btn.remove();
+            page.paragraphs.forEach(p => container.appendChild(createCard(p)));
+            nextAfterId = page.next_after_id;
+            renderLoadMore(container, book, chapter, subtitle);
+        } catch (error) {
+            console.error('Error loading more content:', error);
+            btn.disabled = false;
+            btn.textContent = 'Load more';
+        }
+    };
+    container.appendChild(btn);
+}
+
 function createCard(paragraph) {
     const div = document.createElement('div');
     div.className = 'sentence-card';
@@ -187,10 +219,14 @@ function createCard(paragraph) {
     let audioHtml = '';
     if (paragraph.audio_path) {
         const filename = paragraph.audio_path.split('/').pop();
+        const src = paragraph.audio_url || `/audios_book/${filename}`;
+        // A span of the whole chapter file: fetch nothing until played
+        const segment = paragraph.audio_segment;
+        const preload = segment && !segment.clip ? 'none' : 'metadata';
         audioHtml = `
             <div style="margin-bottom: 15px; padding-bottom: 15px; border-bottom: 1px solid #eee;">
                 <label style="font-weight:bold; display:block; margin-bottom:5px;">Original Audio:</label>
-                <audio controls src="/audios_book/${filename}" style="width: 100%;"></audio>
+                <audio controls preload="${preload}" src="${src}" style="width: 100%;"></audio>
             </div>
         `;
     }
@@ -201,10 +237,11 @@ function createCard(paragraph) {
     
     if (ttsPath) {
         const ttsFilename = ttsPath.split('/').pop();
+        const ttsSrc = paragraph.tts_audio_url || `/audios_book/${ttsFilename}`;
         ttsHtml = `
             <div style="margin-bottom: 15px; padding-bottom: 15px; border-bottom: 1px solid #eee; background-color: #f0f8ff; padding: 10px; border-radius: 5px;">
                 <label style="font-weight:bold; display:block; margin-bottom:5px; color: #333;">TTS Audio:</label>
-                <audio controls src="/audios_book/${ttsFilename}" style="width: 100%;"></audio>
+                <audio controls src="${ttsSrc}" style="width: 100%;"></audio>
             </div>
         `;
     } else {
@@ -223,11 +260,12 @@ function createCard(paragraph) {
 
     if (paragraph.user_audio_path) {
         const filename = paragraph.user_audio_path.split('/').pop();
+        const userSrc = paragraph.user_audio_url || `/audios_user/${filename}`;
         userAudioContainerHtml = `
             <div id="user-audio-container-${id}">
                 <div style="margin-bottom: 15px; padding-bottom: 15px; border-bottom: 1px solid #eee; background-color: #e8f5e9; padding: 10px; border-radius: 5px;">
                     <label style="font-weight:bold; display:block; margin-bottom:5px; color: #333;">User Audio:</label>
-                    <audio controls src="/audios_user/${filename}" style="width: 100%;"></audio>
+                    <audio controls src="${userSrc}" style="width: 100%;"></audio>
                 </div>
             </div>
         `;
@@ -259,7 +297,7 @@ function createCard(paragraph) {
     return div;
 }
 
-async function generateTTS(id) {
+function generateTTS(id) {
     const btn = document.getElementById(`btn-tts-${id}`);
     const status = document.getElementById(`tts-status-${id}`);
     
@@ -267,30 +305,29 @@ async function generateTTS(id) {
     btn.textContent = 'Generating...';
     status.textContent = 'Sending text to Azure AI...';
     
-    try {
-        const response = await fetch('/api/shadowing/generate_tts', {
-            method: 'POST',
-            headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify({ id: id })
-        });
-        
-        const result = await response.json();
-        
-        if (result.success) {
-            status.textContent = 'Done! Reloading...';
-            // Reload content to show the new player
-            loadContent(currentBook, currentChapter, currentSubtitle);
-        } else {
-            status.textContent = 'Error: ' + result.error;
+    // The stream endpoint relays audio while it is synthesized, so playback
+    // starts with the first chunk; the server saves the file when it ends.
+    const audio = document.createElement('audio');
+    audio.controls = true;
+    audio.style.width = '100%';
+    audio.src = `/api/shadowing/tts_stream/${id}`;
+    
+    audio.addEventListener('canplay', () => {
+        status.textContent = '';
+        btn.replaceWith(audio);
+    }, { once: true });
+    
+    audio.addEventListener('error', () => {
+        console.error('TTS Error:', audio.error);
+        if (!audio.isConnected) {
+            status.textContent = 'TTS generation failed';
             btn.disabled = false;
             btn.textContent = '✨ Generate TTS Audio';
         }
-    } catch (error) {
-        console.error('TTS Error:', error);
-        status.textContent = 'Network error';
-        btn.disabled = false;
-        btn.textContent = '✨ Generate TTS Audio';
-    }
+    }, { once: true });
+    
+    // Called inside the click so autoplay policies allow it
+    audio.play().catch(() => {});
 }
 
 async function toggleRecording(id) {
@@ -342,15 +379,14 @@ function playUserAudio(id) {
 }
 
 async function uploadAudio(id, blob) {
-    const formData = new FormData();
-    formData.append('audio', blob, `shadowing_${id}.webm`);
-    formData.append('source', 'shadowing');
-    formData.append('id', id);
+    // Raw body upload: the server streams it straight into ffmpeg
+    const params = new URLSearchParams({ source: 'shadowing', id: id });
 
     try {
-        const response = await fetch('/api/upload_audio', {
+        const response = await fetch(`/api/upload_audio?${params}`, {
             method: 'POST',
-            body: formData
+            headers: { 'Content-Type': blob.type || 'audio/webm' },
+            body: blob
         });
         const result = await response.json();
         console.log('Upload result:', result);
@@ -364,11 +400,12 @@ async function uploadAudio(id, blob) {
             // Show the audio player
             const container = document.getElementById(`user-audio-container-${id}`);
             if (container) {
-                const filename = audioPath;
+                // The ?v= fingerprint changes with every re-recording
+                const src = result.url || `/audios_user/${audioPath}?t=${new Date().getTime()}`;
                 container.innerHTML = `
                     <div style="margin-bottom: 15px; padding-bottom: 15px; border-bottom: 1px solid #eee; background-color: #e8f5e9; padding: 10px; border-radius: 5px;">
                         <label style="font-weight:bold; display:block; margin-bottom:5px; color: #333;">User Audio:</label>
-                        <audio controls src="/audios_user/${filename}?t=${new Date().getTime()}" style="width: 100%;"></audio>
+                        <audio controls src="${src}" style="width: 100%;"></audio>
                     </div>
                 `;
                 console.log('Audio player updated for ID:', id);
@@ -404,19 +441,28 @@ async function rateRecording(id) {
     btn.textContent = 'Rating...';
     resultBox.style.display = 'none';
 
+    const body = {
+        source: 'shadowing',
+        id: id,
+        reference_text: referenceText,
+        audio_path: audioPath
+    };
+    // Local intonation result (main.js), shown until the full rating arrives
+    let intonationHtml = '';
+    const intonation = fetchIntonation(body).then(data => {
+        const text = describeIntonation(data);
+        if (!text) return;
+        intonationHtml = `<div style="margin-bottom: 10px;"><strong>${text}</strong></div>`;
+        if (btn.disabled) {
+            resultBox.innerHTML = intonationHtml;
+            resultBox.style.display = 'block';
+        }
+    });
+
     try {
-        const response = await fetch('/api/rate', {
-            method: 'POST',
-            headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify({
-                source: 'shadowing',
-                id: id,
-                reference_text: referenceText,
-                audio_path: audioPath
-            })
-        });
-        
-        const result = await response.json();
+        // fetchRating (main.js) submits the job and polls until it finishes
+        const result = await fetchRating(body);
+        await intonation;
         console.log('Rating result:', result);
         
         if (result.success) {
@@ -452,6 +498,7 @@ async function rateRecording(id) {
                     <span><strong>Fluency:</strong> ${result.fluency_score.toFixed(1)}</span>
                     <span><strong>Prosody:</strong> ${result.prosody_score.toFixed(1)}</span>
                 </div>
+                ${intonationHtml}
                 ${misHtml}
             `;
         } else {
@@ -0,0 +1,425 @@
+"""Word counts over paragraphs as token-id arrays, and per-user text coverage.
+
+Each paragraph is tokenized once into a uint32 array of vocab ids, stored
+in paragraph_tokens. Triggers queue every inserted, deleted or edited
+paragraph in paragraph_tokens_dirty. sync() re-tokenizes only those and
+applies the np.bincount difference to word_frequency, so importing or
+removing a chapter touches only its own words.
+
+WordEngine keeps, per worker, every chapter's distinct token ids and their
+counts in one concatenated array. Coverage (the share of a chapter's tokens
+whose word the user knows) for every chapter of every book is then one
+bitset lookup and one np.add.reduceat. A user's known words (user_words
+is_known, cards reviewed to KNOWN_REPETITIONS, known_words) are packed one
+bit per vocab id and cached until they change.
+
+Sync from the command line with `python -m web_app.word_engine sync`.
+"""
+import argparse
+import os
+import re
+import sqlite3
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+NON_WORD = re.compile(r"[^a-z0-9]")
+# Chapters touched by syncs, read by other workers to refresh their arrays
+LOG_KEEP = 10000
+MAX_CACHED_USERS = 256
+# Reviewed this many times in a row (web_app/scheduler.py) counts as known
+KNOWN_REPETITIONS = 3
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS vocab (
+        id INTEGER PRIMARY KEY,
+        word TEXT NOT NULL UNIQUE
+    );
+    CREATE TABLE IF NOT EXISTS paragraph_tokens (
+        paragraph_id INTEGER PRIMARY KEY,
+        book TEXT,
+        chapter TEXT,
+        tokens BLOB NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_paragraph_tokens_chapter ON paragraph_tokens(book, chapter);
+    CREATE TABLE IF NOT EXISTS paragraph_tokens_dirty (
+        paragraph_id INTEGER PRIMARY KEY
+    );
+    CREATE TABLE IF NOT EXISTS paragraph_tokens_log (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        book TEXT,
+        chapter TEXT
+    );
+    CREATE TABLE IF NOT EXISTS word_engine_state (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        bootstrapped INTEGER NOT NULL DEFAULT 0
+    );
+    INSERT OR IGNORE INTO word_engine_state (id) VALUES (1);
+    CREATE TABLE IF NOT EXISTS word_frequency(word TEXT, frequency INT, length INT, is_known INT);
+    CREATE TABLE IF NOT EXISTS known_words(word TEXT);
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_word_frequency_word ON word_frequency(word);
+    CREATE TRIGGER IF NOT EXISTS trg_paragraph_tokens_insert AFTER INSERT ON paragraphs
+    BEGIN
+        INSERT OR IGNORE INTO paragraph_tokens_dirty (paragraph_id) VALUES (new.id);
+    END;
+    CREATE TRIGGER IF NOT EXISTS trg_paragraph_tokens_delete AFTER DELETE ON paragraphs
+    BEGIN
+        INSERT OR IGNORE INTO paragraph_tokens_dirty (paragraph_id) VALUES (old.id);
+    END;
+    CREATE TRIGGER IF NOT EXISTS trg_paragraph_tokens_update AFTER UPDATE OF id, book, chapter, content ON paragraphs
+    BEGIN
+        INSERT OR IGNORE INTO paragraph_tokens_dirty (paragraph_id) VALUES (old.id);
+        INSERT OR IGNORE INTO paragraph_tokens_dirty (paragraph_id) VALUES (new.id);
+    END;
+"""
+
+KNOWN_WORDS_QUERY = f"""
+    SELECT word FROM user_words WHERE username = ?1 AND is_known = 1
+    UNION
+    SELECT word FROM card_schedule WHERE username = ?1 AND repetitions >= {KNOWN_REPETITIONS}
+    UNION
+    SELECT word FROM known_words
+"""
+# Changes whenever the result of KNOWN_WORDS_QUERY can have changed
+KNOWN_WORDS_SIGNATURE = f"""
+    SELECT (SELECT COUNT(*) FROM user_words WHERE username = ?1 AND is_known = 1),
+           (SELECT COUNT(*) FROM card_schedule WHERE username = ?1 AND repetitions >= {KNOWN_REPETITIONS}),
+           (SELECT MAX(last_reviewed_at) FROM card_schedule WHERE username = ?1),
+           (SELECT COUNT(*) FROM known_words)
+"""
+
+
+def tokenize(text):
+    """Lowercased tokens with non-alphanumerics dropped ("don't" -> "dont")."""
+    tokens = []
+    for raw in (text or '').lower().split():
+        token = NON_WORD.sub('', raw)
+        if token:
+            tokens.append(token)
+    return tokens
+
+
+def run_script(conn, script):
+    """Run a multi-statement SQL script one statement at a time.
+
+    Unlike executescript(), this does not COMMIT a transaction the caller
+    already has open.
+    """
+    statement = ''
+    for line in script.splitlines(keepends=True):
+        statement += line
+        if sqlite3.complete_statement(statement):
+            conn.execute(statement)
+            statement = ''
+
+
+def ensure_schema(conn):
+    """Create the tables and triggers; the first time, queue every paragraph.
+
+    word_frequency is then recounted from paragraphs by the first sync().
+    Inside a caller's transaction the changes are left to its commit or
+    rollback.
+    """
+    own_transaction = not conn.in_transaction
+    try:
+        if own_transaction:
+            # One IMMEDIATE transaction so two workers cannot both bootstrap
+            conn.execute("BEGIN IMMEDIATE")
+        run_script(conn, SCHEMA)
+        if not conn.execute("SELECT bootstrapped FROM word_engine_state WHERE id = 1").fetchone()[0]:
+            conn.execute(
+                "INSERT OR IGNORE INTO paragraph_tokens_dirty (paragraph_id) "
+                "SELECT id FROM paragraphs WHERE id IS NOT NULL"
+            )
+            conn.execute("UPDATE word_frequency SET frequency = 0")
+            conn.execute("UPDATE word_engine_state SET bootstrapped = 1 WHERE id = 1")
+        if own_transaction:
+            conn.commit()
+    except BaseException:
+        if own_transaction and conn.in_transaction:
+            conn.rollback()
+        raise
+
+
+class _Vocab:
+    """word <-> id map mirrored from the vocab table."""
+
+    def __init__(self):
+        self.ids = {}
+
+    def load(self, conn):
+        self.ids = {row[1]: row[0] for row in conn.execute("SELECT id, word FROM vocab")}
+
+    def lookup(self, conn, words):
+        """Ids for words, adding unseen ones to vocab (inside the caller's transaction)."""
+        missing = [w for w in dict.fromkeys(words) if w not in self.ids]
+        if missing:
+            conn.executemany("INSERT OR IGNORE INTO vocab (word) VALUES (?)", [(w,) for w in missing])
+            for start in range(0, len(missing), 500):
+                chunk = missing[start:start + 500]
+                for row in conn.execute(
+                    f"SELECT id, word FROM vocab WHERE word IN ({','.join('?' * len(chunk))})", chunk
+                ):
+                    self.ids[row[1]] = row[0]
+        return np.fromiter((self.ids[w] for w in words), dtype=np.uint32, count=len(words))
+
+    def size(self, conn):
+        return (conn.execute("SELECT COALESCE(MAX(id), 0) FROM vocab").fetchone()[0]) + 1
+
+
+def _tokens(blob):
+    return np.frombuffer(blob, dtype=np.uint32)
+
+
+def sync(conn, vocab=None):
+    """Re-tokenize queued paragraphs and apply their count changes to word_frequency.
+
+    Runs in the caller's transaction if one is open (ingest_book.py),
+    otherwise in its own. Returns the set of (book, chapter) touched.
+    """
+    if vocab is None:
+        vocab = _Vocab()
+        vocab.load(conn)
+    own_transaction = not conn.in_transaction
+    if own_transaction:
+        if conn.execute("SELECT 1 FROM paragraph_tokens_dirty LIMIT 1").fetchone() is None:
+            return set()
+        conn.execute("BEGIN IMMEDIATE")
+    try:
+        dirty = [row[0] for row in conn.execute("SELECT paragraph_id FROM paragraph_tokens_dirty").fetchall()]
+        touched = set()
+        old_arrays, new_arrays = [], []
+        for start in range(0, len(dirty), 500):
+            chunk = dirty[start:start + 500]
+            marks = ','.join('?' * len(chunk))
+            for row in conn.execute(
+                f"SELECT book, chapter, tokens FROM paragraph_tokens WHERE paragraph_id IN ({marks})", chunk
+            ):
+                touched.add((row[0], row[1]))
+                old_arrays.append(_tokens(row[2]))
+            conn.execute(f"DELETE FROM paragraph_tokens WHERE paragraph_id IN ({marks})", chunk)
+            rows = []
+            for row in conn.execute(
+                f"SELECT id, book, chapter, content FROM paragraphs WHERE id IN ({marks})", chunk
+            ).fetchall():
+                ids = vocab.lookup(conn, tokenize(row[3]))
+                touched.add((row[1], row[2]))
+                new_arrays.append(ids)
+                rows.append((row[0], row[1], row[2], ids.tobytes()))
+            conn.executemany(
+                "INSERT OR REPLACE INTO paragraph_tokens (paragraph_id, book, chapter, tokens) VALUES (?, ?, ?, ?)",
+                rows
+            )
+            conn.execute(f"DELETE FROM paragraph_tokens_dirty WHERE paragraph_id IN ({marks})", chunk)
+
+        size = vocab.size(conn)
+        delta = np.zeros(size, dtype=np.int64)
+        if new_arrays:
+            delta += np.bincount(np.concatenate(new_arrays), minlength=size)
+        if old_arrays:
+            delta -= np.bincount(np.concatenate(old_arrays), minlength=size)
+        changed = np.flatnonzero(delta)
+        if changed.size:
+            words = {}
+            for start in range(0, changed.size, 500):
+                chunk = changed[start:start + 500].tolist()
+                words.update(conn.execute(
+                    f"SELECT id, word FROM vocab WHERE id IN ({','.join('?' * len(chunk))})", chunk
+                ).fetchall())
+            conn.executemany(
+                "INSERT INTO word_frequency (word, frequency, length, is_known) VALUES (?, ?, ?, 0) "
+                "ON CONFLICT(word) DO UPDATE SET frequency = frequency + excluded.frequency",
+                [(words[i], int(delta[i]), len(words[i])) for i in changed.tolist()]
+            )
+            conn.execute("DELETE FROM word_frequency WHERE frequency <= 0")
+        conn.executemany("INSERT INTO paragraph_tokens_log (book, chapter) VALUES (?, ?)", sorted(
+            touched, key=lambda key: (key[0] or '', key[1] or '')
+        ))
+        conn.execute(
+            "DELETE FROM paragraph_tokens_log WHERE seq <= (SELECT MAX(seq) FROM paragraph_tokens_log) - ?",
+            (LOG_KEEP,)
+        )
+        if own_transaction:
+            conn.commit()
+    except BaseException:
+        if own_transaction:
+            conn.rollback()
+        # Ids added to vocab in the rolled-back transaction are gone again
+        vocab.load(conn)
+        raise
+    return touched
+
+
+def refresh_known_flags(conn):
+    """Set word_frequency.is_known from known_words and words any user marked known."""
+    known = "word IN (SELECT lower(word) FROM known_words)"
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'user_words'").fetchone():
+        known = f"({known} OR word IN (SELECT lower(word) FROM user_words WHERE is_known = 1))"
+    return conn.execute(f"UPDATE word_frequency SET is_known = {known} WHERE is_known IS NOT {known}").rowcount
+
+
+def known_word_ids(words, vocab_ids):
+    """Vocab ids of single-word entries; "a, an" counts as both a and an."""
+    ids = []
+    for entry in words:
+        for variant in re.split(r"[,/]", entry or ''):
+            tokens = tokenize(variant)
+            if len(tokens) == 1 and tokens[0] in vocab_ids:
+                ids.append(vocab_ids[tokens[0]])
+    return np.array(ids, dtype=np.int64)
+
+
+class WordEngine:
+    """Per-worker chapter token arrays and user known-word bitsets."""
+
+    def __init__(self, connect):
+        self._connect = connect
+        self._lock = threading.Lock()
+        self._vocab = _Vocab()
+        self._seq = None
+        self._chapter_arrays = {}   # (book, chapter) -> (first_id, unique ids, counts)
+        self._packed = None
+        self._users = OrderedDict()  # username -> (signature, packed known bits)
+
+    def _refresh(self, conn):
+        """Sync queued paragraphs and reload the chapters changed since the last call."""
+        if conn.execute("SELECT 1 FROM paragraph_tokens_dirty LIMIT 1").fetchone() is not None:
+            sync(conn, self._vocab)
+        seq = conn.execute("SELECT COALESCE(MAX(seq), 0) FROM paragraph_tokens_log").fetchone()[0]
+        if seq == self._seq:
+            return
+        oldest = conn.execute("SELECT MIN(seq) FROM paragraph_tokens_log").fetchone()[0]
+        if self._seq is None or oldest is None or oldest > self._seq + 1:
+            chapters = None   # first load, or the log no longer reaches back far enough
+        else:
+            chapters = {tuple(row) for row in conn.execute(
+                "SELECT DISTINCT book, chapter FROM paragraph_tokens_log WHERE seq > ?", (self._seq,)
+            )}
+        self._vocab.load(conn)
+        self._load_chapters(conn, chapters)
+        self._seq = seq
+
+    def _load_chapters(self, conn, chapters):
+        if chapters is None:
+            self._chapter_arrays = {}
+            rows = conn.execute(
+                "SELECT book, chapter, paragraph_id, tokens FROM paragraph_tokens ORDER BY book, chapter"
+            ).fetchall()
+        else:
+            rows = []
+            for book, chapter in chapters:
+                self._chapter_arrays.pop((book, chapter), None)
+                rows += conn.execute(
+                    "SELECT book, chapter, paragraph_id, tokens FROM paragraph_tokens "
+                    "WHERE book IS ? AND chapter IS ?", (book, chapter)
+                ).fetchall()
+        grouped = {}
+        for book, chapter, paragraph_id, blob in rows:
+            entry = grouped.setdefault((book, chapter), [paragraph_id, []])
+            entry[0] = min(entry[0], paragraph_id)
+            entry[1].append(_tokens(blob))
+        for key, (first_id, arrays) in grouped.items():
+            ids, counts = np.unique(np.concatenate(arrays), return_counts=True)
+            if ids.size:
+                self._chapter_arrays[key] = (first_id, ids.astype(np.int64), counts.astype(np.int64))
+
+        # Reading order, then one concatenated array for all chapters
+        order = sorted(
+            (key for key in self._chapter_arrays if key[0] is not None),
+            key=lambda key: (key[0], self._chapter_arrays[key][0])
+        )
+        if order:
+            ids = [self._chapter_arrays[key][1] for key in order]
+            counts = [self._chapter_arrays[key][2] for key in order]
+            offsets = np.cumsum([0] + [a.size for a in ids[:-1]])
+            self._packed = (order, np.concatenate(ids), np.concatenate(counts), offsets)
+        else:
+            self._packed = None
+
+    def _user_bits(self, conn, username, size):
+        signature = tuple(conn.execute(KNOWN_WORDS_SIGNATURE, (username,)).fetchone()) + (size,)
+        cached = self._users.get(username)
+        if cached is not None and cached[0] == signature:
+            self._users.move_to_end(username)
+            return cached[1]
+        words = [row[0] for row in conn.execute(KNOWN_WORDS_QUERY, (username,))]
+        mask = np.zeros(size, dtype=bool)
+        mask[known_word_ids(words, self._vocab.ids)] = True
+        bits = np.packbits(mask)
+        self._users[username] = (signature, bits)
+        if len(self._users) > MAX_CACHED_USERS:
+            self._users.popitem(last=False)
+        return bits
+
+    def coverage(self, username, book=None):
+        """Per book and chapter: tokens, distinct words, and how many of each the user knows."""
+        conn = self._connect()
+        try:
+            with self._lock:
+                self._refresh(conn)
+                if self._packed is None:
+                    return []
+                order, ids, counts, offsets = self._packed
+                bits = self._user_bits(conn, username, self._vocab.size(conn))
+        finally:
+            conn.close()
+
+        # Bit i of the packed bitset: byte i >> 3, most significant bit first
+        known = (bits[ids >> 3] >> (7 - (ids & 7))) & 1
+        tokens = np.add.reduceat(counts, offsets)
+        known_tokens = np.add.reduceat(counts * known, offsets)
+        types = np.add.reduceat(np.ones_like(ids), offsets)
+        known_types = np.add.reduceat(known.astype(np.int64), offsets)
+
+        books = {}
+        for i, (book_name, chapter) in enumerate(order):
+            if book is not None and book_name != book:
+                continue
+            entry = books.setdefault(book_name, {'book': book_name, 'tokens': 0, 'known_tokens': 0, 'chapters': []})
+            entry['tokens'] += int(tokens[i])
+            entry['known_tokens'] += int(known_tokens[i])
+            entry['chapters'].append({
+                'chapter': chapter,
+                'tokens': int(tokens[i]),
+                'known_tokens': int(known_tokens[i]),
+                'coverage': round(float(known_tokens[i]) / float(tokens[i]), 4),
+                'words': int(types[i]),
+                'known_words': int(known_types[i]),
+            })
+        for entry in books.values():
+            entry['coverage'] = round(entry['known_tokens'] / entry['tokens'], 4) if entry['tokens'] else 0.0
+        return list(books.values())
+
+    def stats(self):
+        with self._lock:
+            packed = self._packed
+            return {
+                'vocab': len(self._vocab.ids),
+                'chapters': len(packed[0]) if packed else 0,
+                'chapter_word_entries': int(packed[1].size) if packed else 0,
+                'cached_users': len(self._users),
+                'log_seq': self._seq,
+            }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Word frequency engine maintenance")
+    parser.add_argument("command", choices=["sync"])
+    parser.add_argument("--db", default=os.environ.get(
+        "FGL_DB_PATH", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "masterfgl.db")
+    ))
+    args = parser.parse_args()
+    conn = sqlite3.connect(args.db, timeout=30)
+    try:
+        ensure_schema(conn)
+        touched = sync(conn)
+        refresh_known_flags(conn)
+        conn.commit()
+    finally:
+        conn.close()
+    print(f"Synced {len(touched)} chapters")
+
+
+if __name__ == "__main__":
+    main()